@@ -3,67 +3,122 @@ DuoUmiWild - Latent Ratio Selector Node
 Selects latent image ratios with optional randomization.
 """
 
+import os
+import math
 import random
+import yaml
 import torch
 
 
+PRESETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ratio_presets.yaml")
+
+
+def budget_resolution(ratio, megapixels=1.0, alignment=64):
+    """
+    Size an aspect ratio to a pixel budget, aligned for the latent space.
+
+    Args:
+        ratio: Ratio string like "16:9" or "2.35:1"
+        megapixels: Pixel budget in megapixels (1.0 = 1024x1024)
+        alignment: Width and height are rounded to multiples of this
+
+    Returns:
+        tuple: (width, height)
+    """
+    ratio_w, ratio_h = (float(part) for part in str(ratio).split(':'))
+    aspect = ratio_w / ratio_h
+    pixels = megapixels * 1024 * 1024
+    width = max(alignment, round(math.sqrt(pixels * aspect) / alignment) * alignment)
+    height = max(alignment, round(math.sqrt(pixels / aspect) / alignment) * alignment)
+    return width, height
+
+
+def load_ratio_presets(path=PRESETS_FILE):
+    """
+    Load the ratio preset table and build its lookup structures.
+
+    Args:
+        path: YAML (or JSON) preset file
+
+    Returns:
+        dict: 'presets' (name -> (width, height)), 'categories' (category -> names),
+            'aliases' (lowercase alias -> name) and 'draws' (randomize option ->
+            (names, cumulative weights, or None when all weights are equal))
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+
+    megapixels = data.get('megapixels', 1.0)
+    alignment = data.get('alignment', 64)
+    presets = {}
+    weights = {}
+    categories = {category: [] for category in data.get('categories', [])}
+    aliases = {}
+
+    for entry in data.get('presets', []):
+        if 'width' in entry and 'height' in entry:
+            width, height = int(entry['width']), int(entry['height'])
+            name = entry['name']
+        else:
+            width, height = budget_resolution(entry['ratio'], entry.get('megapixels', megapixels), alignment)
+            name = f"{entry['name']} - {width}x{height}"
+
+        presets[name] = (width, height)
+        weights[name] = entry.get('weight', 1)
+        categories.setdefault(entry.get('category', 'other'), []).append(name)
+
+        ratio_aliases = [entry['ratio']] if 'ratio' in entry else []
+        for alias in [name, name.split(' ')[0], f"{width}x{height}"] + ratio_aliases + entry.get('aliases', []):
+            aliases.setdefault(str(alias).lower(), name)
+
+    def draw_table(names):
+        names_weights = [weights[name] for name in names]
+        if len(set(names_weights)) <= 1:
+            return names, None
+        cumulative = []
+        total = 0
+        for weight in names_weights:
+            total += weight
+            cumulative.append(total)
+        return names, cumulative
+
+    draws = {"All": draw_table(list(presets.keys()))}
+    for category, names in categories.items():
+        if names:
+            draws[f"{category.title()} Only"] = draw_table(names)
+
+    return {'presets': presets, 'categories': categories, 'aliases': aliases, 'draws': draws}
+
+
+RATIO_TABLE = load_ratio_presets()
+
+
 class LatentRatioSelector:
     """
     A node that creates empty latent images with predefined aspect ratios.
     Supports manual selection or random selection from ratios.
     """
 
-    # All available ratios with their resolutions
-    ratio_presets = {
-        # Portrait Ratios
-        '2:3 Portrait - 832x1248': (832, 1248),
-        '3:4 Standard Portrait - 880x1176': (880, 1176),
-        '4:5 Large Format Portrait - 912x1144': (912, 1144),
-        '9:16 Selfie & Social Media - 768x1360': (768, 1360),
-
-        # Square
-        '1:1 Square - 1024x1024': (1024, 1024),
-
-        # Landscape Ratios
-        '4:3 SD TV - 1176x880': (1176, 880),
-        '1.43:1 IMAX - 1224x856': (1224, 856),
-        '1.66:1 European Widescreen - 1312x792': (1312, 792),
-        '16:9 Widescreen HD TV - 1360x768': (1360, 768),
-        '1.85:1 Standard Widescreen - 1392x752': (1392, 752),
-        '2.35:1 Cinemascope - 1568x664': (1568, 664),
-        '2.39:1 Anamorphic Widescreen - 1576x656': (1576, 656),
-        '1.618:1 Golden Ratio - 1296x800': (1296, 800),
-
-        # Additional Common Ratios
-        '3:2 Landscape - 1216x832': (1216, 832),
-        '21:9 Ultrawide - 1536x640': (1536, 640),
-    }
-
-    # Group ratios by category for easier random selection
-    portrait_ratios = [
-        '2:3 Portrait - 832x1248',
-        '3:4 Standard Portrait - 880x1176',
-        '4:5 Large Format Portrait - 912x1144',
-        '9:16 Selfie & Social Media - 768x1360',
-    ]
-
-    landscape_ratios = [
-        '4:3 SD TV - 1176x880',
-        '1.43:1 IMAX - 1224x856',
-        '1.66:1 European Widescreen - 1312x792',
-        '16:9 Widescreen HD TV - 1360x768',
-        '1.85:1 Standard Widescreen - 1392x752',
-        '2.35:1 Cinemascope - 1568x664',
-        '2.39:1 Anamorphic Widescreen - 1576x656',
-        '1.618:1 Golden Ratio - 1296x800',
-        '3:2 Landscape - 1216x832',
-        '21:9 Ultrawide - 1536x640',
-    ]
-
-    square_ratios = ['1:1 Square - 1024x1024']
+    # Presets, category indexes and alias table, loaded once from ratio_presets.yaml
+    ratio_presets = RATIO_TABLE['presets']
+    portrait_ratios = RATIO_TABLE['categories'].get('portrait', [])
+    landscape_ratios = RATIO_TABLE['categories'].get('landscape', [])
+    square_ratios = RATIO_TABLE['categories'].get('square', [])
+    ratio_aliases = RATIO_TABLE['aliases']
+    ratio_draws = RATIO_TABLE['draws']
+    randomize_options = list(RATIO_TABLE['draws'].keys())
 
     all_ratios_list = list(ratio_presets.keys())
 
+    latent_dtypes = {
+        "float32": torch.float32,
+        "float16": torch.float16,
+        "bfloat16": torch.bfloat16,
+    }
+
+    # Shared all-zero latents: (width, height, dtype, device, pinned) -> (tensor, version)
+    zero_latents = {}
+
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -80,7 +135,7 @@ class LatentRatioSelector:
                     "default": "No",
                     "tooltip": "Randomly select from all ratios (ignores ratio_selected)"
                 }),
-                "randomize_from": (["All", "Portrait Only", "Landscape Only", "Square Only"], {
+                "randomize_from": (cls.randomize_options, {
                     "default": "All",
                     "tooltip": "When randomize is Yes, select from this category"
                 }),
@@ -91,6 +146,27 @@ class LatentRatioSelector:
                     "tooltip": "Seed for random ratio selection (when randomize is Yes)"
                 }),
             },
+            "optional": {
+                "ratio_lookup": ("STRING", {
+                    "default": "",
+                    "tooltip": "Preset name, ratio (16:9), resolution (1360x768) or alias from ratio_presets.yaml; when set, used instead of ratio_selected"
+                }),
+                "reuse_latent": (["No", "Yes"], {
+                    "default": "No",
+                    "tooltip": "No: allocate a new tensor every time. Yes: return a read-only view of a cached zero latent shared by all runs (no allocation per run); only safe when no downstream node writes into the latent in place."
+                }),
+                "dtype": (list(cls.latent_dtypes.keys()), {
+                    "default": "float32"
+                }),
+                "device": (["cpu", "cuda"], {
+                    "default": "cpu",
+                    "tooltip": "Where to create the latent (cuda falls back to cpu when unavailable)"
+                }),
+                "pin_memory": (["No", "Yes"], {
+                    "default": "No",
+                    "tooltip": "Use pinned host memory for faster transfer to the GPU (cpu device only)"
+                }),
+            },
         }
 
     RETURN_TYPES = ("LATENT", "STRING", "INT", "INT")
@@ -98,7 +174,84 @@ class LatentRatioSelector:
     FUNCTION = "generate"
     CATEGORY = "DuoUmiWild"
 
-    def generate(self, ratio_selected, batch_size=1, randomize="No", randomize_from="All", seed=0):
+    @classmethod
+    def draw_ratio(cls, randomize_from):
+        """
+        Draw a ratio key from a randomize_from category, honoring preset weights.
+
+        Args:
+            randomize_from: "All" or "<Category> Only"
+
+        Returns:
+            str: Ratio key
+        """
+        names, cumulative = cls.ratio_draws.get(randomize_from, cls.ratio_draws["All"])
+        if cumulative is None:
+            return random.choice(names)
+        return random.choices(names, cum_weights=cumulative)[0]
+
+    @classmethod
+    def lookup_ratio(cls, name):
+        """
+        Resolve a preset name, ratio, resolution or alias to a ratio key.
+
+        Args:
+            name: Text as typed, case-insensitive ("16:9", "1024x1024", ...)
+
+        Returns:
+            str: Ratio key, or None when nothing matches
+        """
+        return cls.ratio_aliases.get(name.strip().lower())
+
+    @classmethod
+    def latent_options(cls, dtype="float32", device="cpu", pin_memory="No"):
+        """
+        Resolve the optional latent inputs.
+
+        Returns:
+            tuple: (torch dtype, device, pinned)
+        """
+        torch_dtype = cls.latent_dtypes.get(dtype, torch.float32)
+        if device == "cuda" and not torch.cuda.is_available():
+            print("DuoUmiWild: CUDA not available, creating latent on cpu")
+            device = "cpu"
+        pinned = pin_memory == "Yes" and device == "cpu" and torch.cuda.is_available()
+        return torch_dtype, device, pinned
+
+    @classmethod
+    def zero_latent(cls, width, height, batch_size, dtype=torch.float32, device="cpu", pin_memory=False):
+        """
+        Return an all-zero latent batch backed by one cached sample.
+
+        The batch is an expand() view of a tensor shared by every caller, so no
+        memory is allocated or cleared per call, and it must be treated as
+        read-only: only used when reuse_latent is "Yes". Writing in place to a
+        view with batch_size > 1 raises in torch; a single-sample view that was
+        written to bumps the shared version counter, and the cached tensor is
+        then replaced for later calls (the earlier ones already saw the write).
+
+        Args:
+            width: Image width in pixels
+            height: Image height in pixels
+            batch_size: Number of latent images in batch
+            dtype: Tensor dtype
+            device: Tensor device
+            pin_memory: Whether to use pinned host memory
+
+        Returns:
+            torch.Tensor: [batch_size, 4, height // 8, width // 8] zeros
+        """
+        key = (width, height, dtype, device, pin_memory)
+        cached = cls.zero_latents.get(key)
+        if cached is None or cached[0]._version != cached[1]:
+            latent = torch.zeros([1, 4, height // 8, width // 8], dtype=dtype, device=device,
+                                 pin_memory=pin_memory)
+            cached = (latent, latent._version)
+            cls.zero_latents[key] = cached
+        return cached[0].expand(batch_size, -1, -1, -1)
+
+    def generate(self, ratio_selected, batch_size=1, randomize="No", randomize_from="All", seed=0,
+                 ratio_lookup="", reuse_latent="No", dtype="float32", device="cpu", pin_memory="No"):
         """
         Generate an empty latent image with the specified or random ratio.
 
@@ -108,6 +261,11 @@ class LatentRatioSelector:
             randomize: Whether to randomly select a ratio
             randomize_from: Which category to randomize from
             seed: Seed for randomization
+            ratio_lookup: Preset name, ratio, resolution or alias overriding ratio_selected
+            reuse_latent: Whether to return a view of a cached zero latent
+            dtype: Latent dtype name
+            device: "cpu" or "cuda"
+            pin_memory: Whether to pin the (cpu) latent in host memory
 
         Returns:
             tuple: (latent dict, ratio string, width, height)
@@ -115,32 +273,115 @@ class LatentRatioSelector:
         # Determine which ratio to use
         if randomize == "Yes":
             random.seed(seed)
-
-            if randomize_from == "Portrait Only":
-                ratio_key = random.choice(self.portrait_ratios)
-            elif randomize_from == "Landscape Only":
-                ratio_key = random.choice(self.landscape_ratios)
-            elif randomize_from == "Square Only":
-                ratio_key = random.choice(self.square_ratios)
-            else:  # "All"
-                ratio_key = random.choice(self.all_ratios_list)
+            ratio_key = self.draw_ratio(randomize_from)
         else:
             ratio_key = ratio_selected
+            if ratio_lookup and ratio_lookup.strip():
+                ratio_key = self.lookup_ratio(ratio_lookup)
+                if ratio_key is None:
+                    print(f'DuoUmiWild: Unknown ratio "{ratio_lookup}", using {ratio_selected}')
+                    ratio_key = ratio_selected
 
         # Get the resolution
         width, height = self.ratio_presets[ratio_key]
 
         # Create empty latent tensor
-        latent = torch.zeros([batch_size, 4, height // 8, width // 8])
+        torch_dtype, device, pinned = self.latent_options(dtype, device, pin_memory)
+
+        if reuse_latent == "Yes":
+            latent = self.zero_latent(width, height, batch_size, torch_dtype, device, pinned)
+        else:
+            latent = torch.zeros([batch_size, 4, height // 8, width // 8], dtype=torch_dtype,
+                                 device=device, pin_memory=pinned)
 
         return ({"samples": latent}, ratio_key, width, height)
 
 
+class LatentRatioBuckets(LatentRatioSelector):
+    """
+    A node that draws a random ratio for every sample of a batch and groups the
+    samples into one latent batch per resolution, so sampling stays batched
+    while the batch covers many aspect ratios.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "batch_size": ("INT", {
+                    "default": 8,
+                    "min": 1,
+                    "max": 4096,
+                    "tooltip": "Total number of samples, spread over the buckets"
+                }),
+                "randomize_from": (cls.randomize_options, {
+                    "default": "All",
+                    "tooltip": "Category each sample's ratio is drawn from"
+                }),
+                "seed": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 0xffffffffffffffff,
+                    "tooltip": "Seed for the per-sample ratio draws"
+                }),
+            },
+            "optional": {name: spec for name, spec in LatentRatioSelector.INPUT_TYPES()["optional"].items()
+                         if name != "ratio_lookup"},
+        }
+
+    RETURN_TYPES = ("LATENT", "STRING", "INT", "INT", "INT")
+    RETURN_NAMES = ("latents", "ratios_used", "widths", "heights", "counts")
+    OUTPUT_IS_LIST = (True, True, True, True, True)
+    FUNCTION = "generate_buckets"
+
+    def generate_buckets(self, batch_size=8, randomize_from="All", seed=0,
+                         reuse_latent="No", dtype="float32", device="cpu", pin_memory="No"):
+        """
+        Draw one ratio per sample and emit one latent batch per drawn ratio.
+
+        Args:
+            batch_size: Total number of samples
+            randomize_from: Which category to draw from
+            seed: Seed for randomization
+            reuse_latent: Whether to return views of cached zero latents
+            dtype: Latent dtype name
+            device: "cpu" or "cuda"
+            pin_memory: Whether to pin the (cpu) latents in host memory
+
+        Returns:
+            tuple: Lists of (latent dict, ratio string, width, height, sample count),
+                one item per bucket in the order the ratios were first drawn
+        """
+        random.seed(seed)
+        buckets = {}
+        for _ in range(batch_size):
+            ratio_key = self.draw_ratio(randomize_from)
+            buckets[ratio_key] = buckets.get(ratio_key, 0) + 1
+
+        torch_dtype, device, pinned = self.latent_options(dtype, device, pin_memory)
+        latents, widths, heights, counts = [], [], [], []
+        for ratio_key, count in buckets.items():
+            width, height = self.ratio_presets[ratio_key]
+            if reuse_latent == "Yes":
+                latent = self.zero_latent(width, height, count, torch_dtype, device, pinned)
+            else:
+                latent = torch.zeros([count, 4, height // 8, width // 8], dtype=torch_dtype,
+                                     device=device, pin_memory=pinned)
+            latents.append({"samples": latent})
+            widths.append(width)
+            heights.append(height)
+            counts.append(count)
+
+        return (latents, list(buckets.keys()), widths, heights, counts)
+
+
 # Node registration for ComfyUI
 NODE_CLASS_MAPPINGS = {
-    "DuoUmiRatioSelector": LatentRatioSelector
+    "DuoUmiRatioSelector": LatentRatioSelector,
+    "DuoUmiRatioBuckets": LatentRatioBuckets
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "DuoUmiRatioSelector": "Latent Ratio Selector"
+    "DuoUmiRatioSelector": "Latent Ratio Selector",
+    "DuoUmiRatioBuckets": "Latent Ratio Buckets"
 }
@@ -0,0 +1,229 @@
+"""
+DuoUmiWild - Bulk Prompt Generation
+Generates prompts for many seeds at once with vectorized NumPy draws.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for bulk generation
+    np = None
+
+try:
+    from .wildcard_template import PickPart, TextPart, WildcardPart, clean_prompt, effective_weights
+except ImportError:  # loaded outside the package
+    from wildcard_template import PickPart, TextPart, WildcardPart, clean_prompt, effective_weights
+
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(value):
+    """SplitMix64 finalizer on a Python int."""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & MASK64
+    return value ^ (value >> 31)
+
+
+def child_stream(stream, position):
+    """Derive the counter stream of a sub-part from its parent's stream."""
+    return splitmix64((stream * 0x9e3779b97f4a7c15 + position + 1) & MASK64)
+
+
+def mix64(values):
+    """SplitMix64 finalizer on a uint64 array."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def uniforms(keys, stream):
+    """
+    One uniform [0, 1) draw per prompt from a counter-based stream.
+
+    Args:
+        keys: uint64 array of per-prompt keys
+        stream: Stream id (Python int) of the draw
+
+    Returns:
+        numpy.ndarray: float64 draws, one per key
+    """
+    bits = mix64(keys ^ np.uint64(stream))
+    return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+class BulkPromptGenerator:
+    """
+    Generate prompts for thousands of seeds with one vectorized draw per choice point.
+
+    Works on the template parts of a PromptEnumerator: every `{}` group and
+    `__file__` reference draws the option of all prompts that reach it in a
+    single NumPy call, then the strings are assembled column-wise.
+
+    Relation to the scalar engines:
+    - Each choice point follows the same distribution as DynamicPromptReplacer
+      (weights, `x-y$$` ranges drawn without replacement) and uniform line
+      picks for wildcard files, like TagSelector/WildcardNode. TagSelector's
+      preference for lines not yet used in the same prompt is not modeled.
+    - The strings are NOT those `random.seed(seed)` gives on the scalar path:
+      draws come from a counter-based hash of (seed, choice point), so prompt i
+      depends only on seeds[i], the template and the library, whatever the
+      batch size or order.
+    - YAML queries and seeded `#n$$` groups are left in place, as in
+      PromptEnumerator; pass the results through the scalar engine to resolve
+      them.
+    """
+
+    # Largest (prompts x options) matrix built at once for weighted range picks
+    chunk_cells = 4000000
+
+    def __init__(self, enumerator):
+        if np is None:
+            raise ImportError("DuoUmiWild: bulk prompt generation needs numpy")
+        self.enumerator = enumerator
+        self.plans = {}
+
+    def generate(self, template, seeds, clean=True):
+        """
+        Generate one prompt per seed.
+
+        Args:
+            template: Template text
+            seeds: Iterable of integer seeds
+            clean: Apply the engines' comma and whitespace cleanup
+
+        Returns:
+            list: Prompts, in the order of seeds
+        """
+        parts = self.enumerator.compile(template)
+        seeds = np.fromiter((int(seed) & MASK64 for seed in seeds), dtype=np.uint64)
+        if not len(seeds):
+            return []
+        keys = mix64(seeds)
+        prompts = self.fill_parts(parts, keys, 0).tolist()
+        if clean:
+            return [clean_prompt(prompt) for prompt in prompts]
+        return prompts
+
+    def fill_parts(self, parts, keys, stream):
+        out = np.full(len(keys), '', dtype=object)
+        for position, part in enumerate(parts):
+            out = out + self.fill_part(part, keys, child_stream(stream, position))
+        return out
+
+    def fill_part(self, part, keys, stream):
+        """Return the text of a part for every key (a str when it is the same for all)."""
+        if isinstance(part, TextPart):
+            return part.text
+        if isinstance(part, WildcardPart):
+            if part.target is None:
+                return part.raw
+            return self.fill_part(part.target, keys, stream)
+        if part.range_based:
+            return self.fill_range(part, keys, stream)
+
+        literals, cumulative = self.plan(part)
+        if cumulative is None:
+            return ''
+        choice = np.searchsorted(cumulative, uniforms(keys, stream) * cumulative[-1], side='right')
+        np.minimum(choice, len(part.options) - 1, out=choice)
+        out = literals[choice]
+        self.fill_options(part, keys, stream, choice, out)
+        return out
+
+    def fill_options(self, part, keys, stream, choice, out):
+        """Expand the options that are not plain text, one group of keys per option."""
+        order = np.argsort(choice, kind='stable')
+        options, starts, counts = np.unique(choice[order], return_index=True, return_counts=True)
+        for option, start, count in zip(options.tolist(), starts.tolist(), counts.tolist()):
+            if self.is_literal(part.options[option]):
+                continue
+            rows = order[start:start + count]
+            out[rows] = self.fill_parts(part.options[option], keys[rows], child_stream(stream, option + 1))
+
+    def fill_range(self, part, keys, stream):
+        count = len(part.options)
+        if part.high == 0 or not count:
+            return ''
+        literals, _ = self.plan(part)
+        weights = np.array([float(weight) for weight in effective_weights(part)])
+        sizes = part.low + np.floor(uniforms(keys, stream) * (part.high - part.low + 1)).astype(np.int64)
+        np.minimum(sizes, part.high, out=sizes)
+        chosen = self.draw_without_replacement(keys, stream, weights, part.high)
+
+        # texts[:, slot] is the option drawn in that slot, or '' past the row's size
+        texts = np.full((len(keys), part.high), '', dtype=object)
+        for slot in range(part.high):
+            active = (slot < sizes) & (chosen[:, slot] >= 0)
+            if not active.any():
+                continue
+            rows = np.nonzero(active)[0]
+            choice = chosen[rows, slot]
+            column = literals[choice]
+            self.fill_options(part, keys[rows], stream, choice, column)
+            texts[rows, slot] = column
+
+        out = np.empty(len(keys), dtype=object)
+        for row, row_texts in enumerate(texts.tolist()):
+            picked = [text for text in row_texts if text.strip()]
+            out[row] = ", ".join(picked) + (", " if picked else "")
+        return out
+
+    def draw_without_replacement(self, keys, stream, weights, draws):
+        """
+        Draw options without replacement, like repeated random.choices calls.
+
+        Args:
+            keys: uint64 array of per-prompt keys
+            stream: Stream id of the choice point
+            weights: float64 option weights
+            draws: Number of draws per prompt
+
+        Returns:
+            numpy.ndarray: (len(keys), draws) option indexes in draw order, -1
+                where no option with a positive weight was left
+        """
+        count = len(weights)
+        draws = min(draws, count)
+        if np.all(weights == weights[0]) and weights[0] > 0:
+            # Uniform: draw a rank among the remaining options, then skip past
+            # the options already taken (in ascending order)
+            chosen = np.empty((len(keys), draws), dtype=np.int64)
+            for slot in range(draws):
+                pick = np.floor(uniforms(keys, child_stream(stream, -slot - 1)) * (count - slot)).astype(np.int64)
+                if slot:
+                    for taken in np.sort(chosen[:, :slot], axis=1).T:
+                        pick += pick >= taken
+                chosen[:, slot] = pick
+            return chosen
+
+        # Weighted: Efraimidis-Spirakis keys u ** (1 / w), largest first
+        option_streams = np.array([child_stream(stream, -option - 1) for option in range(count)], dtype=np.uint64)
+        inverse = np.divide(1.0, weights, out=np.zeros_like(weights), where=weights > 0)
+        chosen = np.empty((len(keys), draws), dtype=np.int64)
+        step = max(1, self.chunk_cells // count)
+        for start in range(0, len(keys), step):
+            block = keys[start:start + step]
+            bits = mix64(block[:, None] ^ option_streams[None, :])
+            draws_u = ((bits >> np.uint64(11)).astype(np.float64) + 0.5) * (1.0 / (1 << 53))
+            scores = np.where(weights > 0, np.log(draws_u) * inverse, -np.inf)
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :draws]
+            order[np.take_along_axis(scores, order, axis=1) == -np.inf] = -1
+            chosen[start:start + step] = order
+        return chosen
+
+    def plan(self, part):
+        """Cache a pick's plain-text options and cumulative weights."""
+        plan = self.plans.get(id(part))
+        if plan is None:
+            literals = np.empty(len(part.options), dtype=object)
+            for index, option in enumerate(part.options):
+                literals[index] = ''.join(p.text for p in option) if self.is_literal(option) else ''
+            weights = [float(weight) for weight in effective_weights(part)]
+            cumulative = np.cumsum(weights) if sum(weights) > 0 else None
+            plan = (literals, cumulative)
+            self.plans[id(part)] = plan
+        return plan
+
+    @staticmethod
+    def is_literal(option):
+        return all(isinstance(p, TextPart) for p in option)
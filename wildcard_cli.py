@@ -0,0 +1,223 @@
+"""
+DuoUmiWild - Command Line Prompt Generator
+Generates prompts from the wildcards library without a running UI, using the
+same engine as the A1111 script, and streams them to stdout or a JSONL file.
+
+Usage:
+    python wildcard_cli.py "a {red|blue} __subject__" --seed 1000 --count 50
+    python wildcard_cli.py --templates-file templates.txt --count 10 --format jsonl -o prompts.jsonl --workers 4
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+
+try:
+    from .wildcard_lines import LinePool
+    from .wildcard_recursive import PromptGenerator, TagLoader
+    from .wildcard_profile import ProfileCapture
+except ImportError:  # run as a script
+    from wildcard_lines import LinePool
+    from wildcard_recursive import PromptGenerator, TagLoader
+    from wildcard_profile import ProfileCapture
+
+
+DEFAULT_WILDCARDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wildcards")
+
+# Generator of the current (worker) process, created by init_worker
+_generator = None
+
+
+def init_worker(wildcards, options):
+    """Load the library once per process."""
+    global _generator
+    TagLoader.wildcard_location = wildcards
+    TagLoader.files.clear()
+    TagLoader.loaded_tags.clear()
+    TagLoader.loaded_paths.clear()
+    TagLoader.line_pool = LinePool()
+    # Engine diagnostics go to stderr, so they never end up in the output stream
+    with contextlib.redirect_stdout(sys.stderr):
+        _generator = PromptGenerator(options)
+
+
+def clean_negative(negative):
+    """Apply the A1111 script's cleanup to a negative prompt."""
+    negative = re.sub(r',\s*,', ',', negative)  # Remove double commas
+    negative = re.sub(r',\s*$', '', negative)   # Remove trailing commas
+    negative = re.sub(r'^\s*,\s*', '', negative) # Remove leading commas
+    return re.sub(r'\s+', ' ', negative)         # Normalize whitespace
+
+
+def generate_record(job):
+    """
+    Generate the prompt, negative prompt and settings of one (template, seed) job.
+
+    Every prompt starts from a fresh selection state, so a record only depends
+    on its template, seed, base negative prompt and the library, not on which
+    worker produced it or what came before.
+
+    Args:
+        job: (template index, template, seed, base negative prompt) tuple
+
+    Returns:
+        dict: JSON-serializable record
+    """
+    index, template, seed, base_negative = job
+    generator = _generator
+    generator.tag_selector.used_values.clear()
+    generator.tag_selector.previously_selected_tags.clear()
+    generator.negative_tag_generator.reset()
+    generator.settings_generator.setting_overrides = {}
+    random.seed(seed)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        prompt = generator.generate_single_prompt(template)
+        negative_tags = generator.get_negative_tags()
+
+    negative = base_negative
+    if negative_tags.strip():
+        negative += (", " if negative.strip() else "") + negative_tags
+
+    return {
+        'template': index,
+        'seed': seed,
+        'prompt': prompt,
+        'negative_prompt': clean_negative(negative),
+        'settings': dict(generator.get_setting_overrides()),
+    }
+
+
+def iter_templates(args):
+    """Yield the templates given on the command line, then those of the templates file."""
+    for template in args.template:
+        yield template
+    if args.templates_file:
+        with (sys.stdin if args.templates_file == '-' else open(args.templates_file, 'r', encoding='utf-8')) as file:
+            for line in file:
+                line = line.rstrip('\r\n')
+                if line.strip():
+                    yield line
+
+
+def iter_jobs(templates, seed, count, base_negative):
+    """Yield one job per template and seed, seeds seed..seed+count-1 for each template."""
+    for index, template in enumerate(templates):
+        for offset in range(count):
+            yield (index, template, seed + offset, base_negative)
+
+
+def generate_records(jobs, wildcards, options, workers=1, chunksize=16, profile=None):
+    """
+    Generate records for a stream of jobs, in job order.
+
+    Args:
+        jobs: Iterable of jobs (see generate_record)
+        wildcards: Wildcard directory
+        options: PromptGenerator options
+        workers: Number of processes; 1 generates in this process
+        chunksize: Jobs handed to a worker at a time
+        profile: Optional ProfileCapture covering the library load and all
+            jobs; generation then runs in this process whatever `workers` is
+
+    Yields:
+        dict: One record per job
+    """
+    if profile is not None:
+        with profile:
+            yield from generate_records(jobs, wildcards, options, 1, chunksize)
+        return
+
+    if workers <= 1:
+        init_worker(wildcards, options)
+        for job in jobs:
+            yield generate_record(job)
+        return
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(wildcards, options)) as pool:
+        yield from pool.imap(generate_record, jobs, chunksize)
+
+
+def write_records(records, output, output_format):
+    """Write records as they are produced, flushing after each one."""
+    written = 0
+    for record in records:
+        if output_format == 'jsonl':
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            output.write(record['prompt'] + "\n")
+        output.flush()
+        written += 1
+    return written
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate prompts from a wildcards library without a UI.")
+    parser.add_argument('template', nargs='*', help="Prompt template(s)")
+    parser.add_argument('-f', '--templates-file',
+                        help="File with one template per line ('-' for stdin)")
+    parser.add_argument('-s', '--seed', type=int, default=0, help="First seed (default: 0)")
+    parser.add_argument('-n', '--count', type=int, default=1, help="Prompts per template (default: 1)")
+    parser.add_argument('-w', '--wildcards', default=DEFAULT_WILDCARDS,
+                        help="Wildcard directory (default: the wildcards folder next to this file)")
+    parser.add_argument('--negative', default="", help="Base negative prompt")
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help="text: one prompt per line; jsonl: prompt, negative prompt and settings per line")
+    parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument('--no-cache', action='store_true', help="Re-read wildcard files for every prompt")
+    parser.add_argument('--lazy-yaml', action='store_true',
+                        help="Load YAML titles and tags only, and entry bodies on first use "
+                             "(also on with DUOUMIWILD_LAZY_YAML=1)")
+    parser.add_argument('--verbose', action='store_true', help="Print engine diagnostics to stderr")
+    parser.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                        help="Profile the run in one process and write a .pstats file and a summary to DIR "
+                             "(default: the profiles folder, or DUOUMIWILD_PROFILE_DIR)")
+    parser.add_argument('--profile-memory', action='store_true', help="With --profile, also trace memory allocations")
+    parser.add_argument('--profile-top', type=int, default=25, metavar='N',
+                        help="Functions and allocation sites in the profile summary (default: 25)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.template and not args.templates_file:
+        build_parser().error("give a template or --templates-file")
+    if not os.path.isdir(args.wildcards):
+        print(f"DuoUmiWild: Wildcard directory not found: {args.wildcards}", file=sys.stderr)
+        return 1
+
+    options = {
+        'verbose': args.verbose,
+        'cache_files': not args.no_cache,
+    }
+    if args.lazy_yaml:
+        options['lazy_yaml'] = True
+    profile = None
+    if args.profile is not None:
+        profile = ProfileCapture('cli', args.profile or None, args.profile_memory, args.profile_top)
+    jobs = iter_jobs(iter_templates(args), args.seed, args.count, args.negative)
+    records = generate_records(jobs, os.path.abspath(args.wildcards), options, args.workers, profile=profile)
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        write_records(records, output, args.format)
+    except BrokenPipeError:
+        # Output closed early (e.g. piped into head): silence the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
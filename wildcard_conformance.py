@@ -0,0 +1,547 @@
+"""
+DuoUmiWild - Conformance Checks
+Checks that the engines still generate what they should, without ComfyUI or
+the WebUI:
+
+- golden: the prompts of a template corpus for fixed seeds, in both engines,
+  compared exactly with a snapshot (wildcard_golden.json) of a known good tree
+- long-run: more prompts of one tag than the A1111 engine's loop guard
+  allows per prompt (50000 hits), through wildcard_cli and the prompt
+  service, none left unresolved
+- distribution: large samples of single choice points, compared by chi-square
+  tests with exact rates (TemplateAnalyzer for {} groups and files, a plain
+  scan of the entries for YAML tag queries) and, optionally, with the same
+  choice points sampled from a reference checkout of this repository
+
+    python wildcard_conformance.py golden              # exit status 1 on any difference
+    python wildcard_conformance.py golden --update     # after an intended output change
+    python wildcard_conformance.py distribution --reference /path/to/older/checkout
+    python wildcard_conformance.py long-run
+
+An optimization that keeps every seed's output passes both; one that draws
+differently (a new random stream) fails golden, and passes distribution only
+if every option keeps its odds.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+from collections import Counter
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WILDCARDS = os.path.join(HERE, "wildcards")
+GOLDEN_FILE = os.path.join(HERE, "wildcard_golden.json")
+ENGINES = ('node', 'a1111')
+
+# Templates of the golden snapshot: every kind of marker, alone and nested
+GOLDEN_TEMPLATES = [
+    "a {red|green|blue} dress",
+    "{2$$a|b|c|d}",
+    "{1-3$$__colors__|__mood__|__lighting__}",
+    "{25%red|blue}",
+    "__colors__, __mood__ __lighting__",
+    "__1-2$$colors__",
+    "__characters/heroes__ vs __villains__",
+    "__nested_example__",
+    "<[hat]>",
+    "<[hat][headwear]>",
+    "<[hat|headwear]>",
+    "<[hat][--female]>",
+    "<example_yaml:[hat]>, <[headwear]> __heroes__",
+    "a-size woman",
+    "__#1$$colors__ and __#1$$colors__",
+    "photo **blurry, lowres** @@width=768, steps=30@@",
+    "{__colors__|__mood__} {a|b}, __posesw__ <[female]>",
+]
+GOLDEN_SEEDS = list(range(24))
+
+# Choice points of the distribution tests: (template, engines, model), where
+# model is how the exact rates are known ('analyzer' or 'tags'; None: only
+# against a reference checkout)
+CHOICE_POINTS = [
+    ("{red|green|blue}", ENGINES, 'analyzer'),
+    ("{25%red|green|blue}", ('a1111',), 'analyzer'),
+    ("__colors__", ENGINES, 'analyzer'),
+    ("__characters/heroes__", ENGINES, 'analyzer'),
+    ("{1-2$$red|green|blue}", ENGINES, None),
+    ("{__colors__|__mood__}", ENGINES, None),
+    ("<[hat]>", ENGINES, 'tags'),
+    ("<[breast size]>", ENGINES, 'tags'),
+    ("<[breast size][huge]>", ENGINES, 'tags'),
+    ("<[huge|hat]>", ENGINES, 'tags'),
+    ("<example_yaml:[hat]>", ENGINES, None),
+]
+DISTRIBUTION_SEED = 1000000
+
+# Templates of the long-run check, each generated for more seeds than the
+# loop guard's hits per tag
+LONG_RUN_TEMPLATES = ["__colors__", "<[hat]>"]
+LONG_RUN_COUNT = 50100
+REFERENCE_SEED = 1 << 40  # reference samples use other seeds: a true two-sample test
+
+
+# Engine sampling, one process per engine and tree
+
+def node_generator(wildcards):
+    """A (template, seed) -> record function on WildcardNode."""
+    from wildcard_node import WildcardNode
+    node = WildcardNode()
+    node.wildcard_dir = wildcards
+    node.refresh_file_cache()
+
+    def generate(template, seed):
+        return {'prompt': node.process_wildcards(template, seed, "No")["result"][0]}
+    return generate
+
+
+def a1111_generator(wildcards):
+    """A (template, seed) -> record function on the A1111 PromptGenerator, as wildcard_cli runs it."""
+    import wildcard_recursive as engine
+    engine.TagLoader.wildcard_location = wildcards
+    generator = engine.PromptGenerator({})
+
+    def generate(template, seed):
+        getattr(generator.tag_selector, 'used_values', {}).clear()
+        getattr(generator.tag_selector, 'previously_selected_tags', {}).clear()
+        negatives = generator.negative_tag_generator
+        negatives.negative_tag = type(negatives.negative_tag)()
+        generator.settings_generator.setting_overrides = {}
+        random.seed(seed)
+        record = {'prompt': generator.generate_single_prompt(template)}
+        if hasattr(generator, 'get_negative_tags'):
+            record['negative_prompt'] = generator.get_negative_tags()
+            record['settings'] = dict(generator.get_setting_overrides())
+        return record
+    return generate
+
+
+def run_sampler(root, engine, wildcards):
+    """Body of the `sample` command: jobs from stdin, records to stdout, engine messages to stderr."""
+    sys.path.insert(0, os.path.abspath(root))
+    jobs = json.load(sys.stdin)
+    with contextlib.redirect_stdout(sys.stderr):
+        generate = node_generator(wildcards) if engine == 'node' else a1111_generator(wildcards)
+        results = [[generate(template, seed) for seed in seeds] for template, seeds in jobs]
+    json.dump(results, sys.stdout)
+
+
+def sample_engine(root, engine, wildcards, jobs):
+    """
+    Generate records with one engine of a tree, in a separate process.
+
+    Args:
+        root: Directory of the tree whose engine runs (this one or a reference checkout)
+        engine: 'node' or 'a1111'
+        wildcards: Wildcard directory
+        jobs: List of (template, seeds)
+
+    Returns:
+        list: One list of records (dicts with 'prompt') per job
+    """
+    environment = dict(os.environ)
+    # Always the local engine: no prompt service, no shared library
+    environment.pop('DUOUMIWILD_SERVICE', None)
+    environment.pop('DUOUMIWILD_LIBRARY', None)
+    command = [sys.executable, os.path.abspath(__file__), '--wildcards', wildcards,
+               'sample', '--root', root, '--engine', engine]
+    result = subprocess.run(command, input=json.dumps(jobs), capture_output=True, text=True,
+                            encoding='utf-8', env=environment)
+    if result.returncode != 0:
+        raise RuntimeError(f"{engine} sampler in {root} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout)
+
+
+# Golden snapshots
+
+def golden_records(root, wildcards):
+    """Records of the golden corpus: engine -> template -> one record per seed."""
+    jobs = [(template, GOLDEN_SEEDS) for template in GOLDEN_TEMPLATES]
+    return {engine: dict(zip(GOLDEN_TEMPLATES, sample_engine(root, engine, wildcards, jobs)))
+            for engine in ENGINES}
+
+
+def check_golden(wildcards, path=GOLDEN_FILE, update=False, shown=10):
+    """
+    Compare the golden corpus with the snapshot, or rewrite the snapshot.
+
+    Returns:
+        int: Number of differing records (0 after an update)
+    """
+    records = golden_records(HERE, wildcards)
+    if update:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'seeds': GOLDEN_SEEDS, 'engines': records}, file, ensure_ascii=False, indent=1)
+            file.write("\n")
+        print(f"DuoUmiWild: Golden snapshot of {len(GOLDEN_TEMPLATES)} templates x {len(GOLDEN_SEEDS)} seeds written to {path}")
+        return 0
+
+    with open(path, 'r', encoding='utf-8') as file:
+        snapshot = json.load(file)
+    if snapshot['seeds'] != GOLDEN_SEEDS:
+        print("DuoUmiWild: The golden seeds changed, rewrite the snapshot with --update")
+        return 1
+
+    differences = 0
+    for engine, templates in records.items():
+        expected_templates = snapshot['engines'].get(engine, {})
+        for template, got in templates.items():
+            expected = expected_templates.get(template)
+            if expected is None:
+                print(f"{engine}: {template!r} is not in the snapshot (add it with --update)")
+                differences += 1
+                continue
+            for seed, before, after in zip(GOLDEN_SEEDS, expected, got):
+                if before == after:
+                    continue
+                differences += 1
+                if differences <= shown:
+                    print(f"{engine}, seed {seed}: {template!r}\n  expected {before}\n  got      {after}")
+    total = len(ENGINES) * len(GOLDEN_TEMPLATES) * len(GOLDEN_SEEDS)
+    if differences > shown:
+        print(f"... {differences - shown} more")
+    print(f"DuoUmiWild: {differences} of {total} golden records differ")
+    return differences
+
+
+# Chi-square tests
+
+def chi_square_p(statistic, dof):
+    """
+    Upper tail probability of the chi-square distribution (the p-value).
+
+    Regularized upper incomplete gamma Q(dof/2, statistic/2), by its series
+    below the mean and its continued fraction above.
+    """
+    if dof <= 0 or statistic <= 0:
+        return 1.0
+    a, x = dof / 2, statistic / 2
+    scale = math.exp(-x + a * math.log(x) - math.lgamma(a))
+    if x < a + 1:
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * scale)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, scale * h)
+
+
+def pooled_bins(expected_counts, minimum=5):
+    """Group outcomes so that each bin expects at least `minimum` hits; returns lists of outcomes."""
+    bins = []
+    pool = []
+    pooled = 0
+    for outcome, count in sorted(expected_counts.items(), key=lambda item: item[1]):
+        if count >= minimum and not pool:
+            bins.append([outcome])
+            continue
+        pool.append(outcome)
+        pooled += count
+        if pooled >= minimum:
+            bins.append(pool)
+            pool = []
+            pooled = 0
+    if pool:
+        # Too little left for a bin of its own: add it to the smallest one
+        if bins:
+            bins[0].extend(pool)
+        else:
+            bins.append(pool)
+    return bins
+
+
+def fit_test(counts, probabilities):
+    """
+    Goodness of fit of outcome counts to exact probabilities.
+
+    Returns:
+        tuple: (statistic, dof, p-value, outcomes that should never happen)
+    """
+    samples = sum(counts.values())
+    unexpected = sorted((outcome for outcome in counts if not probabilities.get(outcome)), key=repr)
+    expected_counts = {outcome: samples * float(rate) for outcome, rate in probabilities.items() if rate}
+    bins = pooled_bins(expected_counts)
+    statistic = 0.0
+    for outcomes in bins:
+        expected = sum(expected_counts[outcome] for outcome in outcomes)
+        observed = sum(counts.get(outcome, 0) for outcome in outcomes)
+        statistic += (observed - expected) ** 2 / expected
+    dof = len(bins) - 1
+    return statistic, dof, chi_square_p(statistic, dof), unexpected
+
+
+def homogeneity_test(first, second):
+    """
+    Chi-square test that two samples of outcomes come from one distribution.
+
+    Returns:
+        tuple: (statistic, dof, p-value)
+    """
+    n1 = sum(first.values())
+    n2 = sum(second.values())
+    total = n1 + n2
+    combined = {outcome: first.get(outcome, 0) + second.get(outcome, 0) for outcome in set(first) | set(second)}
+    # A bin's smaller expected cell is its combined count times the smaller sample's share
+    share = min(n1, n2) / total
+    bins = pooled_bins({outcome: count * share for outcome, count in combined.items()})
+    statistic = 0.0
+    for outcomes in bins:
+        column = sum(combined[outcome] for outcome in outcomes)
+        for sample, size in ((first, n1), (second, n2)):
+            expected = column * size / total
+            observed = sum(sample.get(outcome, 0) for outcome in outcomes)
+            statistic += (observed - expected) ** 2 / expected
+    dof = len(bins) - 1
+    return statistic, dof, chi_square_p(statistic, dof)
+
+
+# Exact rates
+
+def analyzer_rates(engine, template, wildcards):
+    """Probability of each prompt of a single-pick template, from TemplateAnalyzer."""
+    from fractions import Fraction
+    from wildcard_template import PromptEnumerator, TemplateAnalyzer, clean_prompt
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'node':
+            from wildcard_node import WildcardNode
+            node = WildcardNode()
+            node.wildcard_dir = wildcards
+            node.refresh_file_cache()
+            load_lines = node.read_wildcard_file
+        else:
+            from wildcard_recursive import TagLoader
+            TagLoader.wildcard_location = wildcards
+            load_lines = TagLoader({}).load_tags
+        report = TemplateAnalyzer(PromptEnumerator(load_lines)).analyze(template)
+    if report['choice_points'] != 1:
+        raise ValueError(f"{template!r} is not a single choice point")
+    rates = {}
+    for leaf in report['leaves']:
+        prompt = clean_prompt(leaf['text'])
+        rates[prompt] = rates.get(prompt, Fraction(0)) + leaf['probability']
+    return rates
+
+
+def tag_query_rates(node, query):
+    """
+    Probability of each (text, prefixes, suffixes) outcome of WildcardNode.select_by_tags.
+
+    Found by scanning every entry's tags, without the tag postings the node
+    uses, with the node's rules: `[a|b]` is any of the tags, a first `[tag]`
+    nobody has selects nothing and a later one is ignored; then a uniform
+    entry, a uniform kind among its non-empty prompts, prefixes and
+    suffixes, and a uniform item of that kind.
+    """
+    from fractions import Fraction
+    entries = node.yaml_entries
+    tags = {title: set(entries[title]['tags']) for title in entries}
+    candidates = None
+    for position, expression in enumerate(re.findall(r'\[([^\]]+)\]', query)):
+        expression = expression.lower().strip()
+        wanted = {tag.strip() for tag in expression.split('|')}
+        matching = {title for title, entry_tags in tags.items() if wanted & entry_tags}
+        if '|' not in expression and not matching:
+            if position == 0:
+                return {("", (), ()): Fraction(1)}
+            continue
+        candidates = matching if candidates is None else candidates & matching
+    if not candidates:
+        return {("", (), ()): Fraction(1)}
+
+    rates = {}
+    for title in candidates:
+        entry = entries[title]
+        kinds = [kind for kind in ('prompts', 'prefixes', 'suffixes') if entry[kind]]
+        if not kinds:
+            rates[("", (), ())] = rates.get(("", (), ()), 0) + Fraction(1, len(candidates))
+            continue
+        for kind in kinds:
+            items = entry[kind]
+            for item in items:
+                if kind == 'prompts':
+                    outcome = (item, (), ())
+                elif kind == 'prefixes':
+                    outcome = ("", (item,) if item else (), ())
+                else:
+                    outcome = ("", (), (item,) if item else ())
+                rates[outcome] = rates.get(outcome, 0) + Fraction(1, len(candidates) * len(kinds) * len(items))
+    return rates
+
+
+def sample_tag_query(node, query, seeds):
+    """Outcomes of WildcardNode.select_by_tags for each seed."""
+    counts = Counter()
+    for seed in seeds:
+        context = node.new_context(seed)
+        text = node.select_by_tags(query, context)
+        counts[(text, tuple(context.prefixes), tuple(context.suffixes))] += 1
+    return counts
+
+
+def run_distribution(wildcards, samples, reference=None, alpha=0.01):
+    """
+    Run the chi-square tests.
+
+    Args:
+        wildcards: Wildcard directory
+        samples: Prompts per choice point, engine and tree
+        reference: Directory of a reference checkout to compare with, or None
+        alpha: Family-wise significance level (Bonferroni over all tests)
+
+    Returns:
+        int: Number of failed tests
+    """
+    seeds = list(range(DISTRIBUTION_SEED, DISTRIBUTION_SEED + samples))
+    results = []  # (engine, kind, template, statistic, dof, p, unexpected)
+
+    for engine in ENGINES:
+        templates = [template for template, engines, _ in CHOICE_POINTS if engine in engines]
+        prompts = sample_engine(HERE, engine, wildcards, [(template, seeds) for template in templates])
+        counts = {template: Counter(record['prompt'] for record in records)
+                  for template, records in zip(templates, prompts)}
+
+        for template, engines, model in CHOICE_POINTS:
+            if engine in engines and model == 'analyzer':
+                results.append((engine, 'exact', template)
+                               + fit_test(counts[template], analyzer_rates(engine, template, wildcards)))
+
+        if reference:
+            reference_seeds = [REFERENCE_SEED + seed for seed in seeds]
+            try:
+                before = sample_engine(reference, engine, wildcards, [(template, reference_seeds) for template in templates])
+            except RuntimeError as e:
+                # e.g. an old node that imports ComfyUI modules
+                print(f"DuoUmiWild: Skipping the reference {engine} engine, it could not run headless: "
+                      f"{str(e).strip().splitlines()[-1]}")
+                before = []
+            for template, records in zip(templates, before):
+                results.append((engine, 'reference', template)
+                               + homogeneity_test(counts[template], Counter(record['prompt'] for record in records))
+                               + ([],))
+
+    # The node's tag selection, against a scan of all entries
+    from wildcard_node import WildcardNode
+    with contextlib.redirect_stdout(io.StringIO()):
+        node = WildcardNode()
+        node.wildcard_dir = wildcards
+        node.refresh_file_cache()
+    for template, engines, model in CHOICE_POINTS:
+        if model == 'tags' and 'node' in engines:
+            results.append(('node', 'tags', template)
+                           + fit_test(sample_tag_query(node, template, seeds), tag_query_rates(node, template)))
+
+    threshold = alpha / max(len(results), 1)
+    failed = 0
+    for engine, kind, template, statistic, dof, p, unexpected in results:
+        passed = p >= threshold and not unexpected
+        failed += not passed
+        print(f"{'ok  ' if passed else 'FAIL'} {engine:<6} {kind:<9} {template:<28} "
+              f"chi2={statistic:9.2f} dof={dof:<3} p={p:.4f}")
+        for outcome in unexpected[:5]:
+            print(f"       never expected: {outcome!r}")
+    print(f"DuoUmiWild: {failed} of {len(results)} distribution tests failed "
+          f"({samples} samples each, p < {threshold:.2g} fails)")
+    return failed
+
+
+# Long runs
+
+def check_long_run(wildcards, count=LONG_RUN_COUNT):
+    """
+    Generate `count` records of each long-run template through wildcard_cli,
+    then through the prompt service's a1111 engine (one request per template).
+
+    Returns:
+        int: Number of records with an unresolved marker
+    """
+    sys.path.insert(0, HERE)
+    from wildcard_cli import generate_records, iter_jobs
+    from wildcard_service import PromptService
+
+    def service_records():
+        service = PromptService(wildcards)
+        for template in LONG_RUN_TEMPLATES:
+            yield from service.generate({'engine': 'a1111', 'template': template, 'seeds': list(range(count))})
+
+    failed = total = 0
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for source, records in (
+                ('cli', generate_records(iter_jobs(LONG_RUN_TEMPLATES, 0, count, ""), wildcards, {})),
+                ('service', service_records())):
+            for index, record in enumerate(records):
+                total += 1
+                if '__' in record['prompt'] or '<[' in record['prompt']:
+                    failed += 1
+                    if failed <= 5:
+                        print(f"FAIL {source} record {index}: {record['prompt']!r}", file=out)
+    print(f"DuoUmiWild: {failed} of {total} long-run records left a marker unresolved")
+    return failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Check the engines against golden prompts and exact selection rates.")
+    parser.add_argument('-w', '--wildcards', default=DEFAULT_WILDCARDS,
+                        help="Wildcard directory (default: the bundled wildcards; the snapshot is of those)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    golden = commands.add_parser('golden', help="Compare seeded prompts with the golden snapshot")
+    golden.add_argument('--update', action='store_true', help="Rewrite the snapshot from this tree")
+    golden.add_argument('--snapshot', default=GOLDEN_FILE, help="Snapshot file (default: wildcard_golden.json)")
+
+    distribution = commands.add_parser('distribution', help="Chi-square tests of single choice points")
+    distribution.add_argument('-n', '--samples', type=int, default=4000, help="Samples per test (default: 4000)")
+    distribution.add_argument('--reference', help="Checkout of another version to compare the distributions with")
+    distribution.add_argument('--alpha', type=float, default=0.01, help="Family-wise significance level (default: 0.01)")
+
+    long_run = commands.add_parser('long-run', help="Generate more prompts of one tag than the loop guard's hit limit")
+    long_run.add_argument('-n', '--count', type=int, default=LONG_RUN_COUNT,
+                          help=f"Records per template (default: {LONG_RUN_COUNT})")
+
+    sample = commands.add_parser('sample', help=argparse.SUPPRESS)
+    sample.add_argument('--root', required=True)
+    sample.add_argument('--engine', choices=ENGINES, required=True)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    wildcards = os.path.abspath(args.wildcards)
+    if args.command == 'sample':
+        run_sampler(args.root, args.engine, wildcards)
+        return 0
+    if args.command == 'golden':
+        return 1 if check_golden(wildcards, args.snapshot, args.update) else 0
+    if args.command == 'long-run':
+        return 1 if check_long_run(wildcards, args.count) else 0
+    return 1 if run_distribution(wildcards, args.samples, args.reference, args.alpha) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
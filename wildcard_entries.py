@@ -0,0 +1,427 @@
+"""
+DuoUmiWild - Compact YAML Entries
+Stores parsed YAML entries column-wise instead of one dict of lists per entry:
+strings are interned once in a string table shared by all entries, tags and
+entries are integer ids, and tag postings are arrays of entry ids, kept for
+the whole library and for each file (for `<file:[tag]>` queries).
+"""
+
+from array import array
+from collections.abc import Mapping
+
+
+# String id standing for a None value (an empty `-` item in a YAML list)
+NONE_ID = 0xFFFFFFFF
+ENTRY_FIELDS = ('prompts', 'prefixes', 'suffixes', 'tags')
+
+
+class StringTable:
+    """
+    Interned strings by integer id.
+
+    New strings are kept as Python strings until compact() packs them into
+    one UTF-8 buffer with an offsets array, which drops the per-string object
+    and dict overhead. Packed strings stay deduplicated through an
+    open-addressing table of their ids (4 bytes a slot, at most half full),
+    so interning a string again after compact() returns its packed id; the
+    table is only built once a string is interned after a compact().
+    """
+
+    __slots__ = ('ids', 'strings', 'data', 'offsets', 'slots', 'slotted')
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+        self.data = bytearray()
+        self.offsets = array('Q', [0])
+        self.slots = array('I')
+        self.slotted = 0  # packed ids entered in `slots` so far
+
+    def intern(self, value):
+        """Return the id of a string (None maps to NONE_ID), adding it if new."""
+        if value is None:
+            return NONE_ID
+        if not isinstance(value, str):
+            value = str(value)
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.packed_id(value)
+            if string_id is None:
+                string_id = self.ids[value] = len(self)
+                self.strings.append(value)
+        return string_id
+
+    def packed_id(self, value):
+        """The id of a string already packed into the buffer, or None."""
+        packed = len(self.offsets) - 1
+        if not packed:
+            return None
+        if self.slotted < packed:
+            self.add_slots(self.slotted, packed)
+        slots = self.slots
+        encoded = value.encode('utf-8', 'surrogatepass')
+        mask = len(slots) - 1
+        slot = hash(encoded) & mask
+        data = self.data
+        offsets = self.offsets
+        while True:
+            string_id = slots[slot]
+            if string_id == NONE_ID:
+                return None
+            start = offsets[string_id]
+            end = offsets[string_id + 1]
+            if end - start == len(encoded) and data[start:end] == encoded:
+                return string_id
+            slot = (slot + 1) & mask
+
+    def add_slots(self, first, last):
+        """Enter the packed ids first..last-1 in the dedup table, growing it as needed."""
+        if last * 2 > len(self.slots):
+            size = 1024
+            while size < last * 2:
+                size *= 2
+            self.slots = array('I', [NONE_ID]) * size
+            first = 0
+        slots = self.slots
+        mask = len(slots) - 1
+        data = self.data
+        offsets = self.offsets
+        for string_id in range(first, last):
+            slot = hash(bytes(data[offsets[string_id]:offsets[string_id + 1]])) & mask
+            while slots[slot] != NONE_ID:
+                slot = (slot + 1) & mask
+            slots[slot] = string_id
+        self.slotted = last
+
+    def compact(self):
+        """Pack the strings added since the last call into the shared buffer."""
+        if not self.strings:
+            return
+        encoded = [string.encode('utf-8', 'surrogatepass') for string in self.strings]
+        end = self.offsets[-1]
+        for data in encoded:
+            end += len(data)
+            self.offsets.append(end)
+        self.data.extend(b''.join(encoded))
+        self.ids = {}
+        self.strings = []
+
+    def __getitem__(self, string_id):
+        if string_id == NONE_ID:
+            return None
+        packed = len(self.offsets) - 1
+        if string_id >= packed:
+            return self.strings[string_id - packed]
+        return str(self.data[self.offsets[string_id]:self.offsets[string_id + 1]], 'utf-8', 'surrogatepass')
+
+    def decode(self, string_ids):
+        """The strings of a sequence of ids, as a list (faster than indexing one by one)."""
+        packed = len(self.offsets) - 1
+        if not self.strings or not string_ids or max(string_ids) < packed:
+            data = self.data
+            offsets = self.offsets
+            return [str(data[offsets[string_id]:offsets[string_id + 1]], 'utf-8', 'surrogatepass')
+                    for string_id in string_ids]
+        return [self[string_id] for string_id in string_ids]
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.strings)
+
+
+class YamlEntry(Mapping):
+    """
+    One entry of an EntryStore.
+
+    Reads like the dict the loaders used to build ('title', 'description',
+    'prompts', 'prefixes', 'suffixes', 'tags'); list fields are decoded from
+    the store on access.
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        store = self.store
+        if key == 'title':
+            return store.titles[self.index]
+        if key == 'description':
+            return store.strings[store.descriptions[self.index]]
+        field = ENTRY_FIELDS.index(key) if key in ENTRY_FIELDS else None
+        if field is None:
+            raise KeyError(key)
+        base = self.index * 5 + field
+        strings = store.strings
+        return [strings[string_id] for string_id in store.ids[store.offsets[base]:store.offsets[base + 1]]]
+
+    def __iter__(self):
+        return iter(('title', 'description') + ENTRY_FIELDS)
+
+    def __len__(self):
+        return 2 + len(ENTRY_FIELDS)
+
+    def __repr__(self):
+        return f"YamlEntry({dict(self)!r})"
+
+
+class EntryStore(Mapping):
+    """
+    YAML entries by title, stored in flat arrays.
+
+    Each entry takes 5 offsets into one shared array of string ids (the
+    start of its prompts, prefixes, suffixes and tags, and the end), so an
+    entry costs a few machine words instead of a dict and four lists. Adding
+    a title again replaces its entry but keeps its id, like assigning to a
+    dict key: the old entry's postings are removed, and the string ids it
+    leaves behind are reclaimed once they make up half of the array.
+    Adding an unchanged entry again changes nothing.
+
+    Entries added with a scope (the file they come from) are also posted in
+    that scope's own tag postings.
+    """
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+        self.titles = []
+        self.index = {}
+        self.offsets = array('I')
+        self.ids = array('I')
+        self.descriptions = array('I')
+        self.tag_ids = {}
+        self.postings = {}
+        self.scopes = {}  # scope -> tag id -> entry ids
+        self.entry_scopes = {}  # entry id -> scope, for entries added with one
+        self.tag_sets = {}
+        self.garbage = 0  # ids no entry's offsets point to any more
+
+    def add(self, title, prompts, prefixes, suffixes, tags, description=None, scope=None):
+        """
+        Add an entry.
+
+        Args:
+            title: Entry title
+            prompts, prefixes, suffixes: Lists of strings (None items kept)
+            tags: List of normalized tag strings
+            description: Optional description
+            scope: Optional scope name (file key) to also post the entry under
+
+        Returns:
+            int: Entry id
+        """
+        intern = self.strings.intern
+        run = array('I')
+        bounds = []
+        for values in (prompts, prefixes, suffixes):
+            bounds.append(len(run))
+            run.extend(intern(value) for value in (values or ()))
+        bounds.append(len(run))
+        for tag in tags:
+            tag_id = self.tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self.tag_ids[tag] = intern(tag)
+            run.append(tag_id)
+        bounds.append(len(run))
+        description_id = intern(description)
+
+        entry_id = self.index.get(title)
+        if entry_id is None:
+            entry_id = self.index[title] = len(self.titles)
+            self.titles.append(title)
+            self.offsets.extend((0, 0, 0, 0, 0))
+            self.descriptions.append(NONE_ID)
+        else:
+            base = entry_id * 5
+            start = self.offsets[base]
+            if (self.descriptions[entry_id] == description_id and self.entry_scopes.get(entry_id) == scope
+                    and [offset - start for offset in self.offsets[base:base + 5]] == bounds
+                    and self.ids[start:self.offsets[base + 4]] == run):
+                return entry_id
+            self.remove_postings(entry_id)
+            self.garbage += self.offsets[base + 4] - start
+
+        base = entry_id * 5
+        start = len(self.ids)
+        self.ids.extend(run)
+        self.offsets[base:base + 5] = array('I', (start + bound for bound in bounds))
+        self.descriptions[entry_id] = description_id
+
+        scoped = None
+        if scope is not None:
+            self.entry_scopes[entry_id] = scope
+            scoped = self.scopes.setdefault(scope, {})
+        for tag, tag_id in zip(tags, run[bounds[3]:]):
+            self.tag_ids[tag] = tag_id  # again, if replacing the entry dropped the tag
+            posting = self.postings.get(tag_id)
+            if posting is None:
+                posting = self.postings[tag_id] = array('I')
+            posting.append(entry_id)
+            if scoped is not None:
+                posting = scoped.get(tag_id)
+                if posting is None:
+                    posting = scoped[tag_id] = array('I')
+                posting.append(entry_id)
+
+        if self.garbage * 2 > len(self.ids):
+            self.pack_ids()
+        return entry_id
+
+    def remove_postings(self, entry_id):
+        """Take an entry out of the tag postings (and its scope's), before it is replaced."""
+        base = entry_id * 5
+        scope = self.entry_scopes.pop(entry_id, None)
+        scoped = self.scopes.get(scope) if scope is not None else None
+        for tag_id in self.ids[self.offsets[base + 3]:self.offsets[base + 4]]:
+            posting = self.postings.get(tag_id)
+            if posting is not None and entry_id in posting:
+                posting.remove(entry_id)
+                if not posting:
+                    del self.postings[tag_id]
+                    self.tag_ids.pop(self.strings[tag_id], None)
+            if scoped is not None:
+                posting = scoped.get(tag_id)
+                if posting is not None and entry_id in posting:
+                    posting.remove(entry_id)
+                    if not posting:
+                        del scoped[tag_id]
+        if scoped is not None and not scoped:
+            del self.scopes[scope]
+
+    def pack_ids(self):
+        """Copy the live entries' ids into a new array, dropping those replaced entries left behind."""
+        ids = array('I')
+        offsets = array('I')
+        for base in range(0, len(self.offsets), 5):
+            start = self.offsets[base]
+            shift = len(ids) - start
+            ids.extend(self.ids[start:self.offsets[base + 4]])
+            offsets.extend(offset + shift for offset in self.offsets[base:base + 5])
+        self.ids = ids
+        self.offsets = offsets
+        self.garbage = 0
+
+    def tag_set(self, entry_id):
+        """The entry's tags as a frozenset, shared by all entries with the same tags."""
+        base = entry_id * 5
+        key = tuple(sorted(set(self.ids[self.offsets[base + 3]:self.offsets[base + 4]])))
+        tags = self.tag_sets.get(key)
+        if tags is None:
+            tags = self.tag_sets[key] = frozenset(self.strings[tag_id] for tag_id in key)
+        return tags
+
+    def entry_ids(self, tag, scope=None):
+        """Ids of the entries with a tag, in load order."""
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return ()
+        postings = self.postings if scope is None else self.scopes.get(scope, {})
+        return postings.get(tag_id, ())
+
+    def compact(self):
+        """Pack the strings added so far; call once a batch of files is loaded."""
+        self.strings.compact()
+
+    def tag_postings(self, scope=None):
+        """A tag -> titles mapping over the postings (of one scope), as `yaml_tags_to_entries`."""
+        return TagPostings(self, scope)
+
+    def __getitem__(self, title):
+        return YamlEntry(self, self.index[title])
+
+    def __contains__(self, title):
+        return title in self.index
+
+    def __iter__(self):
+        return iter(self.titles)
+
+    def __len__(self):
+        return len(self.titles)
+
+
+class TagPostings(Mapping):
+    """Tag -> list of entry titles, decoded from an EntryStore's postings (or one scope's)."""
+
+    def __init__(self, store, scope=None):
+        self.store = store
+        self.scope = scope
+
+    def scoped(self, scope):
+        """The same mapping restricted to the entries of one scope."""
+        return TagPostings(self.store, scope)
+
+    def __getitem__(self, tag):
+        entry_ids = self.store.entry_ids(tag, self.scope)
+        if not entry_ids:
+            raise KeyError(tag)
+        titles = self.store.titles
+        return [titles[entry_id] for entry_id in entry_ids]
+
+    def __contains__(self, tag):
+        return bool(self.store.entry_ids(tag, self.scope))
+
+    def __iter__(self):
+        if self.scope is None:
+            return iter(self.store.tag_ids)
+        strings = self.store.strings
+        return (strings[tag_id] for tag_id in self.store.scopes.get(self.scope, {}))
+
+    def __len__(self):
+        if self.scope is None:
+            return len(self.store.tag_ids)
+        return len(self.store.scopes.get(self.scope, {}))
+
+
+class TagIndex(dict):
+    """
+    Title -> tag set mapping of YAML entries, with tag postings.
+
+    Filled like a dict; index() then posts every title under its tags (as
+    positions in the dict's order), so a tag query only looks at the entries
+    of its rarest tag instead of every entry.
+    """
+
+    def index(self):
+        """Build the postings; call once the mapping is complete."""
+        self.titles = list(self)
+        self.postings = {}
+        for position, tags in enumerate(self.values()):
+            for tag in tags:
+                posting = self.postings.get(tag)
+                if posting is None:
+                    posting = self.postings[tag] = array('I')
+                posting.append(position)
+        return self
+
+    def candidates(self, all_of, none_of=(), any_of=()):
+        """
+        Titles matching a tag query, in the mapping's order.
+
+        Args:
+            all_of: Tags an entry must all have
+            none_of: Tags it must not have
+            any_of: Tag groups it must have at least one tag of, each
+
+        Returns:
+            list: Matching titles
+        """
+        all_of = frozenset(all_of)
+        none_of = frozenset(none_of)
+        any_of = [frozenset(group) for group in any_of]
+        if all_of:
+            positions = min((self.postings.get(tag, ()) for tag in all_of), key=len)
+        elif any_of:
+            positions = sorted(set().union(*(self.postings.get(tag, ()) for tag in any_of[0])))
+        else:
+            positions = range(len(self.titles))
+
+        matches = []
+        for position in positions:
+            title = self.titles[position]
+            tags = self[title]
+            if not all_of <= tags or none_of & tags:
+                continue
+            if any(not group & tags for group in any_of):
+                continue
+            matches.append(title)
+        return matches
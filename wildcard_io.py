@@ -0,0 +1,275 @@
+"""
+DuoUmiWild - Wildcard File Access
+Finds and opens wildcard files for both engines, including files stored inside
+.zip/.tar packs that are read in place instead of being extracted, and
+compressed .txt.gz/.yaml.gz (and .zst, when a zstd module is available) files.
+"""
+
+import bz2
+import glob
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+PACK_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+WILDCARD_EXTENSIONS = ('.txt', '.yaml')
+COMPRESSED_EXTENSIONS = ('.gz', '.zst') if zstd or zstandard else ('.gz',)
+
+# Open packs by archive path, and pack members by the path they would have if
+# the pack were extracted next to the archive
+_packs = {}
+_pack_members = {}
+
+# Compressed tar formats by magic number, decompressed whole when a pack is opened
+TAR_DECOMPRESSORS = (
+    (b'\x1f\x8b', gzip.decompress),
+    (b'BZh', bz2.decompress),
+    (b'\xfd7zXZ\x00', lzma.decompress),
+)
+
+
+class WildcardPack:
+    """
+    A .zip or .tar wildcard pack.
+
+    The member list (the zip central directory, or the tar headers) is read once
+    when the pack is opened; member contents are only decompressed when a file
+    is actually used. A compressed tar has no index to seek by, so it is
+    decompressed into memory once when opened instead of again for every member.
+    Reads share the one open archive and are serialized by a lock per pack, as
+    any engine thread may read from it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            self.members = {info.filename: info for info in self.archive.infolist() if not info.is_dir()}
+        else:
+            self.archive = self.open_tar(path)
+            self.members = {info.name: info for info in self.archive.getmembers() if info.isfile()}
+
+    @staticmethod
+    def open_tar(path):
+        """Open a tar archive, decompressed in memory if it is compressed."""
+        with open(path, 'rb') as file:
+            head = file.read(6)
+            for magic, decompress in TAR_DECOMPRESSORS:
+                if head.startswith(magic):
+                    file.seek(0)
+                    try:
+                        data = decompress(file.read())
+                    except (OSError, EOFError, ValueError, lzma.LZMAError) as e:
+                        raise tarfile.ReadError(f"cannot decompress: {e}")
+                    return tarfile.open(fileobj=io.BytesIO(data))
+        return tarfile.open(path)
+
+    def member_paths(self):
+        """
+        List the wildcard files in the pack.
+
+        Returns:
+            list: (virtual path, member name) pairs, paths as if extracted in place
+        """
+        base = os.path.dirname(self.path)
+        paths = []
+        for name in self.members:
+            if name.startswith('__MACOSX/') or wildcard_kind(name) is None:
+                continue
+            paths.append((os.path.join(base, *name.split('/')), name))
+        return paths
+
+    def read(self, name):
+        """Decompress one member and return its bytes."""
+        with self.lock:
+            if isinstance(self.archive, zipfile.ZipFile):
+                return self.archive.read(self.members[name])
+            return self.archive.extractfile(self.members[name]).read()
+
+    def close(self):
+        with self.lock:
+            self.archive.close()
+
+
+def load_pack(path):
+    """Open a pack, reusing the already open one unless the archive changed."""
+    pack = _packs.get(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if pack is not None and pack.mtime == mtime:
+        return pack
+    if pack is not None:
+        pack.close()
+    try:
+        pack = WildcardPack(path)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        print(f"DuoUmiWild: Error opening wildcard pack {path}: {e}")
+        _packs.pop(path, None)
+        return None
+    _packs[path] = pack
+    return pack
+
+
+def strip_compression(path):
+    """Remove a .gz/.zst suffix, so 'colors.txt.gz' names the same wildcard as 'colors.txt'."""
+    for extension in COMPRESSED_EXTENSIONS:
+        if path.lower().endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+def wildcard_kind(path):
+    """Return '.txt' or '.yaml' for a (possibly compressed) wildcard file, else None."""
+    extension = os.path.splitext(strip_compression(path))[1].lower()
+    return extension if extension in WILDCARD_EXTENSIONS else None
+
+
+def find_wildcard_files(root):
+    """
+    Find all wildcard files under a directory, including the contents of packs.
+
+    Files on disk take precedence over a pack member with the same path, and
+    uncompressed files over compressed ones with the same name.
+
+    Args:
+        root: Wildcard directory
+
+    Returns:
+        dict: Extension ('.txt', '.yaml') to list of file paths
+    """
+    found = {
+        extension: glob.glob(os.path.join(root, f'**/*{extension}'), recursive=True)
+        for extension in WILDCARD_EXTENSIONS
+    }
+    for extension in WILDCARD_EXTENSIONS:
+        plain = set(found[extension])
+        for compressed in COMPRESSED_EXTENSIONS:
+            for path in glob.glob(os.path.join(root, f'**/*{extension}{compressed}'), recursive=True):
+                if strip_compression(path) not in plain:
+                    found[extension].append(path)
+
+    prefix = os.path.join(root, '')
+    for path in [path for path in _pack_members if path.startswith(prefix)]:
+        del _pack_members[path]
+
+    on_disk = {path for paths in found.values() for path in paths}
+    for extension in PACK_EXTENSIONS:
+        for archive in glob.glob(os.path.join(root, f'**/*{extension}'), recursive=True):
+            pack = load_pack(archive)
+            if pack is None:
+                continue
+            for path, name in pack.member_paths():
+                if path in on_disk or path in _pack_members:
+                    continue
+                _pack_members[path] = (pack, name)
+                found[wildcard_kind(path)].append(path)
+    return found
+
+
+def resolve_wildcard_path(path):
+    """
+    Find how a wildcard file is stored: as given, or compressed next to it.
+
+    Args:
+        path: File path, e.g. ".../colors.txt"
+
+    Returns:
+        str: The existing path (".../colors.txt" or ".../colors.txt.gz"), or None
+    """
+    for candidate in (path,) + tuple(path + extension for extension in COMPRESSED_EXTENSIONS):
+        if candidate in _pack_members or os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def wildcard_exists(path):
+    """Whether a path is a wildcard file on disk or inside a pack, plain or compressed."""
+    return resolve_wildcard_path(path) is not None
+
+
+def wildcard_stat(path):
+    """
+    Size and modification time of a wildcard file, for change detection.
+
+    Args:
+        path: File path, as returned by find_wildcard_files
+
+    Returns:
+        tuple: (size, mtime_ns); pack members report their own size and the
+            archive's mtime. (0, 0) if the file is gone.
+    """
+    path = resolve_wildcard_path(path) or path
+    member = _pack_members.get(path)
+    if member is not None:
+        pack, name = member
+        info = pack.members[name]
+        size = info.file_size if isinstance(pack.archive, zipfile.ZipFile) else info.size
+        return size, int(pack.mtime * 1e9)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0
+    return stat.st_size, stat.st_mtime_ns
+
+
+def open_zstd(raw, encoding):
+    """Wrap a binary stream of zstd data in a streaming text reader."""
+    if zstd is not None:
+        return io.TextIOWrapper(zstd.ZstdFile(raw), encoding=encoding)
+    if zstandard is not None:
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding=encoding)
+    raw.close()
+    raise OSError("reading .zst wildcard files needs Python 3.14+ or the zstandard package")
+
+
+def open_wildcard(path, encoding='utf-8'):
+    """
+    Open a wildcard file for reading as text.
+
+    Compressed files are decompressed as they are read, so callers iterating
+    over lines never hold the whole decompressed text.
+
+    Args:
+        path: File path, as returned by find_wildcard_files (a compressed
+            variant of the path is used if only that exists)
+        encoding: Text encoding
+
+    Returns:
+        file object: Usable in a `with` block like the result of open()
+    """
+    path = resolve_wildcard_path(path) or path
+    member = _pack_members.get(path)
+    lower = path.lower()
+    if member is None:
+        if lower.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding=encoding)
+        if lower.endswith('.zst'):
+            return open_zstd(open(path, 'rb'), encoding)
+        return open(path, 'r', encoding=encoding)
+
+    pack, name = member
+    raw = io.BytesIO(pack.read(name))
+    if lower.endswith('.gz'):
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding=encoding)
+    if lower.endswith('.zst'):
+        return open_zstd(raw, encoding)
+    return io.TextIOWrapper(raw, encoding=encoding)
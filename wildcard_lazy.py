@@ -0,0 +1,391 @@
+"""
+DuoUmiWild - Lazy YAML Loading
+Opt-in (DUOUMIWILD_LAZY_YAML=1) loading of YAML files in two steps: at load
+time only a header index (each entry's title and tags) is built, or read from
+a cache of the headers of unchanged files, and an entry's prompts, prefixes
+and suffixes are parsed the first time it is used. A template's YAML
+references are read ahead on a thread pool, so reading several files that are
+not cached by the OS overlaps.
+
+The header cache (yaml_index.json next to this file, or DUOUMIWILD_YAML_INDEX)
+is keyed by file path, size and modification time, like the shared library.
+"""
+
+import json
+import os
+import re
+import threading
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from .wildcard_entries import EntryStore, YamlEntry
+    from .wildcard_io import open_wildcard, wildcard_stat
+    from .wildcard_yaml import load_yaml
+except ImportError:  # loaded outside the package
+    from wildcard_entries import EntryStore, YamlEntry
+    from wildcard_io import open_wildcard, wildcard_stat
+    from wildcard_yaml import load_yaml
+
+
+LAZY_ENV = 'DUOUMIWILD_LAZY_YAML'
+INDEX_PATH = os.environ.get('DUOUMIWILD_YAML_INDEX') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'yaml_index.json')
+INDEX_VERSION = 1
+
+# Source of an entry whose body is loaded
+LOADED = -1
+
+# YAML references of a template: <[tag]...> and <file:[tag]...>
+REFERENCE_PATTERN = re.compile(r'<(?:([^<>\[\]:]+):)?((?:\[[^\[\]]+\])+)>')
+QUERY_PATTERN = re.compile(r'\[([^\]]+)\]')
+
+# Headers by path: (size, mtime_ns, header), as in the cache file
+_index = None
+_index_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def lazy_yaml_enabled():
+    """Whether DUOUMIWILD_LAZY_YAML asks for lazy YAML loading."""
+    return os.environ.get(LAZY_ENV, '').strip().lower() not in ('', '0', 'no', 'false', 'off')
+
+
+def read_pool():
+    """The thread pool reading YAML files ahead, shared by all engines of the process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='duoumiwild-yaml')
+        return _pool
+
+
+def read_yaml(path):
+    """Parse a YAML file."""
+    with open_wildcard(path) as file:
+        return load_yaml(file)
+
+
+def build_header(path):
+    """
+    Parse a YAML file for its header.
+
+    Args:
+        path: YAML file path
+
+    Returns:
+        tuple: (entries, error): entries is a list of (title, tags) pairs,
+            tags normalized as the loaders do, or None when the file is not a
+            mapping; error is the message of a file that could not be read
+    """
+    try:
+        data = read_yaml(path)
+        if not isinstance(data, dict):
+            return None, None
+        return [(title, [tag.lower().strip() for tag in entry.get('Tags', [])])
+                for title, entry in data.items() if isinstance(entry, dict)], None
+    except Exception as e:
+        return None, str(e)
+
+
+def load_index():
+    """Read the header cache file once per process (under _index_lock)."""
+    global _index
+    if _index is not None:
+        return _index
+    _index = {}
+    try:
+        with open(INDEX_PATH, 'r', encoding='utf-8') as file:
+            saved = json.load(file)
+        if saved.get('version') == INDEX_VERSION:
+            _index = {path: (size, mtime, [(title, tags) for title, tags in entries] if entries is not None else None)
+                      for path, (size, mtime, entries) in saved['files'].items()}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        pass
+    return _index
+
+
+def save_index(index):
+    """Write the header cache file, replacing it at once."""
+    files = {}
+    for path, (size, mtime, entries) in index.items():
+        # Titles JSON would not give back as they are (numbers, dates) are not cached
+        if entries is None or all(isinstance(title, str) for title, _ in entries):
+            files[path] = [size, mtime, entries]
+    temporary = f"{INDEX_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'version': INDEX_VERSION, 'files': files}, file, ensure_ascii=False)
+        os.replace(temporary, INDEX_PATH)
+    except OSError as e:
+        print(f"DuoUmiWild: Could not write the YAML header cache {INDEX_PATH}: {e}")
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def load_headers(paths, root=None):
+    """
+    Headers of YAML files, from the cache when the files are unchanged.
+
+    Files that changed or are new are parsed on the read pool, and the cache
+    file is rewritten. Files that could not be read are not cached, so their
+    error is reported on every load, as when the files are loaded eagerly.
+
+    Args:
+        paths: YAML file paths
+        root: Wildcard directory the paths are the full list of: cached
+            headers of other files under it (removed files) are dropped
+
+    Returns:
+        dict: Path -> (entries, error), as build_header
+    """
+    stats = {path: wildcard_stat(path) for path in paths}
+    with _index_lock:
+        index = load_index()
+        headers = {}
+        missing = []
+        for path in paths:
+            cached = index.get(path)
+            if cached is not None and tuple(cached[:2]) == stats[path]:
+                headers[path] = (cached[2], None)
+            else:
+                missing.append(path)
+
+        changed = False
+        for path, header in zip(missing, read_pool().map(build_header, missing)):
+            headers[path] = header
+            if header[1] is None:
+                index[path] = stats[path] + (header[0],)
+                changed = True
+            elif index.pop(path, None) is not None:
+                changed = True
+        if root is not None:
+            prefix = os.path.join(root, '')
+            for path in [path for path in index if path.startswith(prefix) and path not in stats]:
+                del index[path]
+                changed = True
+        if changed:
+            save_index(index)
+    return headers
+
+
+def entry_body(entry):
+    """Prompts, prefixes, suffixes and description of a YAML entry, as the node stores them."""
+    return entry.get('Prompts', []), entry.get('Prefix', []), entry.get('Suffix', []), None
+
+
+def template_references(template):
+    """
+    The YAML references of a template, for reading their files ahead.
+
+    Args:
+        template: Prompt template
+
+    Returns:
+        tuple: (file names of <file:[...]> references, tag queries of
+            <[...]> references, each a list of sets of alternative tags;
+            excluded `--tag`s are left out)
+    """
+    names = []
+    queries = []
+    for match in REFERENCE_PATTERN.finditer(template):
+        if match.group(1) is not None:
+            names.append(match.group(1))
+            continue
+        query = [{tag.strip() for tag in group.lower().split('|')}
+                 for group in QUERY_PATTERN.findall(match.group(2)) if not group.strip().startswith('--')]
+        if query:
+            queries.append(query)
+    return names, queries
+
+
+class LazyEntryStore(EntryStore):
+    """
+    An EntryStore filled from file headers, whose entry bodies are read on first use.
+
+    Entries are added with add_header (title, tags and the file they come
+    from) and hold no prompts, prefixes or suffixes until one of them is
+    read: the entries of its file still waiting for their bodies are then
+    all filled from one parse of the file. Several threads may read entries
+    at once; a file is parsed by one of them (or by a prefetch) while the
+    others wait for it.
+    """
+
+    def __init__(self, body=entry_body, prefix="DuoUmiWild", strings=None):
+        """
+        Args:
+            body: Function of a YAML entry dict returning its (prompts,
+                prefixes, suffixes, description)
+            prefix: Prefix of the printed messages
+            strings: Optional StringTable to share
+        """
+        super().__init__(strings)
+        self.body = body
+        self.prefix = prefix
+        self.lock = threading.RLock()
+        self.sources = array('i')  # entry id -> index in `paths`, or LOADED
+        self.paths = []
+        self.path_ids = {}
+        self.path_entries = []  # path index -> ids of the entries it was the source of
+        self.reads = {}  # path -> Future of its bodies being (or having been) read
+
+    def add(self, title, prompts, prefixes, suffixes, tags, description=None, scope=None):
+        with self.lock:
+            entry_id = super().add(title, prompts, prefixes, suffixes, tags, description, scope)
+            if entry_id == len(self.sources):
+                self.sources.append(LOADED)
+            else:
+                self.sources[entry_id] = LOADED
+            return entry_id
+
+    def add_header(self, title, tags, path, scope=None):
+        """
+        Add an entry whose body will be read from a YAML file.
+
+        Args:
+            title: Entry title
+            tags: List of normalized tag strings
+            path: YAML file the entry comes from
+            scope: Optional scope name (file key) to also post the entry under
+
+        Returns:
+            int: Entry id
+        """
+        with self.lock:
+            path_id = self.path_ids.get(path)
+            if path_id is None:
+                path_id = self.path_ids[path] = len(self.paths)
+                self.paths.append(path)
+                self.path_entries.append([])
+            entry_id = self.index.get(title)
+            waiting = entry_id is not None and self.sources[entry_id] == path_id
+            entry_id = self.add(title, (), (), (), tags, scope=scope)
+            self.sources[entry_id] = path_id
+            if not waiting:
+                self.path_entries[path_id].append(entry_id)
+            # The file may have been read before this entry was added again
+            self.reads.pop(path, None)
+            return entry_id
+
+    def compact(self):
+        with self.lock:
+            super().compact()
+
+    def tag_set(self, entry_id):
+        with self.lock:
+            return super().tag_set(entry_id)
+
+    def load(self, path):
+        """Fill in the bodies of the entries waiting for them from a YAML file (once)."""
+        with self.lock:
+            future = self.reads.get(path)
+            reader = future is None
+            if reader:
+                future = self.reads[path] = Future()
+        if not reader:
+            future.result()
+            return
+        try:
+            self.fill(path)
+        finally:
+            future.set_result(None)
+
+    def fill(self, path):
+        try:
+            data = read_yaml(path)
+        except Exception as e:
+            print(f"{self.prefix}: Error loading YAML file {path}: {e}")
+            data = None
+        with self.lock:
+            path_id = self.path_ids[path]
+            if isinstance(data, dict):
+                for title, entry in data.items():
+                    entry_id = self.index.get(title)
+                    if entry_id is None or self.sources[entry_id] != path_id or not isinstance(entry, dict):
+                        continue
+                    try:
+                        self.set_body(entry_id, *self.body(entry))
+                    except Exception as e:
+                        print(f"{self.prefix}: Error loading YAML entry {title} of {path}: {e}")
+                    self.sources[entry_id] = LOADED
+            # Entries the file no longer has (edited since its header was read) stay empty
+            for entry_id in self.path_entries[path_id]:
+                if self.sources[entry_id] == path_id:
+                    self.sources[entry_id] = LOADED
+            self.path_entries[path_id] = []
+
+    def set_body(self, entry_id, prompts, prefixes, suffixes, description=None):
+        """Store an entry's prompts, prefixes, suffixes and description, keeping its tags."""
+        base = entry_id * 5
+        tags = self.ids[self.offsets[base + 3]:self.offsets[base + 4]]
+        self.garbage += self.offsets[base + 4] - self.offsets[base]
+        intern = self.strings.intern
+        offsets = array('I')
+        for values in (prompts, prefixes, suffixes):
+            offsets.append(len(self.ids))
+            self.ids.extend(intern(value) for value in (values or ()))
+        offsets.append(len(self.ids))
+        self.ids.extend(tags)
+        offsets.append(len(self.ids))
+        # In one assignment, so readers never see half of the new offsets
+        self.offsets[base:base + 5] = offsets
+        self.descriptions[entry_id] = intern(description)
+
+    def waiting(self):
+        """Whether some entries are still waiting for their bodies."""
+        return any(self.path_entries)
+
+    def pending_paths(self, entry_ids):
+        """The files the given entries still wait for their bodies from."""
+        sources = self.sources
+        return {self.paths[sources[entry_id]] for entry_id in entry_ids if sources[entry_id] != LOADED}
+
+    def query_paths(self, query):
+        """
+        Files to read for a tag query, before it is resolved.
+
+        Args:
+            query: List of sets of alternative tags, all of which must match
+
+        Returns:
+            set: Paths holding entries that may match and are not loaded yet
+        """
+        paths = None
+        for group in query:
+            group_paths = set()
+            for tag in group:
+                group_paths |= self.pending_paths(self.entry_ids(tag))
+            paths = group_paths if paths is None else paths & group_paths
+        return paths or set()
+
+    def prefetch(self, paths):
+        """Start reading the bodies of files on the read pool, without waiting."""
+        pool = None
+        for path in paths:
+            if path in self.path_ids and path not in self.reads:
+                pool = pool or read_pool()
+                pool.submit(self.load, path)
+
+    def load_body(self, entry_id):
+        """Make sure an entry's body is loaded."""
+        source = self.sources[entry_id]
+        if source != LOADED:
+            self.load(self.paths[source])
+
+    def __getitem__(self, title):
+        return LazyYamlEntry(self, self.index[title])
+
+
+class LazyYamlEntry(YamlEntry):
+    """An entry of a LazyEntryStore, whose body is loaded when a field other than its title or tags is read."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key != 'title' and key != 'tags':
+            self.store.load_body(self.index)
+        return super().__getitem__(key)
@@ -0,0 +1,231 @@
+"""
+DuoUmiWild - Line Pool
+Keeps the lines of loaded .txt wildcards in one library-wide pool: each file is
+an array of line ids into a packed string table, so a line is stored once as
+UTF-8 bytes, however many files use it (color lists, quality tags, shared
+poses), and without a Python string object per line.
+
+Print a per-file memory report for a wildcards directory:
+    python wildcard_lines.py [--wildcards DIR]
+"""
+
+import argparse
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+
+try:
+    from .wildcard_entries import StringTable
+except ImportError:  # loaded outside the package
+    from wildcard_entries import StringTable
+
+
+class PooledLines(Sequence):
+    """The lines of one file, as ids into a LinePool's string table."""
+
+    # (StringTable, array of line ids), replaced as one when the pool is repacked
+    __slots__ = ('table',)
+
+    def __init__(self, strings, ids):
+        self.table = (strings, ids)
+
+    @property
+    def ids(self):
+        return self.table[1]
+
+    def __len__(self):
+        return len(self.table[1])
+
+    def __getitem__(self, index):
+        strings, ids = self.table
+        if isinstance(index, slice):
+            return strings.decode(ids[index])
+        return strings[ids[index]]
+
+    def __iter__(self):
+        strings, ids = self.table
+        return iter(strings.decode(ids))
+
+    def __repr__(self):
+        return f"PooledLines({list(self)!r})"
+
+
+class LinePool:
+    """
+    Interned wildcard lines shared by all the files of a library.
+
+    Each file's lines are packed as soon as it is added. Adding a file again
+    replaces its lines, and drop_file() removes them; the lines no file uses
+    any more are freed by repacking the pool once they are half of it.
+    """
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.files = {}
+        self.refs = array('I')  # line id -> number of files using it
+        self.dead = 0  # lines no file uses
+
+    def add_file(self, path, lines):
+        """
+        Pool the lines of a file.
+
+        Args:
+            path: File path, the key of the memory report
+            lines: List of lines
+
+        Returns:
+            PooledLines: Drop-in replacement for the list
+        """
+        self.drop_file(path)
+        strings = self.strings
+        ids = array('I', map(strings.intern, lines))
+        strings.compact()
+        refs = self.refs
+        known = len(refs)
+        refs.extend(array('I', [0]) * (len(strings) - known))
+        for line_id in set(ids):
+            if line_id < known and not refs[line_id]:
+                self.dead -= 1  # a dropped line, used again
+            refs[line_id] += 1
+        pooled = PooledLines(strings, ids)
+        self.files[path] = pooled
+        return pooled
+
+    def drop_file(self, path):
+        """Remove a file's lines from the pool (its PooledLines stay readable)."""
+        pooled = self.files.pop(path, None)
+        if pooled is None:
+            return
+        refs = self.refs
+        for line_id in set(pooled.ids):
+            refs[line_id] -= 1
+            if not refs[line_id]:
+                self.dead += 1
+        if self.dead * 2 > len(refs):
+            self.repack()
+
+    def repack(self):
+        """Move the lines still in use to a new string table, freeing the others."""
+        strings = StringTable()
+        repacked = []
+        for pooled in self.files.values():
+            old_strings, ids = pooled.table
+            repacked.append((pooled, array('I', (strings.intern(old_strings[line_id]) for line_id in ids))))
+        strings.compact()
+        refs = array('I', [0]) * len(strings)
+        for pooled, ids in repacked:
+            for line_id in set(ids):
+                refs[line_id] += 1
+            pooled.table = (strings, ids)
+        self.strings = strings
+        self.refs = refs
+        self.dead = 0
+
+    def memory_report(self):
+        """
+        Estimate what each pooled file costs.
+
+        Returns:
+            list: One dict per file, most expensive first, with
+                file: path
+                lines: number of lines
+                unique_lines: distinct lines in the file
+                shared_lines: distinct lines also used by another file
+                id_bytes: size of the file's line id array
+                list_bytes: size of a plain list of its lines
+                string_bytes: size of its distinct lines as Python strings
+                    (list_bytes plus string_bytes is its cost unpooled)
+                exclusive_bytes: packed size of the lines only this file uses (freed without it)
+                amortized_bytes: id_bytes plus each line's packed size divided among the files using it
+        """
+        usage = {}
+        distinct = {}
+        for path, pooled in self.files.items():
+            distinct[path] = set(pooled.ids)
+            for line_id in distinct[path]:
+                usage[line_id] = usage.get(line_id, 0) + 1
+
+        # A packed line: its UTF-8 bytes, an 8-byte offset and its dedup table slots
+        sizes = {}
+        report = []
+        for path, pooled in self.files.items():
+            strings, ids = pooled.table
+            id_bytes = sys.getsizeof(ids)
+            string_bytes = exclusive_bytes = shared_lines = 0
+            amortized = float(id_bytes)
+            for line_id in distinct[path]:
+                sized = sizes.get(line_id)
+                if sized is None:
+                    line = strings[line_id]
+                    sized = sizes[line_id] = (sys.getsizeof(line), len(line.encode('utf-8', 'surrogatepass')) + 16)
+                string_size, size = sized
+                string_bytes += string_size
+                amortized += size / usage[line_id]
+                if usage[line_id] == 1:
+                    exclusive_bytes += size
+                else:
+                    shared_lines += 1
+            report.append({
+                'file': path,
+                'lines': len(pooled),
+                'unique_lines': len(distinct[path]),
+                'shared_lines': shared_lines,
+                'id_bytes': id_bytes,
+                'list_bytes': sys.getsizeof([None] * len(ids)),
+                'string_bytes': string_bytes,
+                'exclusive_bytes': exclusive_bytes,
+                'amortized_bytes': int(amortized),
+            })
+        report.sort(key=lambda row: row['amortized_bytes'], reverse=True)
+        return report
+
+
+def format_memory_report(report, root=None):
+    """Render a memory report as a text table, with a total line."""
+    rows = [("file", "lines", "unique", "shared", "pooled KiB", "alone KiB", "exclusive KiB")]
+    for row in report:
+        rows.append((
+            os.path.relpath(row['file'], root) if root else row['file'],
+            str(row['lines']),
+            str(row['unique_lines']),
+            str(row['shared_lines']),
+            f"{row['amortized_bytes'] / 1024:.1f}",
+            f"{(row['list_bytes'] + row['string_bytes']) / 1024:.1f}",
+            f"{row['exclusive_bytes'] / 1024:.1f}",
+        ))
+    pooled = sum(row['amortized_bytes'] for row in report)
+    alone = sum(row['list_bytes'] + row['string_bytes'] for row in report)
+    rows.append(("total", str(sum(row['lines'] for row in report)), "", "", f"{pooled / 1024:.1f}", f"{alone / 1024:.1f}", ""))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) if column == 0 else cell.rjust(width) for column, (cell, width) in enumerate(zip(row, widths)))
+        for row in rows
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show what each .txt wildcard file costs in memory.")
+    parser.add_argument('-w', '--wildcards', help="Wildcard directory (default: the wildcards folder next to this file)")
+    args = parser.parse_args(argv)
+
+    try:
+        from .wildcard_node import WildcardNode
+    except ImportError:
+        from wildcard_node import WildcardNode
+    # Measure the files themselves, not a shared library or a prompt service
+    os.environ.pop('DUOUMIWILD_LIBRARY', None)
+    os.environ.pop('DUOUMIWILD_SERVICE', None)
+    node = WildcardNode()
+    if args.wildcards:
+        node.wildcard_dir = os.path.abspath(args.wildcards)
+        node.refresh_file_cache()
+    for name in node.txt_relpath_to_path:
+        node.read_wildcard_file(name)
+    print(format_memory_report(node.line_pool.memory_report(), node.wildcard_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
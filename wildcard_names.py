@@ -0,0 +1,172 @@
+"""
+DuoUmiWild - Wildcard Name Resolution
+Maps the names used in prompts (`__Colors__`, `__characters/heroes__`,
+`<Poses:[Tag]>`) to wildcard files through an alias table built once per file
+list, instead of normalizing the name and probing paths on every lookup.
+"""
+
+import os
+import threading
+
+try:
+    from .wildcard_io import strip_compression, wildcard_exists
+except ImportError:  # loaded outside the package
+    from wildcard_io import strip_compression, wildcard_exists
+
+
+# Resolvers by (root, extension), reused while the file list is the same
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+# (root, name) pairs already reported as ambiguous, so each is reported once
+_reported = set()
+
+
+def wildcard_key(root, path, extension):
+    """
+    Canonical name of a wildcard file: its path relative to the wildcard
+    directory, lowercase, with '/' separators and without extension.
+
+    Args:
+        root: Wildcard directory
+        path: File path (possibly compressed, e.g. "colors.txt.gz")
+        extension: '.txt' or '.yaml'
+
+    Returns:
+        str: e.g. "characters/heroes"
+    """
+    key = strip_compression(os.path.relpath(path, root)).replace('\\', '/').lower()
+    return key[:-len(extension)] if key.endswith(extension) else key
+
+
+class NameResolver:
+    """
+    Alias table of the wildcard files of one kind under a directory.
+
+    Every file is reachable by its canonical key (relative path) and by its
+    basename. When several files share a basename, the one closest to the
+    root (then the first by path) is used, and the first lookup through that
+    basename says so once. Names that are not in the table are tried once as
+    a path under the directory; the outcome, found or not, is remembered, so
+    a misspelled name costs one dict lookup after the first time. A new file
+    list means a new resolver (see resolver_for), which drops those results.
+    """
+
+    def __init__(self, root, files, extension, prefix="DuoUmiWild", kind="Wildcard file", report_missing=True):
+        """
+        Args:
+            root: Wildcard directory
+            files: Wildcard file paths of this kind, as found under root
+            extension: '.txt' or '.yaml'
+            prefix: Prefix of the printed messages
+            kind: What the files are called in the messages
+            report_missing: Print names that match no file (once each)
+        """
+        self.root = root
+        self.files = tuple(files)
+        self.extension = extension
+        self.prefix = prefix
+        self.kind = kind
+        self.report_missing = report_missing
+
+        self.relpaths = {}
+        candidates = {}
+        for path in self.files:
+            key = wildcard_key(root, path, extension)
+            self.relpaths[key] = path
+            candidates.setdefault(key.rsplit('/', 1)[-1], []).append(key)
+        self.basenames = {}
+        self.ambiguous = {}
+        for basename, keys in candidates.items():
+            keys.sort(key=lambda key: (key.count('/'), key))
+            self.basenames[basename] = self.relpaths[keys[0]]
+            if len(keys) > 1:
+                self.ambiguous[basename] = keys
+
+        # Raw name -> (key, path) or None, with and without basename lookups
+        self.names = {True: {}, False: {}}
+
+    def resolve(self, name, basenames=True):
+        """
+        Find the file a name refers to.
+
+        Args:
+            name: Name as written in the prompt, any case, '/' or '\\' separators
+            basenames: Also accept a bare file name for a file in a subfolder
+
+        Returns:
+            tuple: (canonical key, path), or None if no file matches
+        """
+        names = self.names[basenames]
+        try:
+            return names[name]
+        except KeyError:
+            pass
+
+        key = name.strip().replace('\\', '/').lower()
+        if key.endswith(self.extension):
+            key = key[:-len(self.extension)]
+        path = self.relpaths.get(key)
+        if path is None and basenames:
+            path = self.basenames.get(key)
+            if path is not None:
+                self.report_ambiguous(key)
+        if path is not None:
+            resolved = (wildcard_key(self.root, path, self.extension), path)
+        else:
+            # Not in the listing (e.g. in a hidden folder): try the path itself
+            path = os.path.join(self.root, f"{name}{self.extension}")
+            resolved = (key, path) if wildcard_exists(path) else None
+            if resolved is None and self.report_missing:
+                print(f"{self.prefix}: {self.kind} not found: {name}")
+        names[name] = resolved
+        return resolved
+
+    def listed(self, name, basenames=True):
+        """
+        The listed file a name refers to, without trying paths or printing anything.
+
+        Args:
+            name: Name as written in the prompt
+            basenames: Also accept a bare file name for a file in a subfolder
+
+        Returns:
+            str: File path, or None
+        """
+        key = name.strip().replace('\\', '/').lower()
+        if key.endswith(self.extension):
+            key = key[:-len(self.extension)]
+        path = self.relpaths.get(key)
+        if path is None and basenames:
+            path = self.basenames.get(key)
+        return path
+
+    def report_ambiguous(self, basename):
+        keys = self.ambiguous.get(basename)
+        if keys is None or (self.root, basename) in _reported:
+            return
+        _reported.add((self.root, basename))
+        print(f"{self.prefix}: '{basename}' matches {len(keys)} files ({', '.join(keys)}); "
+              f"using {keys[0]}, write the folder to pick another")
+
+
+def resolver_for(root, files, extension, prefix="DuoUmiWild", kind="Wildcard file", report_missing=True):
+    """
+    Return the resolver of a file list, reusing the previous one while the list is unchanged.
+
+    Args:
+        root: Wildcard directory
+        files: Wildcard file paths of this kind, as found under root
+        extension: '.txt' or '.yaml'
+        prefix, kind, report_missing: As for NameResolver
+
+    Returns:
+        NameResolver
+    """
+    files = tuple(files)
+    cache_key = (root, extension, prefix, kind, report_missing)
+    with _resolvers_lock:
+        resolver = _resolvers.get(cache_key)
+        if resolver is None or resolver.files != files:
+            resolver = _resolvers[cache_key] = NameResolver(root, files, extension, prefix, kind, report_missing)
+        return resolver
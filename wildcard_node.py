@@ -6,16 +6,90 @@ A custom node for ComfyUI that feeds random lines from .txt wildcard files into
 import os
 import random
 import re
-import glob
-import yaml
-import torch
-import folder_paths
+import threading
+
+try:
+    from .wildcard_template import PromptEnumerator
+    from .wildcard_recursive import PromptSeenSet, derive_seed
+    from .wildcard_io import find_wildcard_files, open_wildcard
+    from .wildcard_service import connect_service
+    from .wildcard_shared import SharedEntries, SharedFileCache, SharedPostings, attach_library
+    from .wildcard_entries import EntryStore
+    from .wildcard_lines import LinePool
+    from .wildcard_watch import classify_changes, watch_library
+    from .wildcard_names import resolver_for
+    from .wildcard_rope import Delimited, Rope
+    from .wildcard_profile import profiled
+    from .wildcard_lazy import LazyEntryStore, lazy_yaml_enabled, load_headers, template_references
+    from .wildcard_yaml import load_yaml
+except ImportError:  # loaded outside the package
+    from wildcard_template import PromptEnumerator
+    from wildcard_recursive import PromptSeenSet, derive_seed
+    from wildcard_io import find_wildcard_files, open_wildcard
+    from wildcard_service import connect_service
+    from wildcard_shared import SharedEntries, SharedFileCache, SharedPostings, attach_library
+    from wildcard_entries import EntryStore
+    from wildcard_lines import LinePool
+    from wildcard_watch import classify_changes, watch_library
+    from wildcard_names import resolver_for
+    from wildcard_rope import Delimited, Rope
+    from wildcard_profile import profiled
+    from wildcard_lazy import LazyEntryStore, lazy_yaml_enabled, load_headers, template_references
+    from wildcard_yaml import load_yaml
+
+
+# Patterns
+WILDCARD_PATTERN = re.compile(r'__([^_]+(?:_[^_]+)*)__')  # __filename__
+YAML_TAG_PATTERN = re.compile(r'<\[([^\]]+(?:\]\[)?[^\]]*)\]>')  # <[Tag]> or <[Tag1][Tag2]>
+CURLY_BRACE_PATTERN = re.compile(r'\{([^{}]+)\}')  # {option1|option2}
+SCOPED_TAG_PATTERN = re.compile(r'<([^<>\[\]:]+):((?:\[[^\]]+\])+)>')  # <file:[Tag]> or <file:[Tag1][Tag2]>
+
+# The same patterns as expansion steps over a Rope, with the delimiters that
+# bound what their match attempts look at
+WILDCARD_RULE = Delimited(WILDCARD_PATTERN, ('__',), ('__',))
+YAML_TAG_RULE = Delimited(YAML_TAG_PATTERN, ('<',), (']>',))
+SCOPED_TAG_RULE = Delimited(SCOPED_TAG_PATTERN, ('<',), (']>',))
+CURLY_BRACE_RULE = Delimited(CURLY_BRACE_PATTERN, ('{',), ('{', '}'))
+
+# Choices of the "profile" input
+PROFILE_MODES = ["Off", "On", "On + memory"]
+
+
+class WildcardContext:
+    """
+    State of one process_wildcards call.
+
+    Holds the call's own random generator and the prefixes/suffixes picked so
+    far, plus the YAML entries as they were when the call started, so calls
+    running in parallel threads on one node neither share state nor see a
+    reload half done.
+    """
+
+    __slots__ = ('rng', 'cache_files', 'prefixes', 'suffixes', 'yaml_entries', 'yaml_tags_to_entries',
+                 'seeded_values', 'resolving')
+
+    def __init__(self, seed, cache_files, yaml_entries, yaml_tags_to_entries):
+        self.rng = random.Random(seed)
+        self.cache_files = cache_files
+        self.prefixes = []
+        self.suffixes = []
+        self.yaml_entries = yaml_entries
+        self.yaml_tags_to_entries = yaml_tags_to_entries
+        # Seeded groups (__#1$$file__): seed -> resolved text, and the seeds
+        # being resolved (to stop a group that refers to itself)
+        self.seeded_values = {}
+        self.resolving = set()
 
 
 class WildcardNode:
     """
     A ComfyUI node that randomly selects lines from .txt and .yaml files.
     Supports wildcards, nested folders, recursive wildcards, and YAML tag-based selection.
+
+    One instance can run several process_wildcards calls at once from
+    different threads: per-call state lives in a WildcardContext, cached files
+    are read without locking, and loading or reloading files is serialized by
+    `lock`, with new data published only once complete.
     """
 
     def __init__(self):
@@ -24,46 +98,91 @@ class WildcardNode:
         if not os.path.exists(self.wildcard_dir):
             os.makedirs(self.wildcard_dir)
 
-        # Cache for loaded wildcard files
+        # Held while files are loaded into (or dropped from) the caches
+        self.lock = threading.RLock()
+
+        # Cache for loaded wildcard files, by canonical name (see
+        # wildcard_names); cached lines are interned in a pool shared by all files
         self.loaded_tags = {}
+        self.line_pool = LinePool()
+        self.cached_paths = {}  # Cached file name -> path, to drop edited files
+        self.txt_names = None  # Name resolvers of the .txt and .yaml files
+        self.yaml_names = None
         self.all_txt_files = {}
         self.all_yaml_files = {}
         self.yaml_entries = {}  # Store parsed YAML entries
         self.yaml_tags_to_entries = {}  # Map tags to entry titles
-        self.refresh_file_cache()
+        self.yaml_file_scopes = {}  # YAML file -> scope key of its entries
+        self.title_lengths = (None, 0)  # (yaml_entries, longest title)
+        # With DUOUMIWILD_LAZY_YAML set, only titles and tags are loaded up
+        # front and entry bodies are read on first use (see wildcard_lazy)
+        self.lazy_yaml = lazy_yaml_enabled()
+
+        # With DUOUMIWILD_SERVICE set, prompts come from the shared prompt
+        # service and the library is only loaded here if it cannot be reached
+        self.service = connect_service()
+        self.library_loaded = self.service is None
+        if self.library_loaded:
+            self.refresh_file_cache()
 
-        # Track prefixes and suffixes to add
-        self.current_prefixes = []
-        self.current_suffixes = []
+        # Combination walker for the "Enumerate" mode; it keeps state while
+        # compiling a template, so calls on it are serialized
+        self.enumerator = PromptEnumerator(self.read_wildcard_file)
+        self.enumerator_lock = threading.Lock()
 
-    def refresh_file_cache(self):
-        """Build a cache of all .txt and .yaml files for quick lookup, supporting nested folders."""
-        self.all_txt_files = glob.glob(os.path.join(self.wildcard_dir, '**/*.txt'), recursive=True)
-        self.all_yaml_files = glob.glob(os.path.join(self.wildcard_dir, '**/*.yaml'), recursive=True)
-
-        # Create basename to path mapping (ignoring folders for simple lookups)
-        self.txt_basename_to_path = {
-            os.path.basename(file).lower().replace('.txt', ''): file
-            for file in self.all_txt_files
-        }
-        # Also create full relative path mapping for nested folder support
-        self.txt_relpath_to_path = {
-            os.path.relpath(file, self.wildcard_dir).lower().replace('.txt', '').replace('\\', '/'): file
-            for file in self.all_txt_files
-        }
+        # File watcher for autorefresh "Watch", started on first use, and the
+        # watcher version the caches are up to date with
+        self.watcher = None
+        self.library_version = 0
 
-        # Load all YAML files
-        self.load_all_yaml_files()
+    def refresh_file_cache(self):
+        """Build a cache of all .txt and .yaml files for quick lookup, supporting nested folders and .zip/.tar packs."""
+        with self.lock:
+            found = find_wildcard_files(self.wildcard_dir)
+            self.all_txt_files = found['.txt']
+            self.all_yaml_files = found['.yaml']
+
+            # Names to files, by relative path (for nested folders) and by
+            # basename (ignoring folders for simple lookups); the resolvers
+            # are kept while the file list stays the same
+            self.txt_names = resolver_for(self.wildcard_dir, self.all_txt_files, '.txt')
+            self.txt_basename_to_path = self.txt_names.basenames
+            self.txt_relpath_to_path = self.txt_names.relpaths
+
+            # YAML files by scope (canonical name, as for .txt files) for
+            # <file:[Tag]> queries
+            self.yaml_names = resolver_for(self.wildcard_dir, self.all_yaml_files, '.yaml', kind="YAML file")
+            self.yaml_file_scopes = {path: key for key, path in self.yaml_names.relpaths.items()}
+
+            # With DUOUMIWILD_LIBRARY pointing at an up-to-date compiled library,
+            # read lines and YAML entries from it instead of parsing the files
+            library = attach_library(self.wildcard_dir, self.all_txt_files + self.all_yaml_files)
+            if library is not None:
+                self.loaded_tags = SharedFileCache(library)
+                self.yaml_entries = SharedEntries(library)
+                self.yaml_tags_to_entries = SharedPostings(library)
+                return
+            if isinstance(self.loaded_tags, SharedFileCache):
+                self.loaded_tags = {}
+
+            # Load all YAML files
+            self.load_all_yaml_files()
 
     def load_all_yaml_files(self):
         """Load and parse all YAML files, building tag-to-entry mappings."""
-        self.yaml_entries = {}
-        self.yaml_tags_to_entries = {}
+        # Entries are stored compactly; the tag -> titles mapping reads the
+        # store's tag postings. Both are replaced once the new store is
+        # complete, so calls running meanwhile keep using the previous one.
+        entries = LazyEntryStore() if self.lazy_yaml else EntryStore()
+        headers = load_headers(self.all_yaml_files, self.wildcard_dir) if self.lazy_yaml else None
 
         for yaml_file in self.all_yaml_files:
+            if headers is not None:
+                self.add_yaml_header(entries, yaml_file, headers[yaml_file])
+                continue
             try:
-                with open(yaml_file, 'r', encoding='utf-8') as f:
-                    data = yaml.safe_load(f)
+                with open_wildcard(yaml_file) as f:
+                    data = load_yaml(f)
                     if not isinstance(data, dict):
                         print(f"DuoUmiWild: Invalid YAML structure in {yaml_file}")
                         continue
@@ -72,33 +191,118 @@ class WildcardNode:
                         if not isinstance(entry, dict):
                             continue
 
-                        # Process the entry
-                        processed_entry = {
-                            'title': title,
-                            'prompts': entry.get('Prompts', []),
-                            'prefixes': entry.get('Prefix', []),
-                            'suffixes': entry.get('Suffix', []),
-                            'tags': [tag.lower().strip() for tag in entry.get('Tags', [])]
-                        }
-
-                        self.yaml_entries[title] = processed_entry
-
-                        # Build tag to entries mapping
-                        for tag in processed_entry['tags']:
-                            if tag not in self.yaml_tags_to_entries:
-                                self.yaml_tags_to_entries[tag] = []
-                            self.yaml_tags_to_entries[tag].append(title)
+                        # Process the entry (also indexes it under its tags)
+                        entries.add(
+                            title,
+                            entry.get('Prompts', []),
+                            entry.get('Prefix', []),
+                            entry.get('Suffix', []),
+                            [tag.lower().strip() for tag in entry.get('Tags', [])],
+                            scope=self.yaml_file_scopes.get(yaml_file)
+                        )
 
             except Exception as e:
                 print(f"DuoUmiWild: Error loading YAML file {yaml_file}: {e}")
 
-    def select_by_tags(self, tags_query):
+        entries.compact()
+        with self.lock:
+            self.yaml_entries = entries
+            self.yaml_tags_to_entries = entries.tag_postings()
+
+    def add_yaml_header(self, entries, yaml_file, header):
+        """Add the entries of a YAML file's header (see wildcard_lazy.load_headers) to a LazyEntryStore."""
+        titles_and_tags, error = header
+        if error is not None:
+            print(f"DuoUmiWild: Error loading YAML file {yaml_file}: {error}")
+        elif titles_and_tags is None:
+            print(f"DuoUmiWild: Invalid YAML structure in {yaml_file}")
+        else:
+            scope = self.yaml_file_scopes.get(yaml_file)
+            for title, tags in titles_and_tags:
+                entries.add_header(title, tags, yaml_file, scope=scope)
+
+    def prefetch_yaml(self, text, entries):
+        """
+        Start reading the YAML files a template refers to, with lazy YAML loading.
+
+        Args:
+            text: Template
+            entries: The call's YAML entries
+        """
+        if not isinstance(entries, LazyEntryStore) or not entries.waiting():
+            return
+        names, queries = template_references(text)
+        paths = set()
+        for name in names:
+            path = self.yaml_names.listed(name)
+            if path is not None:
+                paths.add(path)
+        for query in queries:
+            paths |= entries.query_paths(query)
+        entries.prefetch(paths)
+
+    def reload_library(self, cache_files=True):
+        """Rescan the wildcard directory and drop every cached file."""
+        with self.lock:
+            self.refresh_file_cache()
+            if not isinstance(self.loaded_tags, SharedFileCache):
+                self.loaded_tags = {}
+            self.cached_paths = {}
+            self.line_pool = LinePool()
+            self.enumerator = PromptEnumerator(lambda name: self.read_wildcard_file(name, cache_files))
+
+    def apply_file_changes(self):
+        """
+        Bring the caches up to date with the files the watcher saw change.
+
+        Only edited .txt files are dropped from the cache and the line pool
+        (and read again when used), YAML files are reloaded when one of them was edited, and the
+        directory is rescanned when files were added or removed. The first call
+        reloads everything, as the files may have changed before watching began.
+        """
+        watcher = self.watcher
+        if watcher is not None and watcher.version == self.library_version:
+            return
+
+        with self.lock:
+            watcher = self.watcher
+            if watcher is None or watcher.root != os.path.abspath(self.wildcard_dir):
+                watcher = self.watcher = watch_library(self.wildcard_dir)
+                self.library_version = watcher.version
+                changes = None
+            elif watcher.version == self.library_version:
+                return  # applied by another call meanwhile
+            else:
+                self.library_version, changes = watcher.changes(self.library_version)
+
+            rescan, txt_paths, yaml_paths = classify_changes(changes)
+            if rescan or isinstance(self.loaded_tags, SharedFileCache):
+                self.reload_library()
+                return
+            for name, path in list(self.cached_paths.items()):
+                if path in txt_paths:
+                    self.loaded_tags.pop(name, None)
+                    del self.cached_paths[name]
+            for path in txt_paths:
+                self.line_pool.drop_file(path)
+            if yaml_paths:
+                self.load_all_yaml_files()
+            self.enumerator = PromptEnumerator(self.read_wildcard_file)
+
+    def new_context(self, seed, cache_files=True):
+        """Start the state of one call, with the YAML entries loaded at this point."""
+        with self.lock:
+            return WildcardContext(seed, cache_files, self.yaml_entries, self.yaml_tags_to_entries)
+
+    def select_by_tags(self, tags_query, context, scope=None):
         """
         Select a YAML entry based on tag query.
         Supports: <[Tag]>, <[Tag1][Tag2]> (AND), <[Tag1|Tag2]> (OR)
 
         Args:
             tags_query: The tag query string
+            context: WildcardContext of the call (random generator, prefixes, suffixes)
+            scope: Only consider the entries of this YAML file (its scope key)
 
         Returns:
             str: Selected prompt text, or empty string if not found
@@ -111,6 +315,11 @@ class WildcardNode:
         if not tags:
             return ""
 
+        # Tag -> titles postings of the whole library, or of one file
+        postings = context.yaml_tags_to_entries
+        if scope is not None:
+            postings = postings.scoped(scope)
+
         candidates = set()
         first_tag = True
 
@@ -122,8 +331,8 @@ class WildcardNode:
                 or_tags = [t.strip() for t in tag_expr_lower.split('|')]
                 or_candidates = set()
                 for or_tag in or_tags:
-                    if or_tag in self.yaml_tags_to_entries:
-                        or_candidates.update(self.yaml_tags_to_entries[or_tag])
+                    if or_tag in postings:
+                        or_candidates.update(postings[or_tag])
 
                 if first_tag:
                     candidates = or_candidates
@@ -131,8 +340,8 @@ class WildcardNode:
                     candidates &= or_candidates
             else:
                 # Single tag
-                if tag_expr_lower in self.yaml_tags_to_entries:
-                    tag_candidates = set(self.yaml_tags_to_entries[tag_expr_lower])
+                if tag_expr_lower in postings:
+                    tag_candidates = set(postings[tag_expr_lower])
                     if first_tag:
                         candidates = tag_candidates
                     else:
@@ -145,9 +354,10 @@ class WildcardNode:
         if not candidates:
             return ""
 
-        # Select a random candidate
-        selected_title = random.choice(list(candidates))
-        entry = self.yaml_entries[selected_title]
+        # Select a random candidate, from the candidates in a fixed order (a
+        # set's order changes between processes, and so would the pick)
+        selected_title = context.rng.choice(sorted(candidates))
+        entry = context.yaml_entries[selected_title]
 
         # Decide whether to use prompt, prefix, or suffix
         available_options = []
@@ -161,19 +371,19 @@ class WildcardNode:
         if not available_options:
             return ""
 
-        choice_type = random.choice(available_options)
+        choice_type = context.rng.choice(available_options)
 
         if choice_type == 'prompt':
-            return random.choice(entry['prompts'])
+            return context.rng.choice(entry['prompts'])
         elif choice_type == 'prefix':
-            prefix = random.choice(entry['prefixes'])
+            prefix = context.rng.choice(entry['prefixes'])
             if prefix:  # Don't add empty prefixes
-                self.current_prefixes.append(prefix)
+                context.prefixes.append(prefix)
             return ""  # Prefix doesn't go in-place
         elif choice_type == 'suffix':
-            suffix = random.choice(entry['suffixes'])
+            suffix = context.rng.choice(entry['suffixes'])
             if suffix:  # Don't add empty suffixes
-                self.current_suffixes.append(suffix)
+                context.suffixes.append(suffix)
             return ""  # Suffix doesn't go in-place
 
         return ""
@@ -196,9 +406,19 @@ class WildcardNode:
                     "max": 0xffffffffffffffff,
                     "tooltip": "Seed for random selection. Use the same seed for consistent results."
                 }),
-                "autorefresh": (["Yes", "No"], {
+                "autorefresh": (["Yes", "No", "Watch"], {
                     "default": "No",
-                    "tooltip": "Yes: reload wildcard files each time (slower, see edits immediately). No: cache files (faster)."
+                    "tooltip": "Yes: reload wildcard files each time (slower, see edits immediately). No: cache files (faster). Watch: cache files and reload only the ones edited since the last run."
+                }),
+            },
+            "optional": {
+                "mode": (["Random", "Enumerate"], {
+                    "default": "Random",
+                    "tooltip": "Enumerate: walk every combination of {} and __file__ choices in order, using the seed as the combination index (wraps around)."
+                }),
+                "profile": (PROFILE_MODES, {
+                    "default": "Off",
+                    "tooltip": "Profile this run with cProfile (and tracemalloc for \"On + memory\"): writes a .pstats file and a summary of the slowest functions to the profiles folder (DUOUMIWILD_PROFILE_DIR)."
                 }),
             },
         }
@@ -209,6 +429,30 @@ class WildcardNode:
     OUTPUT_NODE = True
     CATEGORY = "DuoUmiWild"
 
+    def generate_remote(self, text, seeds, autorefresh, mode):
+        """
+        Generate prompts on the prompt service.
+
+        Args:
+            text: Input text
+            seeds: List of seeds, one prompt each
+            autorefresh: "Yes" to make the service reload its library first
+                ("Watch" is up to the service)
+            mode: "Random" or "Enumerate"
+
+        Returns:
+            list: Prompts, or None if the service failed (the local library
+                is then loaded for local generation)
+        """
+        try:
+            return self.service.generate(text, seeds, 'node', mode, autorefresh == "Yes")
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"DuoUmiWild: Prompt service unavailable, generating locally: {e}")
+            if not self.library_loaded:
+                self.refresh_file_cache()
+                self.library_loaded = True
+            return None
+
     def read_wildcard_file(self, filename, cache_files=True):
         """
         Read a wildcard file and return valid lines.
@@ -221,31 +465,22 @@ class WildcardNode:
         Returns:
             list: Lines from the file, or empty list if file not found
         """
-        # Check cache first if caching is enabled
-        if cache_files and filename in self.loaded_tags:
-            return self.loaded_tags[filename]
-
-        # Normalize the filename
-        normalized = filename.lower().replace('\\', '/')
-
-        # Try multiple lookup strategies:
-        # 1. Direct relative path match (for nested folders)
-        filepath = self.txt_relpath_to_path.get(normalized)
-
-        # 2. Basename match (for simple filenames)
-        if not filepath:
-            filepath = self.txt_basename_to_path.get(normalized)
-
-        # 3. Direct construction
-        if not filepath:
-            filepath = os.path.join(self.wildcard_dir, f"{filename}.txt")
-
-        if not filepath or not os.path.exists(filepath):
-            print(f"DuoUmiWild: Wildcard file not found: {filename}")
+        # Resolve the name (relative path, basename, any case) to the file's
+        # canonical name and path; names of missing files are reported once
+        loaded_tags = self.loaded_tags
+        resolved = self.txt_names.resolve(filename)
+        if resolved is None:
             return []
+        name, filepath = resolved
+
+        # Check cache first if caching is enabled
+        if cache_files:
+            lines = loaded_tags.get(name)
+            if lines is not None:
+                return lines
 
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
+            with open_wildcard(filepath) as f:
                 lines = []
                 for line in f:
                     line = line.strip()
@@ -261,32 +496,44 @@ class WildcardNode:
                     if line:  # Only add if there's content after removing comments
                         lines.append(line)
 
-                # Cache the result if caching is enabled
+                # Cache the result if caching is enabled, unless another call
+                # cached it meanwhile or the cache was reloaded since
                 if cache_files:
-                    self.loaded_tags[filename] = lines
+                    with self.lock:
+                        if self.loaded_tags is loaded_tags:
+                            cached = loaded_tags.get(name)
+                            if cached is not None:
+                                return cached
+                            lines = self.line_pool.add_file(filepath, lines)
+                            loaded_tags[name] = lines
+                            self.cached_paths[name] = filepath
 
                 return lines
         except Exception as e:
             print(f"DuoUmiWild: Error reading file {filepath}: {e}")
             return []
 
-    def process_range_wildcard(self, match, cache_files=True):
+    def process_range_wildcard(self, match, context):
         """
         Process wildcard with range syntax like __0-2$$filename__ or nested wildcards.
 
         Args:
             match: Regex match object containing the wildcard
-            cache_files: Whether to cache file contents
+            context: WildcardContext of the call
 
         Returns:
             str: Selected items joined with commas, or original if error
         """
         content = match.group(1)
 
+        # Seeded group: #seed$$filename, linked to the other uses of the seed
+        if content.startswith('#') and '$$' in content:
+            return self.select_seeded(match, context)
+
         # Check for range syntax: num-num$$filename or num$$filename
         if '$$' in content:
             range_part, filename = content.split('$$', 1)
-            lines = self.read_wildcard_file(filename, cache_files)
+            lines = self.read_wildcard_file(filename, context.cache_files)
 
             if not lines:
                 return match.group(0)  # Return original if no lines
@@ -309,26 +556,26 @@ class WildcardNode:
                     low, high = high, low
 
                 # Select random number of items within range
-                num_items = random.randint(low, high)
+                num_items = context.rng.randint(low, high)
                 if num_items == 0:
                     return ""
 
                 # Randomly select items
-                selected = random.sample(lines, min(num_items, len(lines)))
+                selected = context.rng.sample(lines, min(num_items, len(lines)))
                 return ", ".join(selected)
 
             except (ValueError, Exception) as e:
                 print(f"DuoUmiWild: Error processing range wildcard: {e}")
-                return random.choice(lines) if lines else match.group(0)
+                return context.rng.choice(lines) if lines else match.group(0)
         else:
             # Simple wildcard without range - check if it's a nested wildcard
             if content.startswith('__') and content.endswith('__'):
                 # This is a nested wildcard, will be processed in next iteration
                 return match.group(0)
 
-            lines = self.read_wildcard_file(content, cache_files)
+            lines = self.read_wildcard_file(content, context.cache_files)
             if lines:
-                selected = random.choice(lines)
+                selected = context.rng.choice(lines)
                 # Check if selected line contains nested wildcards
                 if '__' in selected:
                     # It will be processed in the next recursive iteration
@@ -337,13 +584,54 @@ class WildcardNode:
             else:
                 return match.group(0)  # Return original if no lines found
 
-    def process_curly_braces(self, match):
+    def select_seeded(self, match, context):
+        """
+        Process a seeded group like __#1$$filename__ or __#1|2$$filename__.
+
+        The first use of a seed in the prompt picks a line and expands it
+        completely (nested wildcards, YAML tags and {} included); every later
+        use of the seed returns that same text without resolving it again, as
+        the A1111 engine's seeded groups do. With several seeds (#1|2), one of
+        them is picked at random.
+
+        Args:
+            match: Regex match object containing the wildcard
+            context: WildcardContext of the call
+
+        Returns:
+            str: The group's text, or the original marker if the file has no lines
+        """
+        seed_part, filename = match.group(1).split('$$', 1)
+        seed_options = seed_part[1:].split('|')
+        seed_id = seed_options[0] if len(seed_options) == 1 else context.rng.choice(seed_options)
+
+        resolved = context.seeded_values.get(seed_id)
+        if resolved is not None:
+            return resolved
+        if seed_id in context.resolving:
+            print(f"DuoUmiWild: Seeded group #{seed_id} refers to itself")
+            return ""
+
+        lines = self.read_wildcard_file(filename, context.cache_files)
+        if not lines:
+            return match.group(0)
+
+        context.resolving.add(seed_id)
+        try:
+            resolved = self.expand_text(context.rng.choice(lines), context)
+        finally:
+            context.resolving.discard(seed_id)
+        context.seeded_values[seed_id] = resolved
+        return resolved
+
+    def process_curly_braces(self, match, context):
         """
         Process {} randomization like {option1|option2|option3}
         Supports range syntax like {0-1$$option1|option2}
 
         Args:
             match: Regex match object
+            context: WildcardContext of the call
 
         Returns:
             str: Selected option(s)
@@ -374,46 +662,64 @@ class WildcardNode:
                 if low > high:
                     low, high = high, low
 
-                num_items = random.randint(low, high)
+                num_items = context.rng.randint(low, high)
                 if num_items == 0:
                     return ""
 
-                selected = random.sample(options, min(num_items, len(options)))
+                selected = context.rng.sample(options, min(num_items, len(options)))
                 return ", ".join(selected)
             except (ValueError, Exception) as e:
                 print(f"DuoUmiWild: Error processing range in curly braces: {e}")
-                return random.choice(options)
+                return context.rng.choice(options)
         else:
             # Simple random choice
-            return random.choice(options)
+            return context.rng.choice(options)
 
-    def process_yaml_tags(self, match):
+    def process_yaml_tags(self, match, context):
         """
         Process YAML tag selection like <[Tag]> or <[Tag1][Tag2]>
 
         Args:
             match: Regex match object
+            context: WildcardContext of the call
 
         Returns:
             str: Selected YAML entry prompt
         """
         tags_query = match.group(0)  # Get the full match
-        return self.select_by_tags(tags_query)
+        return self.select_by_tags(tags_query, context)
+
+    def process_scoped_yaml_tags(self, match, context):
+        """
+        Process YAML tag selection within one file, like <file:[Tag]> or <folder/file:[Tag1][Tag2]>
 
-    def select_yaml_by_title(self, title):
+        Args:
+            match: Regex match object
+            context: WildcardContext of the call
+
+        Returns:
+            str: Selected YAML entry prompt, or empty string if not found
+        """
+        resolved = self.yaml_names.resolve(match.group(1))
+        if resolved is None:
+            return ""
+        return self.select_by_tags(match.group(2), context, resolved[0])
+
+    def select_yaml_by_title(self, title, context):
         """
         Select a YAML entry directly by its title (e.g., "a-size", "b-size").
 
         Args:
             title: The entry title to look up
+            context: WildcardContext of the call
 
         Returns:
             str: Selected prompt text, or empty string if not found
         """
-        if title not in self.yaml_entries:
+        if title not in context.yaml_entries:
             return ""
 
-        entry = self.yaml_entries[title]
+        entry = context.yaml_entries[title]
 
         # Decide whether to use prompt, prefix, or suffix
         available_options = []
@@ -427,79 +733,161 @@ class WildcardNode:
         if not available_options:
             return ""
 
-        choice_type = random.choice(available_options)
+        choice_type = context.rng.choice(available_options)
 
         if choice_type == 'prompt':
-            return random.choice(entry['prompts'])
+            return context.rng.choice(entry['prompts'])
         elif choice_type == 'prefix':
-            prefix = random.choice(entry['prefixes'])
+            prefix = context.rng.choice(entry['prefixes'])
             if prefix:
-                self.current_prefixes.append(prefix)
+                context.prefixes.append(prefix)
             return ""
         elif choice_type == 'suffix':
-            suffix = random.choice(entry['suffixes'])
+            suffix = context.rng.choice(entry['suffixes'])
             if suffix:
-                self.current_suffixes.append(suffix)
+                context.suffixes.append(suffix)
             return ""
 
         return ""
 
-    def process_wildcards(self, text, seed, autorefresh):
+    def expand_text(self, text, context):
+        """
+        Resolve wildcards, YAML tags and {} groups until the text stops changing.
+
+        Args:
+            text: Text to expand
+            context: WildcardContext of the call
+
+        Returns:
+            str: Expanded text, before prefixes/suffixes and cleanup
+        """
+        # Process multiple times to handle nested structures. The text is kept
+        # as a Rope, so each pass only rescans what the previous steps inserted.
+        max_iterations = 20
+        rope = Rope(text)
+        steps = (
+            # Process in order: wildcards, YAML tags (all files, then per file), then {} randomization
+            (WILDCARD_RULE, lambda m: self.process_range_wildcard(m, context)),
+            (YAML_TAG_RULE, lambda m: self.process_yaml_tags(m, context)),
+            (SCOPED_TAG_RULE, lambda m: self.process_scoped_yaml_tags(m, context)),
+            (CURLY_BRACE_RULE, lambda m: self.process_curly_braces(m, context)),
+        )
+        titles_scanned = 0
+
+        for iteration in range(max_iterations):
+            before = rope.snapshot()
+            changed = 0
+            for rule, replace in steps:
+                changed += rope.sub(rule, replace)
+
+            # Also check for direct YAML title references (like "a-size" from {a|b|c}-size)
+            since, titles_scanned = titles_scanned, rope.clock
+            changed += self.replace_titles(rope, since, context)
+
+            # Done once a pass changes nothing (or only undoes its own changes;
+            # the text is only compared when its length came back the same)
+            if not changed or rope.same_as(before):
+                break
+
+        return rope.text()
+
+    def replace_titles(self, rope, since, context):
+        """
+        Replace the first occurrence of each YAML title found in the text.
+
+        A title that was not found last pass can only appear where the text
+        changed since, so only that text (with a title's length of context)
+        is searched; once a title is found, the rest of the pass runs on the
+        whole text.
+
+        Args:
+            rope: Rope being expanded
+            since: Rope clock when titles were last checked
+            context: WildcardContext of the call
+
+        Returns:
+            int: Number of titles replaced by a different text
+        """
+        entries = context.yaml_entries
+        if not entries or not rope.changed_since(since):
+            return 0
+        changed_text = rope.changed_text(since, max(self.title_length(entries) - 1, 0))
+
+        text = None
+        changed = 0
+        for title in entries.keys():
+            if text is None:
+                if title not in changed_text:
+                    continue
+                text = rope.text()
+            if title in text:
+                replacement = self.select_yaml_by_title(title, context)
+                if replacement != title:
+                    changed += 1
+                text = text.replace(title, replacement, 1)  # Replace only first occurrence
+
+        # A title found (even one replaced by itself) is looked for again next pass
+        if text is not None:
+            rope.reset(text)
+        return changed
+
+    def title_length(self, entries):
+        """Length of the longest YAML title, computed once per set of entries."""
+        cached = self.title_lengths
+        if cached[0] is not entries:
+            cached = self.title_lengths = (entries, max(map(len, entries), default=0))
+        return cached[1]
+
+    def process_wildcards(self, text, seed, autorefresh, mode="Random", profile="Off"):
         """
         Process all wildcards, YAML tags, and {} randomization with recursive support.
 
         Args:
             text: Input text containing wildcards, YAML tags, and {} randomization
             seed: Random seed for reproducible results
-            autorefresh: Whether to refresh file cache and reload files each time
+            autorefresh: "Yes" to refresh the file cache and reload files each time,
+                "No" to keep the cache, "Watch" to keep it but drop edited files
+            mode: "Random" to sample, or "Enumerate" to take combination number `seed`
+            profile: "On" or "On + memory" to profile the call (see wildcard_profile)
 
         Returns:
             dict: Contains UI preview and result tuple
         """
-        # Set random seed for reproducibility
-        random.seed(seed)
+        if profile != "Off":
+            with profiled(True, "node", memory=(profile == "On + memory")):
+                return self.process_wildcards(text, seed, autorefresh, mode)
 
-        # Clear prefix/suffix tracking
-        self.current_prefixes = []
-        self.current_suffixes = []
+        if self.service is not None:
+            prompts = self.generate_remote(text, [seed], autorefresh, mode)
+            if prompts is not None:
+                return {"ui": {"text": prompts}, "result": (prompts[0],)}
 
         # Refresh file cache if autorefresh is enabled
-        cache_files = (autorefresh == "No")
+        cache_files = (autorefresh != "Yes")
         if autorefresh == "Yes":
-            self.refresh_file_cache()
-            self.loaded_tags.clear()
-
-        # Patterns
-        wildcard_pattern = re.compile(r'__([^_]+(?:_[^_]+)*)__')  # __filename__
-        yaml_tag_pattern = re.compile(r'<\[([^\]]+(?:\]\[)?[^\]]*)\]>')  # <[Tag]> or <[Tag1][Tag2]>
-        curly_brace_pattern = re.compile(r'\{([^{}]+)\}')  # {option1|option2}
-
-        # Process multiple times to handle nested structures
-        max_iterations = 20
-        iteration = 0
-        previous_text = None
+            self.reload_library(cache_files)
+        elif autorefresh == "Watch":
+            self.apply_file_changes()
 
-        while previous_text != text and iteration < max_iterations:
-            previous_text = text
+        # Random generator seeded for reproducibility, and prefix/suffix
+        # tracking, private to this call
+        context = self.new_context(seed, cache_files)
+        self.prefetch_yaml(text, context.yaml_entries)
 
-            # Process in order: wildcards, YAML tags, then {} randomization
-            text = wildcard_pattern.sub(lambda m: self.process_range_wildcard(m, cache_files), text)
-            text = yaml_tag_pattern.sub(self.process_yaml_tags, text)
-            text = curly_brace_pattern.sub(self.process_curly_braces, text)
+        # Enumerate mode fixes the {} and __file__ choices; anything left (YAML
+        # tags, seeded groups) is still resolved randomly below.
+        if mode == "Enumerate":
+            with self.enumerator_lock:
+                total = self.enumerator.count(text)
+                text = self.enumerator.prompt_at(text, seed % total)
 
-            # Also check for direct YAML title references (like "a-size" from {a|b|c}-size)
-            for title in self.yaml_entries.keys():
-                if title in text:
-                    replacement = self.select_yaml_by_title(title)
-                    text = text.replace(title, replacement, 1)  # Replace only first occurrence
-
-            iteration += 1
+        text = self.expand_text(text, context)
 
         # Add prefixes and suffixes
-        if self.current_prefixes:
-            text = ", ".join(self.current_prefixes) + ", " + text
-        if self.current_suffixes:
-            text = text + ", " + ", ".join(self.current_suffixes)
+        if context.prefixes:
+            text = ", ".join(context.prefixes) + ", " + text
+        if context.suffixes:
+            text = text + ", " + ", ".join(context.suffixes)
 
         # Clean up any extra commas or whitespace
         text = re.sub(r',\s*,', ',', text)  # Remove double commas
@@ -512,11 +900,86 @@ class WildcardNode:
         return {"ui": {"text": [text]}, "result": (text,)}
 
 
+class WildcardBatchNode(WildcardNode):
+    """
+    Generates a list of prompts from one template, one per seed from `seed` upwards.
+    Can guarantee that no prompt appears twice in the list.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        inputs = super().INPUT_TYPES()
+        inputs["required"]["count"] = ("INT", {
+            "default": 4,
+            "min": 1,
+            "max": 4096,
+            "tooltip": "Number of prompts to generate (seeds seed, seed+1, ...)."
+        })
+        inputs["required"]["unique"] = (["No", "Yes"], {
+            "default": "No",
+            "tooltip": "Yes: redraw prompts already generated in this list, with seeds derived from the original one."
+        })
+        return inputs
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("processed_text",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "process_batch"
+
+    def process_batch(self, text, seed, autorefresh, count=4, unique="No", mode="Random", profile="Off"):
+        """
+        Process the template once per seed.
+
+        Args:
+            text: Input text containing wildcards, YAML tags, and {} randomization
+            seed: Seed of the first prompt; prompt i uses seed + i
+            autorefresh: Whether to refresh file cache and reload files first
+            count: Number of prompts
+            unique: "Yes" to redraw duplicates
+            mode: "Random" or "Enumerate", as for the single prompt node
+            profile: "On" or "On + memory" to profile the whole batch
+
+        Returns:
+            dict: Contains UI preview and result tuple with the list of prompts
+        """
+        if profile != "Off":
+            with profiled(True, "node-batch", memory=(profile == "On + memory")):
+                return self.process_batch(text, seed, autorefresh, count, unique, mode)
+
+        if self.service is not None and unique == "No":
+            prompts = self.generate_remote(text, [seed + index for index in range(count)], autorefresh, mode)
+            if prompts is not None:
+                return {"ui": {"text": prompts}, "result": (prompts,)}
+
+        seen_prompts = PromptSeenSet(count) if unique == "Yes" else None
+        prompts = []
+
+        for index in range(count):
+            item_seed = seed + index
+            # Only reload files once per batch
+            refresh = autorefresh if index == 0 else "No"
+            prompt = self.process_wildcards(text, item_seed, refresh, mode)["result"][0]
+
+            attempt = 0
+            while seen_prompts is not None and not seen_prompts.add(prompt):
+                if attempt == PromptSeenSet.max_retries:
+                    print(f"DuoUmiWild: No unique prompt after {attempt} redraws, keeping duplicate")
+                    break
+                attempt += 1
+                prompt = self.process_wildcards(text, derive_seed(item_seed, attempt), "No", mode)["result"][0]
+
+            prompts.append(prompt)
+
+        return {"ui": {"text": prompts}, "result": (prompts,)}
+
+
 # Node registration for ComfyUI
 NODE_CLASS_MAPPINGS = {
-    "DuoUmiWildcard": WildcardNode
+    "DuoUmiWildcard": WildcardNode,
+    "DuoUmiWildcardBatch": WildcardBatchNode
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "DuoUmiWildcard": "Wildcard Prompt"
+    "DuoUmiWildcard": "Wildcard Prompt",
+    "DuoUmiWildcardBatch": "Wildcard Prompt Batch"
 }
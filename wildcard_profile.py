@@ -0,0 +1,154 @@
+"""
+DuoUmiWild - Profiling
+Opt-in capture of where generation time goes: a batch of prompts runs under
+cProfile (and tracemalloc, for memory), and the capture is written as a
+.pstats file plus a text summary of the hottest functions and allocation
+sites. Nothing is hooked unless a capture is asked for.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+
+# Where captures are written unless told otherwise
+DEFAULT_DIRECTORY = os.environ.get('DUOUMIWILD_PROFILE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+# Only one capture at a time: cProfile and tracemalloc are process-wide
+_capture_lock = threading.Lock()
+
+
+class ProfileCapture:
+    """
+    Context manager profiling the code it wraps.
+
+    On exit it writes `<label>-<time>-<pid>.pstats` (load it with pstats or
+    snakeviz) and a `.txt` summary next to it: the top functions by
+    cumulative and own time, and with memory=True the lines that allocated
+    the most memory still held at the end, and the peak traced memory. When
+    another capture is running, this one is skipped with a message.
+    """
+
+    def __init__(self, label, directory=None, memory=False, top=25, prefix="DuoUmiWild"):
+        """
+        Args:
+            label: Start of the file names (e.g. "node", "cli")
+            directory: Output directory (default: DEFAULT_DIRECTORY)
+            memory: Also trace allocations with tracemalloc (much slower)
+            top: Number of functions and allocation sites in the summary
+            prefix: Prefix of the printed messages
+        """
+        self.label = label
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.memory = memory
+        self.top = top
+        self.prefix = prefix
+        self.profiler = None
+        self.started_tracing = False
+        self.baseline = None
+        self.allocations = None
+        self.started = None
+        self.summary_path = None
+
+    def __enter__(self):
+        if not _capture_lock.acquire(blocking=False):
+            self.report(f"{self.prefix}: A profile capture is already running, not profiling this run")
+            return self
+        import cProfile
+        if self.memory:
+            import tracemalloc
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.baseline = traced_snapshot()
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.profiler is None:
+            return False
+        self.profiler.disable()
+        elapsed = time.perf_counter() - self.started
+        try:
+            if self.memory:
+                # Before writing anything, so the report's own allocations are left out
+                import tracemalloc
+                self.allocations = (tracemalloc.get_traced_memory(),
+                                    traced_snapshot().compare_to(self.baseline, 'lineno'))
+                if self.started_tracing:
+                    tracemalloc.stop()
+            self.write(elapsed)
+        except OSError as e:
+            self.report(f"{self.prefix}: Could not write the profile to {self.directory}: {e}")
+        finally:
+            self.profiler = self.baseline = self.allocations = None
+            _capture_lock.release()
+        return False
+
+    def write(self, elapsed):
+        """Write the .pstats file and the summary."""
+        import pstats
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        stats_path = os.path.join(self.directory, name + '.pstats')
+        self.profiler.dump_stats(stats_path)
+
+        summary = io.StringIO()
+        summary.write(f"{self.label}: {elapsed:.3f} s\n")
+        stats = pstats.Stats(self.profiler, stream=summary).strip_dirs()
+        for order, title in (('cumulative', 'cumulative time'), ('tottime', 'own time')):
+            summary.write(f"\nTop {self.top} functions by {title}\n")
+            stats.sort_stats(order).print_stats(self.top)
+        if self.allocations is not None:
+            self.write_memory(summary)
+
+        self.summary_path = os.path.join(self.directory, name + '.txt')
+        with open(self.summary_path, 'w', encoding='utf-8') as file:
+            file.write(summary.getvalue())
+        self.report(f"{self.prefix}: Profile of {self.label} ({elapsed:.3f} s) written to {stats_path}, summary {self.summary_path}")
+
+    def write_memory(self, summary):
+        (current, peak), differences = self.allocations
+        summary.write(f"\nTraced memory: {current / 2**20:.1f} MiB at the end, {peak / 2**20:.1f} MiB peak\n")
+        summary.write(f"\nTop {self.top} allocation sites of memory still held at the end\n")
+        for stat in differences[:self.top]:
+            summary.write(f"{stat}\n")
+
+    def report(self, message):
+        # stderr, so a capture never mixes with prompts written to stdout
+        print(message, file=sys.stderr)
+
+
+def traced_snapshot():
+    """Current tracemalloc snapshot, without the allocations of the profilers and the import system."""
+    import cProfile
+    import tracemalloc
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+
+def profiled(enabled, label, directory=None, memory=False, top=25, prefix="DuoUmiWild"):
+    """
+    A ProfileCapture when enabled, otherwise a context manager that does nothing.
+
+    Args:
+        enabled: Whether to profile
+        label, directory, memory, top, prefix: As for ProfileCapture
+
+    Returns:
+        Context manager
+    """
+    if not enabled:
+        return contextlib.nullcontext()
+    return ProfileCapture(label, directory, memory, top, prefix)
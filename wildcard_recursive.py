@@ -1,27 +1,64 @@
 import os
+import sys
 import random
 import inspect
 import pathlib
 import re
 import time
 import glob
+import hashlib
+import math
 from random import choices
 import yaml
 
-import modules.scripts as scripts
-import modules.images as images
-import gradio as gr
-
-from modules.processing import Processed, process_images
-from modules.shared import opts, cmd_opts, state
-from modules import scripts, script_callbacks, shared
-from modules.styles import StyleDatabase
-import modules.textual_inversion.textual_inversion
+try:
+    import modules.scripts as scripts
+    import modules.images as images
+    import gradio as gr
+
+    from modules.processing import Processed, process_images
+    from modules.shared import opts, cmd_opts, state
+    from modules import scripts, script_callbacks, shared
+    from modules.styles import StyleDatabase
+    import modules.textual_inversion.textual_inversion
+
+    from modules.sd_samplers import samplers, samplers_for_img2img
+except ImportError:
+    # Imported outside the WebUI (ComfyUI node, command line tools): only the
+    # prompt engine classes are usable, the Script below is inert.
+    scripts = None
 
-from modules.sd_samplers import samplers, samplers_for_img2img
+try:
+    from .wildcard_io import find_wildcard_files, open_wildcard, strip_compression
+    from .wildcard_service import connect_service
+    from .wildcard_shared import SharedLines, attach_library
+    from .wildcard_entries import EntryStore, TagIndex
+    from .wildcard_lines import LinePool, PooledLines
+    from .wildcard_watch import classify_changes, watch_library
+    from .wildcard_names import resolver_for
+    from .wildcard_rope import Delimited, Rope, Spaced
+    from .wildcard_profile import profiled
+    from .wildcard_lazy import LazyEntryStore, lazy_yaml_enabled, load_headers, template_references
+    from .wildcard_yaml import load_yaml
+except ImportError:
+    # The WebUI loads this script by path: make the helper modules next to it importable
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from wildcard_io import find_wildcard_files, open_wildcard, strip_compression
+    from wildcard_service import connect_service
+    from wildcard_shared import SharedLines, attach_library
+    from wildcard_entries import EntryStore, TagIndex
+    from wildcard_lines import LinePool, PooledLines
+    from wildcard_watch import classify_changes, watch_library
+    from wildcard_names import resolver_for
+    from wildcard_rope import Delimited, Rope, Spaced
+    from wildcard_profile import profiled
+    from wildcard_lazy import LazyEntryStore, lazy_yaml_enabled, load_headers, template_references
+    from wildcard_yaml import load_yaml
 
 
 ALL_KEY = 'all yaml files'
+# Types of a loaded .txt wildcard: a list, pooled lines, or a view into a shared library
+LINE_TYPES = (list, PooledLines, SharedLines)
 UsageGuide = """
                     ### Usage
                     * `{a|b|c|...}` will pick one of `a`, `b`, `c`, ...
@@ -80,10 +117,10 @@ def read_file_lines(file):
     Returns:
         list: Selected lines from the file
     """
-    f_lines = file.read().splitlines()
     lines = []
     
-    for line in f_lines:
+    # Iterate the stream so large (or compressed) files are never held whole
+    for line in file:
         line = line.strip()
         # Skip empty lines
         if not line:
@@ -189,65 +226,189 @@ class TagLoader:
     wildcard_location = os.path.join(
         pathlib.Path(inspect.getfile(lambda: None)).parent.parent, "wildcards")
     loaded_tags = {}
+    line_pool = LinePool()  # Lines of the cached .txt files, interned across files
+    loaded_paths = {}  # Cache key -> file path (None for ALL_KEY), to drop edited files
     missing_tags = set()
+    # File watcher of the watch_files option and the version the cache is up to date with
+    watcher = None
+    library_version = 0
 
     def __init__(self, options):
-        self.ignore_paths = dict(options).get('ignore_paths', True)
-        self.all_txt_files = glob.glob(os.path.join(self.wildcard_location, '**/*.txt'), recursive=True)
-        self.all_yaml_files = glob.glob(os.path.join(self.wildcard_location, '**/*.yaml'), recursive=True)
-        self.txt_basename_to_path = {os.path.basename(file).lower().split('.')[0]: file for file in self.all_txt_files}
-        self.yaml_basename_to_path = {os.path.basename(file).lower().split('.')[0]: file for file in self.all_yaml_files}
+        # "Ignore folders": also find files in subfolders by their bare name
+        self.ignore_paths = dict(options).get('ignore_folders', dict(options).get('ignore_paths', True))
+        self.watch_files = dict(options).get('watch_files', False)
+        self.find_files()
         self.verbose = dict(options).get('verbose', False)
-        self.yaml_entries = {}  # Store processed YAML entries
+        # 'lazy_yaml' option or DUOUMIWILD_LAZY_YAML: load titles and tags
+        # only, and entry bodies on first use (see wildcard_lazy)
+        self.lazy_yaml = dict(options).get('lazy_yaml', lazy_yaml_enabled())
+        # Store processed YAML entries
+        self.yaml_entries = self.new_yaml_store()
+
+    def new_yaml_store(self):
+        """An empty store for the YAML entries, lazy or not as configured."""
+        return LazyEntryStore(self.yaml_body, prefix="UmiAI") if self.lazy_yaml else EntryStore()
+
+    def find_files(self):
+        """List the wildcard files and attach the shared library, if current."""
+        found = find_wildcard_files(self.wildcard_location)
+        self.all_txt_files = found['.txt']
+        self.all_yaml_files = found['.yaml']
+        # Names to files (relative path or basename, any case); kept while the
+        # file list stays the same, with the names found missing
+        self.txt_names = resolver_for(self.wildcard_location, self.all_txt_files, '.txt', prefix="UmiAI", report_missing=False)
+        self.yaml_names = resolver_for(self.wildcard_location, self.all_yaml_files, '.yaml', prefix="UmiAI", report_missing=False)
+        # Compiled library shared between processes (DUOUMIWILD_LIBRARY), if current
+        self.shared_library = attach_library(self.wildcard_location, self.all_txt_files + self.all_yaml_files)
+
+    def apply_file_changes(self):
+        """Drop the cached files the watcher saw change (and their pooled lines); rescan when files were added or removed."""
+        watcher = TagLoader.watcher
+        if watcher is None or watcher.root != os.path.abspath(self.wildcard_location):
+            # Files may have changed before watching began: start from scratch
+            watcher = TagLoader.watcher = watch_library(self.wildcard_location)
+            TagLoader.library_version = watcher.version
+            changes = None
+        else:
+            TagLoader.library_version, changes = watcher.changes(TagLoader.library_version)
+
+        rescan, txt_paths, yaml_paths = classify_changes(changes)
+        if rescan:
+            self.loaded_tags.clear()
+            self.loaded_paths.clear()
+            self.missing_tags.clear()
+            TagLoader.line_pool = LinePool()
+            self.yaml_entries = self.new_yaml_store()
+            self.find_files()
+            return
+        if yaml_paths:
+            # Entry ids are only valid in the store they were added to: reload
+            # every YAML file into a fresh one, so that edited entries leave
+            # no stale postings behind
+            self.yaml_entries = self.new_yaml_store()
+            yaml_files = set(self.all_yaml_files)
+        for key, path in list(self.loaded_paths.items()):
+            if path in txt_paths or (yaml_paths and (path is None or path in yaml_files)):
+                self.loaded_tags.pop(key, None)
+                del self.loaded_paths[key]
+        for path in txt_paths:
+            self.line_pool.drop_file(path)
+
+    def shared_lines(self, txt_file_path):
+        """Lines of a .txt file from the shared library, or None when it is not there."""
+        if self.shared_library is None:
+            return None
+        name = strip_compression(os.path.relpath(txt_file_path, self.wildcard_location)).replace('\\', '/').lower()
+        if name.endswith('.txt'):
+            name = name[:-len('.txt')]
+        return self.shared_library.file_lines(name)
+
+    @staticmethod
+    def yaml_body(entry_data):
+        """Prompts, prefixes, suffixes and description of a YAML entry."""
+        return (
+            entry_data.get('Prompts', []),
+            entry_data.get('Prefix', []),
+            entry_data.get('Suffix', []),
+            entry_data.get('Description', [None])[0] if isinstance(entry_data.get('Description', []), list) else None
+        )
 
     def process_yaml_entry(self, title, entry_data):
-        """Process a single YAML entry with the new structure."""
-        processed_entry = {
-            'title': title,
-            'description': entry_data.get('Description', [None])[0] if isinstance(entry_data.get('Description', []), list) else None,
-            'prompts': entry_data.get('Prompts', []),
-            'prefixes': entry_data.get('Prefix', []),
-            'suffixes': entry_data.get('Suffix', []),
-            'tags': [x.lower().strip() for x in entry_data.get('Tags', [])]
-        }
-        return processed_entry
+        """Store a single YAML entry with the new structure. Returns its id, or None if it has no tags."""
+        tags = [x.lower().strip() for x in entry_data.get('Tags', [])]
+        if not tags:  # Only add if it has tags
+            return None
+        prompts, prefixes, suffixes, description = self.yaml_body(entry_data)
+        return self.yaml_entries.add(title, prompts, prefixes, suffixes, tags, description)
+
+    def index_yaml_header(self, file_path, header, output, verbose=False):
+        """
+        Add the tagged entries of a YAML file's header (see wildcard_lazy.load_headers) to a TagIndex.
+
+        Returns:
+            bool: False if the file could not be read or is not a mapping
+        """
+        titles_and_tags, error = header
+        if error is not None:
+            print(f'Error parsing YAML file {file_path}: {error}')
+            return False
+        if titles_and_tags is None:
+            if verbose:
+                print(f'Invalid YAML structure in {file_path}')
+            return False
+        for title, tags in titles_and_tags:
+            if tags:  # Only add if it has tags
+                entry_id = self.yaml_entries.add_header(title, tags, file_path)
+                output[title] = self.yaml_entries.tag_set(entry_id)
+        return True
+
+    def prefetch(self, template):
+        """Start reading the YAML files a template refers to, with lazy YAML loading."""
+        if not self.lazy_yaml or not self.yaml_entries.waiting():
+            return
+        names, queries = template_references(template)
+        paths = set()
+        for name in names:
+            path = self.yaml_names.listed(name, self.ignore_paths)
+            if path is not None:
+                paths.add(path)
+        for query in queries:
+            paths |= self.yaml_entries.query_paths(query)
+        self.yaml_entries.prefetch(paths)
 
     def load_tags(self, file_path, verbose=False, cache_files=True):
         """Load tags from a file, supporting both .txt and .yaml formats."""
-        if cache_files and self.loaded_tags.get(file_path):
-            return self.loaded_tags.get(file_path)
-
-        txt_full_file_path = os.path.join(self.wildcard_location, f'{file_path}.txt')
-        yaml_full_file_path = os.path.join(self.wildcard_location, f'{file_path}.yaml')
-        txt_file_match = self.txt_basename_to_path.get(file_path.lower()) or txt_full_file_path
-        yaml_file_match = self.yaml_basename_to_path.get(file_path.lower()) or yaml_full_file_path
-        txt_file_path = txt_file_match if self.ignore_paths else txt_full_file_path
-        yaml_file_path = yaml_file_match if self.ignore_paths else yaml_full_file_path
+        if self.watch_files and (TagLoader.watcher is None or TagLoader.watcher.version != TagLoader.library_version):
+            self.apply_file_changes()
 
+        # Files are cached by canonical name, so every spelling of a name
+        # shares one entry
         if file_path == ALL_KEY:
             key = ALL_KEY
+            txt_file_path = yaml_file_path = None
         else:
-            if self.ignore_paths:
-                basename = os.path.basename(file_path.lower())
-            key = file_path
+            txt_file = self.txt_names.resolve(file_path, self.ignore_paths)
+            yaml_file = self.yaml_names.resolve(file_path, self.ignore_paths)
+            if txt_file is None and yaml_file is None:
+                self.missing_tags.add(file_path)
+                return []
+            key = (txt_file or yaml_file)[0]
+            txt_file_path = txt_file[1] if txt_file else None
+            yaml_file_path = yaml_file[1] if yaml_file else None
+        if cache_files and self.loaded_tags.get(key):
+            return self.loaded_tags.get(key)
 
         # Handle text files
-        if self.wildcard_location and os.path.isfile(txt_file_path):
-            with open(txt_file_path, encoding="utf8") as file:
+        shared_lines = self.shared_lines(txt_file_path) if txt_file_path else None
+        if shared_lines is not None:
+            self.files.append(f"{file_path}.txt")
+            self.loaded_tags[key] = shared_lines
+            self.loaded_paths[key] = txt_file_path
+        elif self.wildcard_location and txt_file_path:
+            with open_wildcard(txt_file_path) as file:
                 self.files.append(f"{file_path}.txt")
-                self.loaded_tags[key] = read_file_lines(file)
-                if self.ignore_paths:
-                    self.loaded_tags[basename] = self.loaded_tags[key]
+                lines = read_file_lines(file)
+                # Only cached files are pooled; an uncached read replaces the pooled copy
+                if cache_files:
+                    lines = self.line_pool.add_file(txt_file_path, lines)
+                else:
+                    self.line_pool.drop_file(txt_file_path)
+                self.loaded_tags[key] = lines
+                self.loaded_paths[key] = txt_file_path
 
         # Handle YAML files
         if key is ALL_KEY and self.wildcard_location:
-            files = glob.glob(os.path.join(self.wildcard_location, '**/*.yaml'), recursive=True)
-            output = {}
-            for file_path in files:
-                with open(file_path, encoding="utf8") as file:
+            output = TagIndex()
+            headers = load_headers(self.all_yaml_files, self.wildcard_location) if self.lazy_yaml else None
+            for file_path in self.all_yaml_files:
+                if headers is not None:
+                    self.files.append(f"{file_path}.yaml")
+                    self.index_yaml_header(file_path, headers[file_path], output, verbose)
+                    continue
+                with open_wildcard(file_path) as file:
                     self.files.append(f"{file_path}.yaml")
                     try:
-                        data = yaml.safe_load(file)
+                        data = load_yaml(file)
                         if not isinstance(data, dict):
                             if verbose:
                                 print(f'Invalid YAML structure in {file_path}')
@@ -257,39 +418,43 @@ class TagLoader:
                             if not isinstance(entry, dict):
                                 continue
                             
-                            processed_entry = self.process_yaml_entry(title, entry)
-                            if processed_entry['tags']:  # Only add if it has tags
-                                output[title] = set(processed_entry['tags'])
-                                self.yaml_entries[title] = processed_entry
+                            entry_id = self.process_yaml_entry(title, entry)
+                            if entry_id is not None:
+                                output[title] = self.yaml_entries.tag_set(entry_id)
 
                     except yaml.YAMLError as exc:
                         print(f'Error parsing YAML file {file_path}: {exc}')
-            self.loaded_tags[key] = output
-
-        if self.wildcard_location and os.path.isfile(yaml_file_path):
-            with open(yaml_file_path, encoding="utf8") as file:
+            self.yaml_entries.compact()
+            self.loaded_tags[key] = output.index()
+            self.loaded_paths[key] = None
+
+        if self.wildcard_location and yaml_file_path and self.lazy_yaml:
+            self.files.append(f"{file_path}.yaml")
+            output = TagIndex()
+            if self.index_yaml_header(yaml_file_path, load_headers([yaml_file_path])[yaml_file_path], output, verbose):
+                self.yaml_entries.compact()
+                self.loaded_tags[key] = output.index()
+                self.loaded_paths[key] = yaml_file_path
+        elif self.wildcard_location and yaml_file_path:
+            with open_wildcard(yaml_file_path) as file:
                 self.files.append(f"{file_path}.yaml")
                 try:
-                    data = yaml.safe_load(file)
-                    output = {}
+                    data = load_yaml(file)
+                    output = TagIndex()
                     for title, entry in data.items():
                         if not isinstance(entry, dict):
                             continue
                         
-                        processed_entry = self.process_yaml_entry(title, entry)
-                        if processed_entry['tags']:  # Only add if it has tags
-                            output[title] = set(processed_entry['tags'])
-                            self.yaml_entries[title] = processed_entry
-
-                    self.loaded_tags[key] = output
-                    if self.ignore_paths:
-                        self.loaded_tags[os.path.basename(file_path.lower())] = self.loaded_tags[key]
+                        entry_id = self.process_yaml_entry(title, entry)
+                        if entry_id is not None:
+                            output[title] = self.yaml_entries.tag_set(entry_id)
+
+                    self.yaml_entries.compact()
+                    self.loaded_tags[key] = output.index()
+                    self.loaded_paths[key] = yaml_file_path
                 except yaml.YAMLError as exc:
                     print(f'Error parsing YAML file {yaml_file_path}: {exc}')
 
-        if not os.path.isfile(yaml_file_path) and not os.path.isfile(txt_file_path):
-            self.missing_tags.add(file_path)
-
         return self.loaded_tags.get(key) if self.loaded_tags.get(key) else []
 
     def get_entry_details(self, title):
@@ -331,7 +496,7 @@ class TagSelector:
 
     def get_tag_choice(self, parsed_tag, tags):
         """Select a tag from the available choices, handling seeded selection."""
-        if not isinstance(tags, list):
+        if not isinstance(tags, LINE_TYPES):
             if self.verbose:
                 print(f'UmiAI: Expected list of tags but got {type(tags)}')
             return ""
@@ -431,21 +596,11 @@ class TagSelector:
                          if not x.startswith('--') and '|' not in x]
             pos_groups_set = {x for x in pos_groups}
             
-            candidates = []
-            for tag, tag_set in tags.items():
-                if len(list(pos_groups_set & tag_set)) != len(pos_groups_set):
-                    continue
-                if len(list(neg_groups_set & tag_set)) > 0:
-                    continue
-                if len(any_groups) > 0:
-                    any_groups_found = 0
-                    for any_group in any_groups:
-                        if len(list(any_group & tag_set)) == 0:
-                            break
-                        any_groups_found += 1
-                    if len(any_groups) != any_groups_found:
-                        continue
-                candidates.append(tag)
+            # The loaded YAML files are indexed by tag, so only the entries
+            # of the query's rarest tag are checked
+            if not isinstance(tags, TagIndex):
+                tags = TagIndex(tags).index()
+            candidates = tags.candidates(pos_groups_set, neg_groups_set, any_groups)
 
             if candidates:
                 if self.verbose:
@@ -564,7 +719,7 @@ class TagSelector:
                 if any(range_part.startswith(str(i)) for i in range(10)) or '-' in range_part:
                     try:
                         tags = self.tag_loader.load_tags(file_part, self.verbose, self.cache_files)
-                        if isinstance(tags, list):
+                        if isinstance(tags, LINE_TYPES):
                             result = process_wildcard_range(parsed_tag, tags)
                             if result is not None:
                                 return result
@@ -575,7 +730,7 @@ class TagSelector:
             # Then handle seeded tags
             if parsed_tag.startswith('#'):
                 tags = self.tag_loader.load_tags(parsed_tag.split('$$')[1], self.verbose, self.cache_files)
-                if isinstance(tags, list):
+                if isinstance(tags, LINE_TYPES):
                     return self.get_tag_choice(parsed_tag, tags)
                 
             # Regular tag handling
@@ -632,6 +787,7 @@ class TagReplacer:
         self.options = options
         # Fixed regex to properly capture the entire wildcard content
         self.wildcard_regex = re.compile(r'(__|<)(.*?)(__|>)')
+        self.wildcard_rule = Delimited(self.wildcard_regex, ('__', '<'), ('__', '>'))
         self.opts_regexp = re.compile(r'(?<=\[)(.*?)(?=\])')
 
     def replace_wildcard(self, matches):
@@ -662,25 +818,36 @@ class TagReplacer:
             return selected_tags
         return matches.group(0)
 
-    def replace_wildcard_recursive(self, prompt):
-        p = self.wildcard_regex.sub(self.replace_wildcard, prompt)
+    def replace_wildcard_recursive(self, rope):
+        """Replace wildcards in a Rope, rescanning what was inserted. Returns the number of changes."""
+        before = rope.snapshot()
+        changed = total = rope.sub(self.wildcard_rule, self.replace_wildcard)
         # Keep replacing wildcards until no more changes occur
         count = 0
         max_iterations = 10  # Add a safety limit to prevent infinite loops
-        while p != prompt and count < max_iterations:
-            prompt = p
-            p = self.wildcard_regex.sub(self.replace_wildcard, prompt)
+        while changed and not rope.same_as(before) and count < max_iterations:
+            before = rope.snapshot()
+            changed = rope.sub(self.wildcard_rule, self.replace_wildcard)
+            total += changed
             count += 1
-        return p
-        
+        return total
+
+    def replace_rope(self, rope):
+        return self.replace_wildcard_recursive(rope)
+
     def replace(self, prompt):
-        return self.replace_wildcard_recursive(prompt)
+        rope = Rope(prompt)
+        self.replace_rope(rope)
+        return rope.text()
 
 
 # handle {1$$this | that} notation
 class DynamicPromptReplacer:
     def __init__(self):
         self.re_combinations = re.compile(r"\{([^{}]*)\}")
+        self.combinations_rule = Delimited(self.re_combinations, ('{',), ('{', '}'))
+        self.double_commas_rule = Spaced(re.compile(r',\s*,'))
+        self.spaces_rule = Spaced(re.compile(r'\s+'))
 
     def get_variant_weight(self, variant):
         split_variant = variant.split("%")
@@ -793,20 +960,25 @@ class DynamicPromptReplacer:
             print(f"Error picking variants: {e}")
             return ""
 
-    def replace(self, template):
-        if template is None:
-            return None
+    def replace_rope(self, rope):
+        """Replace {} groups in a Rope and clean up around them. Returns the number of changes."""
+        changed = rope.sub(self.combinations_rule, self.replace_combinations)
 
-        result = self.re_combinations.sub(self.replace_combinations, template)
-        
         # Clean up any potential double commas or spaces that might occur
-        result = re.sub(r',\s*,', ',', result)  # Remove double commas
-        result = re.sub(r'\s+', ' ', result)    # Remove double spaces
-        
+        changed += rope.sub(self.double_commas_rule, lambda m: ',')  # Remove double commas
+        changed += rope.sub(self.spaces_rule, lambda m: ' ')  # Remove double spaces
+
         # Only ensure a trailing comma for range-based replacements
         # We might need a more complex approach here if problematic
-        
-        return result
+
+        return changed
+
+    def replace(self, template):
+        if template is None:
+            return None
+        rope = Rope(template)
+        self.replace_rope(rope)
+        return rope.text()
 
 class PromptGenerator:
     def __init__(self, options):
@@ -820,36 +992,59 @@ class PromptGenerator:
             self.settings_generator
         ]
         self.verbose = dict(options).get('verbose', False)
+        # Prompt service to generate on instead of the local library, from the
+        # 'service' option or DUOUMIWILD_SERVICE
+        self.service = connect_service(dict(options).get('service'))
 
-    def use_replacers(self, prompt):
-        """Apply all replacers to the prompt in sequence"""
+    def generate_remote(self, original_prompt):
+        """Generate a prompt on the prompt service, seeded from the current random state. Returns None if it failed."""
+        try:
+            record = self.service.generate(original_prompt, [random.getrandbits(63)], 'a1111')[0]
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f'UmiAI: Prompt service unavailable, generating locally: {e}')
+            return None
+        if record['negative_prompt']:
+            self.negative_tag_generator.add_negative_tags(record['negative_prompt'])
+        self.settings_generator.setting_overrides.update(record['settings'])
+        return record['prompt']
+
+    def use_replacers(self, rope):
+        """Apply all replacers to the prompt (a Rope) in sequence. Returns the number of changes."""
+        changed = 0
         for replacer in self.replacers:
-            prompt = replacer.replace(prompt)
-        return prompt
+            changed += replacer.replace_rope(rope)
+        return changed
 
     def generate_single_prompt(self, original_prompt):
         """Generate a single prompt with all wildcards replaced and additions applied"""
+        if self.service is not None:
+            prompt = self.generate_remote(original_prompt)
+            if prompt is not None:
+                return prompt
+
         # Clear seeded values before generating new prompt
         self.tag_selector.clear_seeded_values()
+        # Start reading the YAML files the template refers to
+        self.tag_loader.prefetch(original_prompt)
         
-        # Generate the main prompt
-        previous_prompt = original_prompt
+        # Generate the main prompt, kept as a Rope so that each round only
+        # rescans what the previous one inserted
+        rope = Rope(original_prompt)
         start = time.time()
-        prompt = self.use_replacers(original_prompt)
-        
+
         # Keep replacing until no more changes occur
-        while previous_prompt != prompt:
-            previous_prompt = prompt
-            prompt = self.use_replacers(prompt)
-            
+        before = rope.snapshot()
+        while self.use_replacers(rope) and not rope.same_as(before):
+            before = rope.snapshot()
+
         # Get prefixes and suffixes
         additions = self.tag_selector.get_prefixes_and_suffixes()
         
         # Add prefixes and suffixes to the prompt
         if additions['prefixes']:
-            prompt = ", ".join(additions['prefixes']) + ", " + prompt
+            rope.prepend(", ".join(additions['prefixes']) + ", ")
         if additions['suffixes']:
-            prompt = prompt + ", " + ", ".join(additions['suffixes'])
+            rope.append(", " + ", ".join(additions['suffixes']))
             
         # Handle negative prefixes and suffixes
         if additions['negative_prefixes'] or additions['negative_suffixes']:
@@ -861,7 +1056,8 @@ class PromptGenerator:
             self.negative_tag_generator.add_negative_tags(negative_parts)
             
         # Process any remaining negative tags in the prompt
-        prompt = self.negative_tag_generator.replace(prompt)
+        self.negative_tag_generator.replace_rope(rope)
+        prompt = rope.text()
         
         # Clean up extra commas from the prompt
         prompt = re.sub(r',\s*,', ',', prompt)  # Remove double commas
@@ -886,26 +1082,37 @@ class PromptGenerator:
 
 class NegativePromptGenerator:
     def __init__(self):
-        self.negative_tag = set()
+        # Negative tags in the order they were found, without duplicates
+        # (a dict used as an ordered set)
+        self.negative_tag = {}
         self.negative_prefixes = []
         self.negative_suffixes = []
+        self.negative_tags_rule = Delimited(re.compile(r'\*\*.*?\*\*'), ('**',), ('**',))
+
+    def reset(self):
+        """Forget the negative tags of the previous prompt."""
+        self.negative_tag = {}
+
+    def extract_negative_tag(self, match):
+        """Collect the tag of one **...** marker and remove the marker."""
+        self.negative_tag[match.group(0).replace("**", "")] = None
+        return ""
 
     def strip_negative_tags(self, tags):
-        # Original negative tag handling
-        matches = re.findall('\*\*.*?\*\*', tags)
-        if matches:
-            for match in matches:
-                self.negative_tag.add(match.replace("**", ""))
-                tags = tags.replace(match, "")
-        return tags
+        rope = Rope(tags)
+        self.replace_rope(rope)
+        return rope.text()
 
     def add_negative_tags(self, tags):
         """Add additional negative tags from prefixes/suffixes"""
         if isinstance(tags, list):
             for tag in tags:
-                self.negative_tag.add(tag.strip())
+                self.negative_tag[tag.strip()] = None
         else:
-            self.negative_tag.add(tags.strip())
+            self.negative_tag[tags.strip()] = None
+
+    def replace_rope(self, rope):
+        return rope.sub(self.negative_tags_rule, self.extract_negative_tag)
 
     def replace(self, prompt):
         return self.strip_negative_tags(prompt)
@@ -940,6 +1147,7 @@ class SettingsGenerator:
 
     def __init__(self):
         self.re_setting_tags = re.compile(r"@@(.*?)@@")
+        self.setting_tags_rule = Delimited(self.re_setting_tags, ('@@',), ('@@',))
         self.setting_overrides = {}
         self.type_mapping = {
             'cfg_scale': float,
@@ -949,32 +1157,39 @@ class SettingsGenerator:
             'height': int,
             'denoising_strength': float
         }
+        # Every prefix of a setting name -> the first setting it starts
+        self.setting_prefixes = {}
+        for key in self.type_mapping:
+            for end in range(len(key) + 1):
+                self.setting_prefixes.setdefault(key[:end], key)
+
+    def apply_setting_tag(self, matches):
+        """Apply the settings of one @@...@@ tag and remove it."""
+        match = matches.group(1)
+        sep = "," if "," in match else "|"
+        for assignment in [m.strip() for m in match.split(sep)]:
+            key_raw, value = assignment.split("=")
+            if not value:
+                print(
+                    f"Invalid setting {assignment}, settings should assign a value"
+                )
+                continue
+            key = self.setting_prefixes.get(key_raw)
+            if key is not None:
+                self.setting_overrides[key] = self.type_mapping[key](value)
+            else:
+                print(
+                    f"Unknown setting {key_raw}, setting should be the starting part of: {', '.join(self.type_mapping.keys())}"
+                )
+        return ""
 
     def strip_setting_tags(self, prompt):
-        matches = self.re_setting_tags.findall(prompt)
-        if matches:
-            for match in matches:
-                sep = "," if "," in match else "|"
-                for assignment in [m.strip() for m in match.split(sep)]:
-                    key_raw, value = assignment.split("=")
-                    if not value:
-                        print(
-                            f"Invalid setting {assignment}, settings should assign a value"
-                        )
-                        continue
-                    key_found = False
-                    for key in self.type_mapping.keys():
-                        if key.startswith(key_raw):
-                            self.setting_overrides[key] = self.type_mapping[
-                                key](value)
-                            key_found = True
-                            break
-                    if not key_found:
-                        print(
-                            f"Unknown setting {key_raw}, setting should be the starting part of: {', '.join(self.type_mapping.keys())}"
-                        )
-                prompt = prompt.replace('@@' + match + '@@', "")
-        return prompt
+        rope = Rope(prompt)
+        self.replace_rope(rope)
+        return rope.text()
+
+    def replace_rope(self, rope):
+        return rope.sub(self.setting_tags_rule, self.apply_setting_tag)
 
     def replace(self, prompt):
         return self.strip_setting_tags(prompt)
@@ -982,10 +1197,68 @@ class SettingsGenerator:
     def get_setting_overrides(self):
         return self.setting_overrides
 
+def derive_seed(seed, attempt):
+    """Seed for the attempt-th redraw of a duplicate prompt, stable for a given base seed."""
+    digest = hashlib.blake2b(f"{seed}:{attempt}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class PromptSeenSet:
+    """
+    Remembers which prompts were already generated in a batch or run.
+
+    Prompts are stored as 64-bit hashes. Past `bloom_threshold` expected prompts a
+    Bloom filter is used instead, which keeps memory fixed at the cost of an
+    occasional false "seen" (a needless redraw, never a duplicate).
+    """
+
+    bloom_threshold = 1000000
+    max_retries = 20
+
+    def __init__(self, expected=0, error_rate=0.001):
+        self.hashes = None
+        self.bits = None
+        if expected > self.bloom_threshold:
+            self.size = max(8, int(-expected * math.log(error_rate) / (math.log(2) ** 2)))
+            self.hash_count = max(1, round(self.size / expected * math.log(2)))
+            self.bits = bytearray((self.size + 7) // 8)
+        else:
+            self.hashes = set()
+
+    def add(self, prompt):
+        """
+        Record a prompt.
+
+        Args:
+            prompt: Generated prompt text
+
+        Returns:
+            bool: True if the prompt was new, False if it was seen before
+        """
+        digest = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).digest()
+        if self.hashes is not None:
+            key = int.from_bytes(digest[:8], 'little')
+            if key in self.hashes:
+                return False
+            self.hashes.add(key)
+            return True
+
+        # Double hashing: bit i = h1 + i * h2
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        new = False
+        for i in range(self.hash_count):
+            bit = (h1 + i * h2) % self.size
+            if not self.bits[bit >> 3] & (1 << (bit & 7)):
+                self.bits[bit >> 3] |= 1 << (bit & 7)
+                new = True
+        return new
+
+
 def _get_effective_prompt(prompts: list[str], prompt: str) -> str:
     return prompts[0] if prompts else prompt
 
-class Script(scripts.Script):
+class Script(scripts.Script if scripts is not None else object):
     is_txt2img = False
 
     def title(self):
@@ -1019,27 +1292,45 @@ class Script(scripts.Script):
                                               value=True, 
                                               elem_id=elemid_prefix + "cache-files", 
                                               tooltip="Cache .txt and .yaml files at runtime. Speeds up prompt generation. Disable if you're editing wildcard files to see changes instantly.")
+                    watch_files = gr.Checkbox(label="Watch tag files",
+                                              value=False,
+                                              elem_id=elemid_prefix + "watch-files",
+                                              tooltip="Keep the cache, but reload the .txt and .yaml files edited since the last generation. A background thread watches the wildcards folder.")
                     verbose = gr.Checkbox(label="Verbose logging", 
                                           value=False, 
                                           elem_id=elemid_prefix + "verbose",
                                           tooltip="Displays UmiAI log messages. Useful when prompt crafting, or debugging file-path errors.")
+                    unique_prompts = gr.Checkbox(label='Unique prompts in batch',
+                                                 value=False,
+                                                 elem_id=elemid_prefix + "unique-prompts",
+                                                 tooltip="Redraw prompts that were already generated in this batch, so no image is wasted on a duplicate.")
                     negative_prompt = gr.Checkbox(label='**negative keywords**', 
                                                   value=True,
                                                   elem_id=elemid_prefix + "negative-keywords", 
                                                   tooltip="Collect and add **negative keywords** from wildcards to Negative Prompts.")
                     ignore_folders = gr.Checkbox(label="Ignore folders", 
-                                                 value=False,
+                                                 value=True,
                                                  elem_id=elemid_prefix + "ignore-folders",
-                                                 tooltip="Ignore folder structure, will choose first file found if duplicate file names exist.")
+                                                 tooltip="Also find files in subfolders by their bare name; when names repeat, the file nearest the top folder is used.")
+                with gr.Row(elem_id=elemid_prefix + "profiling"):
+                    profile = gr.Checkbox(label="Profile generation",
+                                          value=False,
+                                          elem_id=elemid_prefix + "profile",
+                                          tooltip="Profile prompt generation with cProfile and write a .pstats file and a summary of the slowest functions to the profiles folder (DUOUMIWILD_PROFILE_DIR).")
+                    profile_memory = gr.Checkbox(label="Profile memory",
+                                                 value=False,
+                                                 elem_id=elemid_prefix + "profile-memory",
+                                                 tooltip="Also trace memory allocations while profiling (much slower).")
                                             
             with gr.Tab("Usage"):
                 gr.Markdown(UsageGuide)
 
         return [enabled, verbose, cache_files, ignore_folders, same_seed, negative_prompt, shared_seed,
+                unique_prompts, watch_files, profile, profile_memory,
                 ]
 
     def process(self, p, enabled, verbose, cache_files, ignore_folders, same_seed, negative_prompt,
-                shared_seed, *args):
+                shared_seed, unique_prompts=False, watch_files=False, profile=False, profile_memory=False, *args):
         if not enabled:
             return
 
@@ -1061,60 +1352,78 @@ class Script(scripts.Script):
             'verbose': verbose,
             'cache_files': cache_files,
             'ignore_folders': ignore_folders,
+            'watch_files': watch_files,
         }
-        prompt_generator = PromptGenerator(options)
 
-        for cur_count in range(p.n_iter):  #Batch count
-            for cur_batch in range(p.batch_size):  #Batch Size
+        # Profile the library load and the whole batch when asked (nothing is hooked otherwise)
+        with profiled(profile, 'a1111', memory=profile_memory, prefix='UmiAI'):
+            prompt_generator = PromptGenerator(options)
+            seen_prompts = PromptSeenSet(p.n_iter * p.batch_size) if unique_prompts and not same_seed else None
 
-                index = p.batch_size * cur_count + cur_batch
+            for cur_count in range(p.n_iter):  #Batch count
+                for cur_batch in range(p.batch_size):  #Batch Size
 
-                # pick same wildcard for a given seed
-                if (shared_seed):
-                    random.seed(p.all_seeds[p.batch_size *cur_count if same_seed else index])
-                else:
-                    random.seed(time.time()+index*10)
+                    index = p.batch_size * cur_count + cur_batch
+
+                    # pick same wildcard for a given seed
+                    if (shared_seed):
+                        seed = p.all_seeds[p.batch_size *cur_count if same_seed else index]
+                    else:
+                        seed = time.time()+index*10
+                    random.seed(seed)
                 
-                if debug: print(f'{"Batch #"+str(cur_count) if same_seed else "Prompt #"+str(index):=^30}')
+                    if debug: print(f'{"Batch #"+str(cur_count) if same_seed else "Prompt #"+str(index):=^30}')
 
-                prompt_generator.negative_tag_generator.negative_tag = set()
+                    prompt_generator.negative_tag_generator.reset()
 
-                prompt = prompt_generator.generate_single_prompt(original_prompt)
+                    prompt = prompt_generator.generate_single_prompt(original_prompt)
+
+                    # redraw duplicates with derived seeds, so the batch stays reproducible
+                    attempt = 0
+                    while seen_prompts is not None and not seen_prompts.add(prompt):
+                        if attempt == PromptSeenSet.max_retries:
+                            if verbose:
+                                print(f'UmiAI: No unique prompt after {attempt} redraws, keeping duplicate "{prompt}"')
+                            break
+                        attempt += 1
+                        random.seed(derive_seed(seed, attempt))
+                        prompt_generator.negative_tag_generator.reset()
+                        prompt = prompt_generator.generate_single_prompt(original_prompt)
                 
-                # Clean up any extra commas or whitespace in the final prompt
-                prompt = re.sub(r',\s*,', ',', prompt)  # Remove double commas
-                prompt = re.sub(r',\s*$', '', prompt)   # Remove trailing commas
-                prompt = re.sub(r'^\s*,\s*', '', prompt) # Remove leading commas
-                prompt = re.sub(r'\s+', ' ', prompt)    # Normalize whitespace
+                    # Clean up any extra commas or whitespace in the final prompt
+                    prompt = re.sub(r',\s*,', ',', prompt)  # Remove double commas
+                    prompt = re.sub(r',\s*$', '', prompt)   # Remove trailing commas
+                    prompt = re.sub(r'^\s*,\s*', '', prompt) # Remove leading commas
+                    prompt = re.sub(r'\s+', ' ', prompt)    # Normalize whitespace
                 
-                p.all_prompts[index] = prompt
-                if hr_fix_enabled:
-                    p.all_hr_prompts[index] = prompt
+                    p.all_prompts[index] = prompt
+                    if hr_fix_enabled:
+                        p.all_hr_prompts[index] = prompt
 
-                if debug: print(f'Prompt: "{prompt}"')
+                    if debug: print(f'Prompt: "{prompt}"')
 
-                negative = original_negative_prompt
-                if negative_prompt and hasattr(p, "all_negative_prompts"): # hasattr to fix crash on old webui versions
-                    neg_tags = prompt_generator.get_negative_tags()
-                    if neg_tags.strip():  # Only add if there are actual negative tags
-                        negative += (", " if negative.strip() else "") + neg_tags
+                    negative = original_negative_prompt
+                    if negative_prompt and hasattr(p, "all_negative_prompts"): # hasattr to fix crash on old webui versions
+                        neg_tags = prompt_generator.get_negative_tags()
+                        if neg_tags.strip():  # Only add if there are actual negative tags
+                            negative += (", " if negative.strip() else "") + neg_tags
                     
-                    # Clean up any extra commas or whitespace in the final negative prompt
-                    negative = re.sub(r',\s*,', ',', negative)  # Remove double commas
-                    negative = re.sub(r',\s*$', '', negative)   # Remove trailing commas
-                    negative = re.sub(r'^\s*,\s*', '', negative) # Remove leading commas
-                    negative = re.sub(r'\s+', ' ', negative)    # Normalize whitespace
+                        # Clean up any extra commas or whitespace in the final negative prompt
+                        negative = re.sub(r',\s*,', ',', negative)  # Remove double commas
+                        negative = re.sub(r',\s*$', '', negative)   # Remove trailing commas
+                        negative = re.sub(r'^\s*,\s*', '', negative) # Remove leading commas
+                        negative = re.sub(r'\s+', ' ', negative)    # Normalize whitespace
                     
-                    p.all_negative_prompts[index] = negative
-                    if hr_fix_enabled:
-                        p.all_hr_negative_prompts[index] = negative
-                    if debug: print(f'Negative: "{negative}\n"')
+                        p.all_negative_prompts[index] = negative
+                        if hr_fix_enabled:
+                            p.all_hr_negative_prompts[index] = negative
+                        if debug: print(f'Negative: "{negative}\n"')
 
-                # same prompt per batch
-                if (same_seed):
-                    for index, i in enumerate(p.all_prompts):
-                        p.all_prompts[index] = prompt
-                    break
+                    # same prompt per batch
+                    if (same_seed):
+                        for index, i in enumerate(p.all_prompts):
+                            p.all_prompts[index] = prompt
+                        break
 
         def find_sampler_index(sampler_list, value):
             for index, elem in enumerate(sampler_list):
@@ -1148,10 +1457,11 @@ class Script(scripts.Script):
                 p.extra_generation_params["File includes"] = "|".join(
                     TagLoader.files)
 
-from modules import sd_hijack
-path = os.path.join(scripts.basedir(), "embeddings")
-try:
-    sd_hijack.model_hijack.embedding_db.add_embedding_dir(path)
-except:
-    print("UmiAI: Failed to load embeddings. Your a1111 installation is ancient. Update it.")
-    pass
\ No newline at end of file
+if scripts is not None:
+    from modules import sd_hijack
+    path = os.path.join(scripts.basedir(), "embeddings")
+    try:
+        sd_hijack.model_hijack.embedding_db.add_embedding_dir(path)
+    except:
+        print("UmiAI: Failed to load embeddings. Your a1111 installation is ancient. Update it.")
+        pass
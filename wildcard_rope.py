@@ -0,0 +1,328 @@
+"""
+DuoUmiWild - Prompt Rope
+Holds a prompt being expanded as a list of fragments, each stamped with the
+step that produced it. An expansion step (one regex substitution) only scans
+windows around the fragments that changed since it last ran, and the prompt
+is joined once at the end, instead of every step copying and rescanning the
+whole prompt until it stops changing.
+
+The windows give exactly the matches a scan of the whole prompt would: each
+rule states which delimiters bound the text a match attempt can look at, and
+a window reaches back and forth to delimiters that no match can cross.
+"""
+
+from bisect import bisect_right
+
+
+class Delimited:
+    """
+    A substitution whose matches start with an opener and whose attempts stop at a closer.
+
+    Valid when an attempt at a position without an opener fails right there,
+    and an attempt at an opener looks no further than the end of the first
+    closer starting after that opener (e.g. `{...}` stops at the next brace).
+    """
+
+    def __init__(self, pattern, openers, closers, replays=True):
+        """
+        Args:
+            pattern: Compiled regex
+            openers: Strings a match can start with
+            closers: Strings that end what an attempt looks at
+            replays: Run a match again on the next pass when its replacement is
+                the matched text itself, as a scan of the whole prompt would
+                (for replacements with side effects, like random picks)
+        """
+        self.pattern = pattern
+        self.openers = openers
+        self.closers = closers
+        self.replays = replays
+        self.opener_length = max(map(len, openers))
+        self.closer_length = max(map(len, closers))
+
+    def rewind(self, rope, lo):
+        """Where to start scanning for changes at `lo`: no attempt before it looks at `lo` or later."""
+        closer = rope.rfind(self.closers, lo)
+        if closer >= 0:
+            return max(closer - self.opener_length + 1, 0)
+        opener = rope.find(self.openers, 0, lo + self.opener_length - 1)
+        return max(lo - self.opener_length + 1, 0) if opener < 0 else min(opener, lo)
+
+    def advance(self, rope, hi):
+        """Where to stop scanning for changes ending at `hi`: attempts before `hi` look no further."""
+        closer = rope.find(self.closers, hi + self.opener_length - 1)
+        return rope.length if closer < 0 else min(closer + self.closer_length, rope.length)
+
+
+class Spaced:
+    """
+    A whitespace cleanup (like `\\s+` or `,\\s*,`), whose attempts stop at the next non-space character.
+    """
+
+    replays = False
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def rewind(self, rope, lo):
+        return max(rope.rfind_nonspace(lo), 0)
+
+    def advance(self, rope, hi):
+        found = rope.find_nonspace(hi)
+        return rope.length if found < 0 else found + 1
+
+
+class Rope:
+    """
+    A prompt as stamped fragments.
+
+    `clock` goes up once per step that changed something; fragments carry the
+    clock value of the step that wrote them, and each rule remembers the
+    clock when it last ran, so the fragments newer than that are what it has
+    not seen yet.
+    """
+
+    __slots__ = ('parts', 'stamps', 'clock', 'scanned', 'offsets')
+
+    def __init__(self, text=''):
+        self.parts = [text]
+        self.stamps = [1]
+        self.clock = 1
+        self.scanned = {}  # rule -> clock when it last ran
+        self.offsets = None
+
+    def text(self):
+        return ''.join(self.parts)
+
+    __str__ = text
+
+    @property
+    def length(self):
+        return self.offsets[-1]
+
+    def index_parts(self):
+        offsets = [0]
+        for part in self.parts:
+            offsets.append(offsets[-1] + len(part))
+        self.offsets = offsets
+
+    def part_at(self, position):
+        """Index of the fragment holding `position`."""
+        return min(bisect_right(self.offsets, position) - 1, len(self.parts) - 1)
+
+    def slice(self, start, stop):
+        """The text between two positions."""
+        if start >= stop:
+            return ''
+        index = self.part_at(start)
+        offsets = self.offsets
+        if offsets[index + 1] >= stop:
+            return self.parts[index][start - offsets[index]:stop - offsets[index]]
+        pieces = [self.parts[index][start - offsets[index]:]]
+        index += 1
+        while offsets[index + 1] < stop:
+            pieces.append(self.parts[index])
+            index += 1
+        pieces.append(self.parts[index][:stop - offsets[index]])
+        return ''.join(pieces)
+
+    def rfind(self, needles, end):
+        """Start of the last occurrence of any needle ending at or before `end`, or -1."""
+        longest = max(map(len, needles))
+        offsets = self.offsets
+        index = self.part_at(max(end - 1, 0))
+        while index >= 0:
+            start = offsets[index]
+            part_end = min(offsets[index + 1], end)
+            found = -1
+            for needle in needles:
+                position = self.parts[index].rfind(needle, 0, part_end - start)
+                if position >= 0:
+                    found = max(found, start + position)
+            if longest > 1 and part_end < end:
+                # Occurrences starting here and ending in a later fragment
+                edge = max(part_end - longest + 1, start)
+                joint = self.slice(edge, min(part_end + longest - 1, end))
+                for needle in needles:
+                    position = joint.rfind(needle)
+                    if position >= 0 and edge + position < part_end:
+                        found = max(found, edge + position)
+            if found >= 0:
+                return found
+            index -= 1
+        return -1
+
+    def find(self, needles, start, end=None):
+        """Start of the first occurrence of any needle starting at or after `start` (and ending by `end`), or -1."""
+        end = self.length if end is None else min(end, self.length)
+        longest = max(map(len, needles))
+        offsets = self.offsets
+        index = self.part_at(max(start, 0))
+        while index < len(self.parts) and offsets[index] < end:
+            part_start = max(offsets[index], start)
+            part_end = min(offsets[index + 1], end)
+            found = -1
+            for needle in needles:
+                position = self.parts[index].find(needle, part_start - offsets[index], part_end - offsets[index])
+                if position >= 0 and (found < 0 or offsets[index] + position < found):
+                    found = offsets[index] + position
+            if longest > 1 and part_end < end:
+                edge = max(part_end - longest + 1, part_start)
+                joint = self.slice(edge, min(part_end + longest - 1, end))
+                for needle in needles:
+                    position = joint.find(needle)
+                    if position >= 0 and edge + position < part_end and (found < 0 or edge + position < found):
+                        found = edge + position
+            if found >= 0:
+                return found
+            index += 1
+        return -1
+
+    def rfind_nonspace(self, end):
+        """Position of the last non-whitespace character before `end`, or -1."""
+        index = self.part_at(max(end - 1, 0))
+        while index >= 0:
+            part = self.parts[index]
+            position = min(len(part), end - self.offsets[index])
+            while position > 0 and part[position - 1].isspace():
+                position -= 1
+            if position > 0:
+                return self.offsets[index] + position - 1
+            index -= 1
+        return -1
+
+    def find_nonspace(self, start):
+        """Position of the first non-whitespace character at or after `start`, or -1."""
+        index = self.part_at(start)
+        while index < len(self.parts):
+            part = self.parts[index]
+            position = max(start - self.offsets[index], 0)
+            while position < len(part) and part[position].isspace():
+                position += 1
+            if position < len(part):
+                return self.offsets[index] + position
+            index += 1
+        return -1
+
+    def changed_runs(self, since):
+        """(start, end) of each run of fragments written after clock value `since`."""
+        runs = []
+        offsets = self.offsets
+        stamps = self.stamps
+        index = 0
+        while index < len(stamps):
+            if stamps[index] > since:
+                first = index
+                while index + 1 < len(stamps) and stamps[index + 1] > since:
+                    index += 1
+                runs.append((offsets[first], offsets[index + 1]))
+            index += 1
+        return runs
+
+    def changed_since(self, since):
+        return any(stamp > since for stamp in self.stamps)
+
+    def windows(self, runs, rewind, advance):
+        """Merge the windows [rewind(start), advance(end)) of the changed runs."""
+        windows = []
+        for start, stop in sorted((rewind(start), advance(end)) for start, end in runs):
+            if windows and start < windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], stop)
+            else:
+                windows.append([start, stop])
+        return windows
+
+    def changed_text(self, since, margin):
+        """The text around the changes after `since`, `margin` characters each side, windows joined by NUL."""
+        self.index_parts()
+        runs = self.changed_runs(since)
+        windows = self.windows(runs, lambda start: max(start - margin, 0), lambda end: min(end + margin, self.length))
+        return '\0'.join(self.slice(start, stop) for start, stop in windows)
+
+    def sub(self, rule, replace):
+        """
+        Apply a rule's substitution to the text it has not scanned yet.
+
+        Args:
+            rule: Delimited or Spaced rule
+            replace: Function of a match returning its replacement
+
+        Returns:
+            int: Number of matches replaced by a different text
+        """
+        since = self.scanned.get(rule, 0)
+        self.scanned[rule] = self.clock
+        if not self.changed_since(since):
+            return 0
+        self.index_parts()
+        runs = self.changed_runs(since)
+        windows = self.windows(runs, lambda start: rule.rewind(self, start), lambda end: rule.advance(self, end))
+
+        # Replacements are computed left to right (the order of a full scan,
+        # which random picks depend on) and spliced in right to left
+        edits = []
+        changed = 0
+        for start, stop in windows:
+            for match in rule.pattern.finditer(self.slice(start, stop)):
+                replacement = replace(match)
+                if replacement == match.group(0):
+                    if not rule.replays:
+                        continue
+                else:
+                    changed += 1
+                edits.append((start + match.start(), start + match.end(), replacement))
+        if not edits:
+            return 0
+
+        self.clock += 1
+        for start, stop, replacement in reversed(edits):
+            self.splice(start, stop, replacement, self.clock)
+        return changed
+
+    def splice(self, start, stop, replacement, stamp):
+        """Replace text[start:stop] (positions from before any splice of this step, applied right to left)."""
+        offsets = self.offsets
+        first = self.part_at(start)
+        last = self.part_at(stop - 1) if stop > start else first
+        pieces = []
+        stamps = []
+        head = self.parts[first][:start - offsets[first]]
+        if head:
+            pieces.append(head)
+            stamps.append(self.stamps[first])
+        pieces.append(replacement)
+        stamps.append(stamp)
+        tail = self.parts[last][stop - offsets[last]:]
+        if tail:
+            pieces.append(tail)
+            stamps.append(self.stamps[last])
+        self.parts[first:last + 1] = pieces
+        self.stamps[first:last + 1] = stamps
+
+    def snapshot(self):
+        """The fragments as they are now (a list copy; fragments are immutable)."""
+        return list(self.parts)
+
+    def same_as(self, snapshot):
+        """Whether the text equals a snapshot's, comparing lengths before contents."""
+        if sum(map(len, snapshot)) != sum(map(len, self.parts)):
+            return False
+        return ''.join(snapshot) == self.text()
+
+    def prepend(self, text):
+        """Insert text at the start, as changed."""
+        self.clock += 1
+        self.parts.insert(0, text)
+        self.stamps.insert(0, self.clock)
+
+    def append(self, text):
+        """Add text at the end, as changed."""
+        self.clock += 1
+        self.parts.append(text)
+        self.stamps.append(self.clock)
+
+    def reset(self, text):
+        """Replace the whole text, as changed."""
+        self.clock += 1
+        self.parts = [text]
+        self.stamps = [self.clock]
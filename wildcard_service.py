@@ -0,0 +1,319 @@
+"""
+DuoUmiWild - Local Prompt Service
+Holds one loaded wildcard library for all the ComfyUI/A1111 workers of a
+machine and generates prompts for them over a Unix socket or a localhost port.
+
+Start the service:
+    python wildcard_service.py --socket /tmp/duoumiwild.sock
+    python wildcard_service.py --port 8765
+
+Then start the workers with DUOUMIWILD_SERVICE=unix:/tmp/duoumiwild.sock (or
+DUOUMIWILD_SERVICE=127.0.0.1:8765): WildcardNode and the A1111 PromptGenerator
+send their prompts to the service instead of loading the library themselves,
+and fall back to local generation if it cannot be reached.
+
+Protocol: one JSON object per line in each direction, several requests per
+connection allowed.
+    {"op": "generate", "engine": "node", "template": "...", "seeds": [1, 2],
+     "mode": "Random", "refresh": false}
+        -> {"ok": true, "results": ["prompt", "prompt"]}
+    {"op": "generate", "engine": "a1111", "template": "...", "seeds": [1]}
+        -> {"ok": true, "results": [{"prompt": ..., "negative_prompt": ..., "settings": {...}}]}
+    {"op": "ping"} -> {"ok": true, "engines": [...]}
+    {"op": "refresh"} -> {"ok": true}
+Errors are returned as {"ok": false, "error": "..."}.
+
+With --watch, edited wildcard files are picked up between requests without a
+"refresh": the engines drop only the files a background watcher saw change.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import select
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+SERVICE_ENV = 'DUOUMIWILD_SERVICE'
+ENGINES = ('node', 'a1111')
+
+# Longest request line accepted (a template plus a batch of seeds)
+MAX_LINE = 16 * 1024 * 1024
+
+
+def parse_address(address):
+    """
+    Split a service address into a socket family and address.
+
+    Args:
+        address: "unix:/path/to.sock", "host:port" or a bare port
+
+    Returns:
+        tuple: (socket family, path or (host, port))
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class ServiceClient:
+    """
+    Blocking client for the prompt service, used from inside the engines.
+
+    The connection is opened on first use and kept for the following calls,
+    one request at a time (calls from other threads wait for it). A kept
+    connection the service has closed is reopened before sending; a request
+    is resent only when sending it failed, never once it may have arrived.
+    """
+
+    timeout = 60
+
+    def __init__(self, address):
+        self.address = address
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        family, address = parse_address(self.address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(address)
+        except OSError:
+            self.close()
+            raise
+        self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def closed_by_service(self):
+        """Whether the kept connection was closed on the service side since the last request."""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable) and not self.sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def request(self, payload):
+        """
+        Send one request and wait for its response.
+
+        Raises:
+            OSError: The service cannot be reached
+            RuntimeError: The service returned an error
+        """
+        data = (json.dumps(payload) + "\n").encode('utf-8')
+        with self.lock:
+            if self.sock is not None and self.closed_by_service():
+                self.close()
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    self.sock.sendall(data)
+                    break
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+            try:
+                line = self.reader.readline()
+                if not line:
+                    raise ConnectionError("connection closed by the prompt service")
+            except OSError:
+                self.close()
+                raise
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise RuntimeError(f"DuoUmiWild: prompt service error: {response.get('error')}")
+        return response
+
+    def generate(self, template, seeds, engine='node', mode='Random', refresh=False):
+        """
+        Generate one prompt per seed on the service.
+
+        Args:
+            template: Template text
+            seeds: List of integer seeds
+            engine: 'node' (WildcardNode syntax) or 'a1111' (PromptGenerator)
+            mode: "Random" or "Enumerate" (node engine)
+            refresh: Reload the library before generating
+
+        Returns:
+            list: Prompts for the node engine, or records with prompt,
+                negative_prompt and settings for the a1111 engine
+        """
+        return self.request({
+            'op': 'generate',
+            'engine': engine,
+            'template': template,
+            'seeds': [int(seed) for seed in seeds],
+            'mode': mode,
+            'refresh': bool(refresh),
+        })['results']
+
+
+def connect_service(address=None):
+    """Return a client for the given address or $DUOUMIWILD_SERVICE, or None when neither is set."""
+    address = address or os.environ.get(SERVICE_ENV)
+    return ServiceClient(address) if address else None
+
+
+class PromptService:
+    """
+    The library held by the service, with one engine of each kind.
+
+    Engines are created on first use and keep their caches (loaded files,
+    parsed YAML, compiled Enumerate templates) between requests. Requests are
+    run one at a time on a worker thread, so the engines never see concurrent
+    calls while the event loop keeps accepting connections.
+    """
+
+    def __init__(self, wildcard_dir=None, verbose=False, watch=False):
+        self.wildcard_dir = wildcard_dir
+        self.verbose = verbose
+        self.watch = watch
+        self.engines = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # The engines created here must generate locally, not call a service
+        os.environ.pop(SERVICE_ENV, None)
+
+    def engine(self, name):
+        if name not in ENGINES:
+            raise ValueError(f"Unknown engine {name}, expected one of: {', '.join(ENGINES)}")
+        if name not in self.engines:
+            if name == 'node':
+                try:
+                    from .wildcard_node import WildcardNode
+                except ImportError:
+                    from wildcard_node import WildcardNode
+                node = WildcardNode()
+                if self.wildcard_dir:
+                    node.wildcard_dir = self.wildcard_dir
+                    node.refresh_file_cache()
+                self.engines[name] = node
+            else:
+                try:
+                    from .wildcard_cli import DEFAULT_WILDCARDS, init_worker
+                except ImportError:
+                    from wildcard_cli import DEFAULT_WILDCARDS, init_worker
+                # The A1111 engine lives in wildcard_cli's process-wide generator
+                wildcards = self.wildcard_dir or DEFAULT_WILDCARDS
+                init_worker(wildcards, {'verbose': self.verbose, 'watch_files': self.watch})
+                self.engines[name] = wildcards
+        return self.engines[name]
+
+    def generate(self, request):
+        engine = request.get('engine', 'node')
+        template = request['template']
+        seeds = request.get('seeds', [0])
+        refresh = request.get('refresh', False)
+        if refresh and engine == 'a1111':
+            self.engines.pop('a1111', None)
+        self.engine(engine)
+
+        if engine == 'node':
+            node = self.engines['node']
+            mode = request.get('mode', 'Random')
+            keep = "Watch" if self.watch else "No"
+            return [
+                node.process_wildcards(template, seed, "Yes" if refresh and index == 0 else keep, mode)["result"][0]
+                for index, seed in enumerate(seeds)
+            ]
+
+        try:
+            from .wildcard_cli import generate_record
+        except ImportError:
+            from wildcard_cli import generate_record
+        records = []
+        for seed in seeds:
+            record = generate_record((0, template, seed, ""))
+            records.append({key: record[key] for key in ('prompt', 'negative_prompt', 'settings')})
+        return records
+
+    def handle(self, request):
+        """Run one request on the worker thread and build its response."""
+        op = request.get('op')
+        if op == 'generate':
+            return {'ok': True, 'results': self.generate(request)}
+        if op == 'ping':
+            return {'ok': True, 'engines': sorted(self.engines), 'pid': os.getpid()}
+        if op == 'refresh':
+            self.engines.clear()
+            return {'ok': True}
+        return {'ok': False, 'error': f"Unknown op {op}"}
+
+    async def serve_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await loop.run_in_executor(self.executor, self.handle, request)
+                except Exception as e:
+                    response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, address):
+        """Start listening; returns the asyncio server."""
+        family, address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.unlink(address)  # stale socket of a previous run
+            return await asyncio.start_unix_server(self.serve_client, address, limit=MAX_LINE)
+        return await asyncio.start_server(self.serve_client, *address, limit=MAX_LINE)
+
+    async def serve(self, address, preload=ENGINES):
+        loop = asyncio.get_running_loop()
+        for name in preload:
+            await loop.run_in_executor(self.executor, self.engine, name)
+        server = await self.start(address)
+        print(f"DuoUmiWild: Prompt service listening on {address}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve prompts from one shared wildcards library.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--socket', help="Unix socket path")
+    target.add_argument('--port', type=int, help="TCP port on 127.0.0.1")
+    parser.add_argument('-w', '--wildcards', help="Wildcard directory (default: the wildcards folder next to this file)")
+    parser.add_argument('--watch', action='store_true', help="Reload wildcard files as they are edited")
+    parser.add_argument('--verbose', action='store_true', help="Print engine diagnostics")
+    args = parser.parse_args(argv)
+
+    address = f"unix:{args.socket}" if args.socket else f"127.0.0.1:{args.port}"
+    service = PromptService(args.wildcards and os.path.abspath(args.wildcards), args.verbose, args.watch)
+    try:
+        asyncio.run(service.serve(address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,555 @@
+"""
+DuoUmiWild - Shared Wildcard Library
+Compiles the wildcards library (lines, YAML entries, tag postings) into one
+flat segment that every worker process on the machine maps read-only,
+instead of each process parsing and holding its own copy.
+
+Build the segment, then point the workers at it with DUOUMIWILD_LIBRARY:
+    python wildcard_shared.py build /dev/shm/duoumiwild.lib
+        -> DUOUMIWILD_LIBRARY=/dev/shm/duoumiwild.lib (mmap'ed file)
+    python wildcard_shared.py serve duoumiwild
+        -> DUOUMIWILD_LIBRARY=shm:duoumiwild (multiprocessing.shared_memory,
+           kept alive until the command is stopped)
+
+A segment is only used while it matches the files on disk (same paths, sizes
+and modification times); after an edit the workers fall back to reading the
+files themselves until the segment is rebuilt.
+"""
+
+import argparse
+import atexit
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import signal
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Mapping, MutableMapping, Sequence
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # platforms without shared memory support
+    shared_memory = None
+
+try:
+    from .wildcard_entries import ENTRY_FIELDS, NONE_ID
+    from .wildcard_io import wildcard_stat
+    from .wildcard_service import SERVICE_ENV
+except ImportError:  # loaded outside the package
+    from wildcard_entries import ENTRY_FIELDS, NONE_ID
+    from wildcard_io import wildcard_stat
+    from wildcard_service import SERVICE_ENV
+
+
+LIBRARY_ENV = 'DUOUMIWILD_LIBRARY'
+MAGIC = b'DUOWLIB1'
+
+# Attached libraries by DUOUMIWILD_LIBRARY value, shared by all engines of the process
+_attached = {}
+
+
+def library_fingerprint(root, files):
+    """
+    Hash the paths, sizes and modification times of a set of wildcard files.
+
+    Args:
+        root: Wildcard directory
+        files: Iterable of file paths under root
+
+    Returns:
+        str: Hex digest, equal for unchanged files
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(files):
+        size, mtime = wildcard_stat(path)
+        digest.update(f"{os.path.relpath(path, root)}\0{size}\0{mtime}\n".encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+class SegmentWriter:
+    """Collects interned strings and uint32 sections, then packs them into one segment."""
+
+    def __init__(self):
+        self.string_ids = {}
+        self.strings = []
+        self.sections = {}
+
+    def intern(self, value):
+        if value is None:
+            return NONE_ID
+        value = str(value)
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def add(self, name, values, typecode='I'):
+        self.sections[name] = array(typecode, values)
+
+    def add_lists(self, name, lists):
+        """Store a list of string lists as CSR: `name` (ids) and `name_starts` (n + 1 offsets)."""
+        starts = [0]
+        ids = []
+        for values in lists:
+            ids.extend(self.intern(value) for value in values)
+            starts.append(len(ids))
+        self.add(name + '_starts', starts)
+        self.add(name, ids)
+
+    def pack(self, header):
+        encoded = [string.encode('utf-8', 'surrogatepass') for string in self.strings]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        self.add('string_offsets', offsets, 'Q')
+        self.sections['string_data'] = b''.join(encoded)
+
+        # Lay the sections out after the header, 8-byte aligned
+        layout = {}
+        position = 0
+        for name, section in self.sections.items():
+            data = section.tobytes() if isinstance(section, array) else section
+            layout[name] = (position, len(data), section.typecode if isinstance(section, array) else 'B')
+            position += (len(data) + 7) & ~7
+        header = dict(header, sections=layout, byteorder=sys.byteorder)
+        header_data = json.dumps(header).encode('utf-8')
+        base = (16 + len(header_data) + 7) & ~7
+
+        out = bytearray(base + position)
+        out[:8] = MAGIC
+        out[8:16] = struct.pack('<Q', len(header_data))
+        out[16:16 + len(header_data)] = header_data
+        for name, section in self.sections.items():
+            offset, length, _ = layout[name]
+            out[base + offset:base + offset + length] = section.tobytes() if isinstance(section, array) else section
+        return bytes(out)
+
+
+def compile_library(wildcard_dir=None):
+    """
+    Load a wildcards directory with the node's own parsing and compile it into a segment.
+
+    Args:
+        wildcard_dir: Wildcard directory (default: the node's)
+
+    Returns:
+        bytes: The segment
+    """
+    try:
+        from .wildcard_node import WildcardNode
+    except ImportError:
+        from wildcard_node import WildcardNode
+
+    # Parse the files themselves, not an existing segment or a prompt service
+    saved = {name: os.environ.pop(name) for name in (LIBRARY_ENV, SERVICE_ENV) if name in os.environ}
+    try:
+        node = WildcardNode()
+        if wildcard_dir:
+            node.wildcard_dir = wildcard_dir
+            node.refresh_file_cache()
+    finally:
+        os.environ.update(saved)
+    root = node.wildcard_dir
+    writer = SegmentWriter()
+
+    # Text files: every lookup key (relative path and basename) points at a file
+    txt_files = sorted(set(node.txt_relpath_to_path.values()))
+    file_index = {path: index for index, path in enumerate(txt_files)}
+    keys = {}
+    keys.update({key: file_index[path] for key, path in node.txt_basename_to_path.items()})
+    keys.update({key: file_index[path] for key, path in node.txt_relpath_to_path.items()})
+    writer.add_lists('file_lines', [
+        node.read_wildcard_file(os.path.relpath(path, root).replace('\\', '/').rsplit('.txt', 1)[0], False)
+        for path in txt_files
+    ])
+    key_names = sorted(keys)
+    writer.add('file_keys', [writer.intern(key) for key in key_names])
+    writer.add('file_key_files', [keys[key] for key in key_names])
+
+    # YAML entries, in load order, plus a by-title index
+    titles = list(node.yaml_entries)
+    writer.add('entry_titles', [writer.intern(title) for title in titles])
+    writer.add('title_order', sorted(range(len(titles)), key=lambda index: str(titles[index])))
+    for field in ENTRY_FIELDS:
+        writer.add_lists('entry_' + field, [node.yaml_entries[title][field] for title in titles])
+
+    # Tag postings: tag -> titles, as yaml_tags_to_entries
+    tags = sorted(node.yaml_tags_to_entries)
+    writer.add('posting_tags', [writer.intern(tag) for tag in tags])
+    writer.add_lists('postings', [node.yaml_tags_to_entries[tag] for tag in tags])
+
+    # Per-file tag postings for <file:[tag]>, keyed "scope\0tag"
+    scoped = sorted(
+        (f"{scope}\0{tag}", scope, tag)
+        for scope in node.yaml_entries.scopes
+        for tag in node.yaml_tags_to_entries.scoped(scope)
+    )
+    writer.add('scope_posting_keys', [writer.intern(key) for key, _, _ in scoped])
+    writer.add_lists('scope_postings', [node.yaml_tags_to_entries.scoped(scope)[tag] for _, scope, tag in scoped])
+
+    files = node.all_txt_files + node.all_yaml_files
+    return writer.pack({
+        'root': os.path.abspath(root),
+        'fingerprint': library_fingerprint(root, files),
+        'files': len(files),
+        'strings': len(writer.strings),
+    })
+
+
+class SharedLibrary:
+    """
+    A compiled library mapped read-only from a file or shared memory block.
+
+    Arrays are memoryviews over the mapping (no copy); strings are decoded
+    when they are read.
+    """
+
+    def __init__(self, buffer, keep_alive=None):
+        self.keep_alive = keep_alive
+        view = memoryview(buffer)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError("not a DuoUmiWild library segment")
+        (header_length,) = struct.unpack('<Q', view[8:16])
+        self.header = json.loads(bytes(view[16:16 + header_length]))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError("library segment was built on a machine with another byte order")
+        base = (16 + header_length + 7) & ~7
+        self.view = view
+        self.sections = {}
+        for name, (offset, length, typecode) in self.header['sections'].items():
+            section = view[base + offset:base + offset + length]
+            self.sections[name] = section.cast(typecode) if typecode != 'B' else section
+        self.string_offsets = self.sections['string_offsets']
+        self.string_data = self.sections['string_data']
+        self.titles = None
+
+    @property
+    def root(self):
+        return self.header['root']
+
+    def matches(self, files):
+        """Whether the segment was compiled from exactly these files."""
+        return self.header['fingerprint'] == library_fingerprint(self.root, files)
+
+    def string(self, string_id):
+        if string_id == NONE_ID:
+            return None
+        start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+        return str(self.string_data[start:end], 'utf-8', 'surrogatepass')
+
+    def strings(self, name, index):
+        """Decode row `index` of a CSR string list section."""
+        starts = self.sections[name + '_starts']
+        ids = self.sections[name][starts[index]:starts[index + 1]]
+        return [self.string(string_id) for string_id in ids]
+
+    def find(self, keys_section, key, order=None):
+        """Binary search a section of string ids sorted by string; returns the position or None."""
+        ids = self.sections[keys_section]
+        if order is not None:
+            order = self.sections[order]
+            names = SortedStrings(self, ids, order)
+        else:
+            names = SortedStrings(self, ids)
+        position = bisect.bisect_left(names, key)
+        if position < len(names) and names[position] == key:
+            return order[position] if order is not None else position
+        return None
+
+    def file_lines(self, name):
+        """Lines of a text file by lookup key (relative path or basename, lowercase), or None."""
+        position = self.find('file_keys', name)
+        if position is None:
+            return None
+        return SharedLines(self, self.sections['file_key_files'][position])
+
+    def entry(self, title):
+        """A YAML entry as the dict the node builds, or None."""
+        index = self.find('entry_titles', title, order='title_order')
+        if index is None:
+            return None
+        entry = {'title': self.string(self.sections['entry_titles'][index])}
+        for field in ENTRY_FIELDS:
+            entry[field] = self.strings('entry_' + field, index)
+        return entry
+
+    def entry_titles(self):
+        """All entry titles in load order (decoded once, then kept)."""
+        if self.titles is None:
+            self.titles = [self.string(string_id) for string_id in self.sections['entry_titles']]
+        return self.titles
+
+    def posting(self, tag, scope=None):
+        """Titles with a tag, in the whole library or in one YAML file's scope, or None."""
+        if scope is None:
+            position = self.find('posting_tags', tag)
+            return self.strings('postings', position) if position is not None else None
+        if 'scope_posting_keys' not in self.sections:
+            return None  # segment compiled before per-file postings existed
+        position = self.find('scope_posting_keys', f"{scope}\0{tag}")
+        return self.strings('scope_postings', position) if position is not None else None
+
+    def close(self):
+        for section in self.sections.values():
+            section.release()
+        self.view.release()
+        if self.keep_alive is not None:
+            self.keep_alive.close()
+
+
+class SortedStrings(Sequence):
+    """Decoded view of sorted string ids, for bisect."""
+
+    def __init__(self, library, ids, order=None):
+        self.library = library
+        self.ids = ids
+        self.order = order
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        index = self.order[position] if self.order is not None else position
+        return self.library.string(self.ids[index])
+
+
+class SharedLines(Sequence):
+    """The lines of one text file, read from the segment on access."""
+
+    def __init__(self, library, file_index):
+        starts = library.sections['file_lines_starts']
+        self.library = library
+        self.start = starts[file_index]
+        self.end = starts[file_index + 1]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        ids = self.library.sections['file_lines']
+        if isinstance(index, slice):
+            return [self.library.string(ids[self.start + i]) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.library.string(ids[self.start + index])
+
+
+class SharedFileCache(MutableMapping):
+    """
+    `loaded_tags` over a shared library: file name -> lines.
+
+    Files missing from the segment are read by the node as usual and kept in
+    a local overlay; clear() only drops that overlay.
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self.local = {}
+
+    def __getitem__(self, name):
+        if name in self.local:
+            return self.local[name]
+        lines = self.library.file_lines(name.lower().replace('\\', '/'))
+        if lines is None:
+            raise KeyError(name)
+        return lines
+
+    def __contains__(self, name):
+        return name in self.local or self.library.file_lines(name.lower().replace('\\', '/')) is not None
+
+    def __setitem__(self, name, lines):
+        self.local[name] = lines
+
+    def __delitem__(self, name):
+        del self.local[name]
+
+    def __iter__(self):
+        return iter(self.local)
+
+    def __len__(self):
+        return len(self.local)
+
+    def clear(self):
+        self.local.clear()
+
+
+class SharedEntries(Mapping):
+    """`yaml_entries` over a shared library: title -> entry dict, built on access."""
+
+    def __init__(self, library):
+        self.library = library
+
+    def __getitem__(self, title):
+        entry = self.library.entry(title)
+        if entry is None:
+            raise KeyError(title)
+        return entry
+
+    def __contains__(self, title):
+        return self.library.find('entry_titles', title, order='title_order') is not None
+
+    def __iter__(self):
+        return iter(self.library.entry_titles())
+
+    def __len__(self):
+        return len(self.library.sections['entry_titles'])
+
+
+class SharedPostings(Mapping):
+    """`yaml_tags_to_entries` over a shared library: tag -> titles, optionally of one YAML file."""
+
+    def __init__(self, library, scope=None):
+        self.library = library
+        self.scope = scope
+
+    def scoped(self, scope):
+        """The same mapping restricted to the entries of one scope."""
+        return SharedPostings(self.library, scope)
+
+    def __getitem__(self, tag):
+        titles = self.library.posting(tag, self.scope)
+        if titles is None:
+            raise KeyError(tag)
+        return titles
+
+    def __contains__(self, tag):
+        if self.scope is None:
+            return self.library.find('posting_tags', tag) is not None
+        return self.library.posting(tag, self.scope) is not None
+
+    def __iter__(self):
+        if self.scope is None:
+            return (self.library.string(string_id) for string_id in self.library.sections['posting_tags'])
+        prefix = self.scope + "\0"
+        keys = (self.library.string(string_id) for string_id in self.library.sections.get('scope_posting_keys', ()))
+        return (key[len(prefix):] for key in keys if key.startswith(prefix))
+
+    def __len__(self):
+        if self.scope is None:
+            return len(self.library.sections['posting_tags'])
+        return sum(1 for _ in self)
+
+
+@atexit.register
+def close_libraries():
+    """Unmap the attached libraries before the interpreter tears the mappings down."""
+    for library in _attached.values():
+        library.close()
+    _attached.clear()
+
+
+def open_library(location):
+    """
+    Map a compiled library.
+
+    Args:
+        location: File path, or "shm:NAME" for a shared memory block
+
+    Returns:
+        SharedLibrary
+    """
+    if location.startswith('shm:'):
+        if shared_memory is None:
+            raise OSError("shared memory is not supported on this platform")
+        name = location[len('shm:'):]
+        try:
+            block = shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+        except TypeError:
+            block = shared_memory.SharedMemory(name)
+            # Only the process that created the block may unlink it; the
+            # tracker knows POSIX blocks by their name with a leading slash
+            if os.name == 'posix':
+                resource_tracker.unregister('/' + block.name.lstrip('/'), 'shared_memory')
+        return SharedLibrary(block.buf, block)
+    with open(location, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return SharedLibrary(mapping, mapping)
+
+
+def attach_library(root, files, location=None):
+    """
+    Return the shared library for a wildcard directory if one is configured and current.
+
+    Args:
+        root: Wildcard directory of the engine
+        files: Wildcard files found under root
+        location: Library location (default: $DUOUMIWILD_LIBRARY)
+
+    Returns:
+        SharedLibrary or None
+    """
+    location = location or os.environ.get(LIBRARY_ENV)
+    if not location:
+        return None
+    library = _attached.get(location)
+    if library is None:
+        try:
+            library = _attached[location] = open_library(location)
+        except (OSError, ValueError) as e:
+            print(f"DuoUmiWild: Cannot open shared library {location}: {e}")
+            return None
+    if os.path.abspath(root) != library.root:
+        return None  # compiled for another wildcard directory
+    if not library.matches(files):
+        print(f"DuoUmiWild: Shared library {location} is out of date, loading wildcard files locally")
+        return None
+    return library
+
+
+def write_library(path, wildcard_dir=None):
+    """Compile a library into a file, replacing any previous one atomically."""
+    data = compile_library(wildcard_dir)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, path)
+    return len(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the wildcards library for sharing between processes.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Write the library to a file (map it with DUOUMIWILD_LIBRARY=PATH)")
+    build.add_argument('path')
+    serve = commands.add_parser('serve', help="Hold the library in shared memory (DUOUMIWILD_LIBRARY=shm:NAME)")
+    serve.add_argument('name')
+    for command in (build, serve):
+        command.add_argument('-w', '--wildcards', help="Wildcard directory (default: the wildcards folder next to this file)")
+    args = parser.parse_args(argv)
+    wildcard_dir = args.wildcards and os.path.abspath(args.wildcards)
+
+    if args.command == 'build':
+        size = write_library(args.path, wildcard_dir)
+        print(f"DuoUmiWild: Wrote {size} bytes to {args.path}", file=sys.stderr)
+        return 0
+
+    if shared_memory is None:
+        print("DuoUmiWild: shared memory is not supported on this platform", file=sys.stderr)
+        return 1
+    data = compile_library(wildcard_dir)
+    block = shared_memory.SharedMemory(args.name, create=True, size=len(data))
+    # Release the block on `kill` as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        block.buf[:len(data)] = data
+        print(f"DuoUmiWild: Holding {len(data)} bytes in shared memory as shm:{args.name}, Ctrl+C to release",
+              file=sys.stderr)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        block.close()
+        block.unlink()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,643 @@
+"""
+DuoUmiWild - Template Enumeration
+Walks the full combination space of a wildcard template instead of sampling it.
+"""
+
+import re
+from bisect import bisect_right
+from collections.abc import Sequence
+from fractions import Fraction
+
+try:
+    from .wildcard_recursive import DynamicPromptReplacer
+except ImportError:  # loaded outside the package (command line, A1111)
+    from wildcard_recursive import DynamicPromptReplacer
+
+
+# A leading "x$$" (or "x-y$$", "-y$$", "x-$$") on the first option of a {} group
+RANGE_PREFIX = re.compile(r'^(\d+-?\d*|-\d+)\$\$(.*)$', re.S)
+# A leading "x%" weight on an option that itself contains nested markers
+WEIGHT_PREFIX = re.compile(r'^(\d+)%(.*)$', re.S)
+
+
+class TextPart:
+    """Literal text, or a marker the enumerator leaves for the regular engine."""
+
+    __slots__ = ('text', 'count')
+
+    def __init__(self, text):
+        self.text = text
+        self.count = 1
+
+
+class PickPart:
+    """
+    A choice point: a {} group, or the lines of a wildcard file.
+
+    Options are parsed templates (lists of parts). A range-based pick selects
+    between `low` and `high` distinct options, like `{1-2$$a|b|c}`. `source`
+    names the file or group and `labels` keeps the option text, for reports.
+    """
+
+    __slots__ = ('options', 'weights', 'low', 'high', 'range_based',
+                 'source', 'labels', 'count', 'cumulative', 'subsets')
+
+    def __init__(self, options, weights=None, low=1, high=1, range_based=False,
+                 source=None, labels=None):
+        self.options = options
+        self.weights = weights or [0] * len(options)
+        self.low = low
+        self.high = high
+        self.range_based = range_based
+        self.source = source
+        self.labels = labels
+        self.count = None
+        self.cumulative = None
+        self.subsets = None
+
+
+class WildcardPart:
+    """A `__name__` or `__x-y$$name__` reference, bound to its file on first use."""
+
+    __slots__ = ('name', 'range_str', 'raw', 'target', 'count')
+
+    def __init__(self, name, range_str, raw):
+        self.name = name
+        self.range_str = range_str
+        self.raw = raw
+        self.target = None
+        self.count = None
+
+
+def find_marker_end(text, i):
+    """
+    Return the index just past a `<...>` or `__...__` marker starting at i.
+
+    Args:
+        text: Template text
+        i: Position to test
+
+    Returns:
+        int: End of the marker, or -1 if no complete marker starts at i
+    """
+    if text.startswith('__', i):
+        end = text.find('__', i + 2)
+        return end + 2 if end > i + 2 else -1
+    if text[i] == '<':
+        end = text.find('>', i + 1)
+        return end + 1 if end != -1 else -1
+    return -1
+
+
+def find_closing_brace(text, start):
+    """Return the index of the `}` matching the `{` at start, or -1."""
+    depth = 0
+    i = start
+    while i < len(text):
+        end = find_marker_end(text, i)
+        if end != -1:
+            i = end
+            continue
+        if text[i] == '{':
+            depth += 1
+        elif text[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+def split_options(content):
+    """Split the inside of a {} group on the `|` separators of its own level."""
+    options = []
+    depth = 0
+    begin = 0
+    i = 0
+    while i < len(content):
+        end = find_marker_end(content, i)
+        if end != -1:
+            i = end
+            continue
+        char = content[i]
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            options.append(content[begin:i])
+            begin = i + 1
+        i += 1
+    options.append(content[begin:])
+    return options
+
+
+class TemplateParser:
+    """
+    Parse wildcard templates into parts, with the variant rules of DynamicPromptReplacer.
+
+    `{}` groups (weights, `x$$` ranges, nesting) and plain or ranged `__file__`
+    references become choice points. YAML queries (`<[tag]>`, `<file:[tag]>`),
+    seeded groups (`__#1$$file__`) and dynamic file names are kept as literal
+    text so the regular engine can resolve them afterwards.
+    """
+
+    def __init__(self):
+        self.replacer = DynamicPromptReplacer()
+
+    def parse(self, text):
+        """
+        Parse a template string.
+
+        Args:
+            text: Template text
+
+        Returns:
+            list: Template parts (TextPart, PickPart, WildcardPart)
+        """
+        parts = []
+        literal = []
+        i = 0
+        while i < len(text):
+            if text[i] == '{':
+                end = find_closing_brace(text, i)
+                if end != -1:
+                    if literal:
+                        parts.append(TextPart(''.join(literal)))
+                        literal = []
+                    parts.append(self.parse_choice(text[i + 1:end]))
+                    i = end + 1
+                    continue
+            end = find_marker_end(text, i)
+            if end != -1:
+                part = self.parse_wildcard(text[i:end])
+                if isinstance(part, TextPart):
+                    literal.append(part.text)
+                else:
+                    if literal:
+                        parts.append(TextPart(''.join(literal)))
+                        literal = []
+                    parts.append(part)
+                i = end
+                continue
+            literal.append(text[i])
+            i += 1
+        if literal:
+            parts.append(TextPart(''.join(literal)))
+        return parts
+
+    def parse_choice(self, content):
+        """Parse the inside of a {} group into a PickPart."""
+        variants = [option.strip() for option in split_options(content)]
+        weights = []
+        for index, variant in enumerate(variants):
+            if '{' in variant or '__' in variant or '<' in variant:
+                # Nested markers may contain '%' themselves; only a leading weight counts
+                match = WEIGHT_PREFIX.match(variant)
+                weights.append(int(match.group(1)) if match else 0)
+                if match:
+                    variants[index] = match.group(2)
+            else:
+                weights.append(self.replacer.get_variant_weight(variant))
+                variants[index] = self.replacer.get_variant(variant)
+
+        low = high = 1
+        range_based = False
+        match = RANGE_PREFIX.match(variants[0])
+        if match:
+            range_based = True
+            variants[0] = match.group(2)
+            low, high = self.replacer.parse_range(match.group(1), len(variants))
+
+        options = [self.parse(variant) for variant in variants]
+        return PickPart(options, weights, max(0, low), min(high, len(options)), range_based,
+                        '{' + content + '}', variants)
+
+    def parse_wildcard(self, raw):
+        """Parse a `__...__` or `<...>` marker; anything not enumerable stays literal."""
+        if raw.startswith('<'):
+            return TextPart(raw)
+        content = raw[2:-2]
+        if content.startswith('#') or any(c in content for c in '{}<>[]:|'):
+            return TextPart(raw)
+        if '$$' in content:
+            range_str, name = content.split('$$', 1)
+            if not RANGE_PREFIX.match(range_str + '$$'):
+                return TextPart(raw)
+            return WildcardPart(name, range_str, raw)
+        return WildcardPart(content, None, raw)
+
+
+class PromptEnumerator:
+    """
+    Lazily enumerate every prompt a template can produce, in a fixed order.
+
+    Each combination has an index in `range(count(template))`; the first choice
+    point varies slowest and the last fastest, like `itertools.product`. Any
+    index is decoded directly, so a sweep can resume anywhere and runs in
+    constant memory no matter how large the space is.
+
+    Wildcard files are read through `load_lines(name)`, which should return the
+    list of lines of a file (for example `WildcardNode.read_wildcard_file` or
+    `TagLoader.load_tags`). Names that do not resolve to a list of lines, and
+    files that reference themselves, are left as literal markers.
+    """
+
+    def __init__(self, load_lines):
+        self.load_lines = load_lines
+        self.parser = TemplateParser()
+        self.templates = {}
+        self.file_options = {}
+        self.resolving = set()
+
+    def compile(self, template):
+        """
+        Parse a template and size its combination space.
+
+        Args:
+            template: Template text
+
+        Returns:
+            list: Template parts, with counts filled in
+        """
+        parts = self.templates.get(template)
+        if parts is None:
+            parts = self.parser.parse(template)
+            self.count_parts(parts)
+            self.templates[template] = parts
+        return parts
+
+    def count(self, template):
+        """
+        Count the distinct combinations of a template, without generating any.
+
+        Args:
+            template: Template text
+
+        Returns:
+            int: Exact number of combinations
+        """
+        return self.count_parts(self.compile(template))
+
+    def prompt_at(self, template, index):
+        """
+        Build the prompt for one combination index.
+
+        Args:
+            template: Template text
+            index: Combination index, 0 <= index < count(template)
+
+        Returns:
+            str: The prompt for that combination
+        """
+        parts = self.compile(template)
+        total = self.count_parts(parts)
+        if not 0 <= index < total:
+            raise IndexError(f"Combination {index} out of range for {total} combinations")
+        out = []
+        self.emit_parts(parts, index, out)
+        return clean_prompt(''.join(out))
+
+    def iter_prompts(self, template, start=0, stop=None):
+        """
+        Yield prompts for combination indexes start, start + 1, ... in order.
+
+        Args:
+            template: Template text
+            start: First combination index (resume point)
+            stop: Index to stop before, defaults to the total count
+
+        Yields:
+            str: One prompt per combination
+        """
+        parts = self.compile(template)
+        total = self.count_parts(parts)
+        stop = total if stop is None else min(stop, total)
+        for index in range(start, stop):
+            out = []
+            self.emit_parts(parts, index, out)
+            yield clean_prompt(''.join(out))
+
+    def file_pick(self, name):
+        """Return (lines, parsed lines) of a wildcard file, or None if it has none."""
+        if name not in self.file_options:
+            lines = self.load_lines(name)
+            if isinstance(lines, Sequence) and not isinstance(lines, str) and lines:
+                self.file_options[name] = (lines, [self.parser.parse(line) for line in lines])
+            else:
+                self.file_options[name] = None
+        return self.file_options[name]
+
+    def count_parts(self, parts):
+        total = 1
+        for part in parts:
+            total *= self.count_part(part)
+        return total
+
+    def count_part(self, part):
+        if part.count is not None:
+            return part.count
+        if isinstance(part, WildcardPart):
+            part.count = 1
+            if part.name.lower() in self.resolving:
+                return part.count  # self reference, keep the marker
+            loaded = self.file_pick(part.name)
+            if loaded is None:
+                return part.count
+            lines, options = loaded
+            if part.range_str is None:
+                part.target = PickPart(options, source=part.name, labels=lines)
+            else:
+                low, high = self.parser.replacer.parse_range(part.range_str, len(options))
+                part.target = PickPart(options, None, max(0, low), min(high, len(options)), True,
+                                       part.name, lines)
+            self.resolving.add(part.name.lower())
+            try:
+                part.count = self.count_part(part.target)
+            finally:
+                self.resolving.discard(part.name.lower())
+            return part.count
+
+        counts = [self.count_parts(option) for option in part.options]
+        if not part.range_based:
+            part.count = sum(counts)
+        else:
+            part.count = sum(elementary_symmetric(counts, part.high)[part.low:part.high + 1])
+        return part.count
+
+    def emit_parts(self, parts, index, out):
+        digits = []
+        for part in reversed(parts):
+            index, digit = divmod(index, part.count)
+            digits.append(digit)
+        for part, digit in zip(parts, reversed(digits)):
+            self.emit_part(part, digit, out)
+
+    def emit_part(self, part, index, out):
+        if isinstance(part, TextPart):
+            out.append(part.text)
+            return
+        if isinstance(part, WildcardPart):
+            if part.target is None:
+                out.append(part.raw)
+            else:
+                self.emit_part(part.target, index, out)
+            return
+
+        if not part.range_based:
+            if part.cumulative is None:
+                part.cumulative = running_totals(self.count_parts(option) for option in part.options)
+            option = bisect_right(part.cumulative, index)
+            if option:
+                index -= part.cumulative[option - 1]
+            self.emit_parts(part.options[option], index, out)
+            return
+
+        # Range pick: subsets by size, then in option order, then nested choices
+        if part.subsets is None:
+            part.subsets = suffix_elementary_symmetric(
+                [self.count_parts(option) for option in part.options], part.high)
+        table = part.subsets
+        size = part.low
+        while index >= table[0][size]:
+            index -= table[0][size]
+            size += 1
+
+        picked = []
+        for position, option in enumerate(part.options):
+            if size == 0:
+                break
+            option_count = self.count_parts(option)
+            block = option_count * table[position + 1][size - 1]
+            if index < block:
+                rest, sub_index = divmod(index, option_count)
+                piece = []
+                self.emit_parts(option, sub_index, piece)
+                text = ''.join(piece)
+                if text.strip():
+                    picked.append(text)
+                index = rest
+                size -= 1
+            else:
+                index -= block
+        out.append(", ".join(picked) + (", " if picked else ""))
+
+
+class TemplateAnalyzer:
+    """
+    Size a template's combination space and the selection rate of every option.
+
+    Everything is computed from the parsed template and the wildcard library;
+    no prompt is generated, so templates with astronomically large spaces are
+    analyzed as quickly as small ones. Counts are exact integers and rates are
+    exact fractions.
+
+    Selection follows the DynamicPromptReplacer rules: `{x%a|...}` weights,
+    with unweighted options sharing the remaining percentage, and `x-y$$`
+    ranges picking a uniform number of options, drawn one at a time without
+    replacement. Wildcard file lines are picked uniformly.
+    """
+
+    # Weighted range picks are solved exactly over partial selections; past this
+    # many states the rate falls back to an estimate and the report says so.
+    max_subset_states = 200000
+
+    def __init__(self, enumerator):
+        self.enumerator = enumerator
+        self.file_profiles = {}
+        self.texts = {}
+        self.exact = True
+
+    def analyze(self, template):
+        """
+        Analyze a template.
+
+        Args:
+            template: Template text
+
+        Returns:
+            dict: 'combinations' (int), 'choice_points' (int), 'exact' (bool) and
+                'leaves', a list of dicts with 'source', 'index', 'text' and
+                'probability' (Fraction, the expected number of times the option is
+                selected per prompt; the plain probability when it can only be
+                picked once)
+        """
+        self.exact = True
+        parts = self.enumerator.compile(template)
+        profile = self.profile_parts(parts)
+        leaves = [
+            {'source': source, 'index': index, 'text': self.texts[(source, index)], 'probability': rate}
+            for (source, index), rate in profile.items()
+        ]
+        return {
+            'combinations': self.enumerator.count_parts(parts),
+            'choice_points': len({source for source, _ in profile}),
+            'exact': self.exact,
+            'leaves': leaves,
+        }
+
+    def profile_parts(self, parts):
+        totals = {}
+        for part in parts:
+            for key, rate in self.profile_part(part).items():
+                totals[key] = totals.get(key, 0) + rate
+        return totals
+
+    def profile_part(self, part):
+        if isinstance(part, TextPart):
+            return {}
+        if isinstance(part, WildcardPart):
+            if part.target is None:
+                return {}
+            # A file reached from many places is only walked once
+            key = (part.name.lower(), part.range_str)
+            if key not in self.file_profiles:
+                self.file_profiles[key] = self.profile_part(part.target)
+            return self.file_profiles[key]
+
+        totals = {}
+        for index, rate in enumerate(self.option_probabilities(part)):
+            key = (part.source, index)
+            self.texts[key] = part.labels[index] if part.labels else ''
+            totals[key] = totals.get(key, 0) + rate
+            if rate:
+                for nested, nested_rate in self.profile_parts(part.options[index]).items():
+                    totals[nested] = totals.get(nested, 0) + rate * nested_rate
+        return totals
+
+    def option_probabilities(self, part):
+        """
+        Selection rate of each option of a choice point.
+
+        Args:
+            part: PickPart
+
+        Returns:
+            list: Fraction per option
+        """
+        count = len(part.options)
+        weights = effective_weights(part)
+        if not sum(weights):
+            return [Fraction(0)] * count
+
+        sizes = range(part.low, part.high + 1) if part.range_based else range(1, 2)
+        if len(set(weights)) == 1:
+            # Uniform draws: every option is equally likely to be in the subset
+            mean_size = Fraction(sum(min(size, count) for size in sizes), len(sizes))
+            return [mean_size / count] * count
+        if not part.range_based:
+            total = sum(weights)
+            return [weight / total for weight in weights]
+
+        included = self.weighted_inclusion(weights, max(sizes))
+        return [sum(included[size][index] for size in sizes) / len(sizes) for index in range(count)]
+
+    def weighted_inclusion(self, weights, max_size):
+        """
+        P(option i is among the first k weighted draws without replacement).
+
+        Args:
+            weights: Option weights
+            max_size: Largest number of draws
+
+        Returns:
+            list: included[k][i] for k = 0..max_size
+        """
+        count = len(weights)
+        total = sum(weights)
+        included = [[Fraction(0)] * count]
+        states = {0: Fraction(1)}
+        for _ in range(max_size):
+            row = list(included[-1])
+            if len(states) * count > self.max_subset_states:
+                # Too many partial selections: estimate with proportional inclusion
+                self.exact = False
+                drawn = len(included)
+                row = [min(Fraction(1), drawn * weight / total) for weight in weights]
+                included.append(row)
+                continue
+            next_states = {}
+            for mask, probability in states.items():
+                remaining = total - sum(weights[i] for i in range(count) if mask >> i & 1)
+                if remaining <= 0:
+                    next_states[mask] = next_states.get(mask, 0) + probability
+                    continue
+                for i in range(count):
+                    if mask >> i & 1 or not weights[i]:
+                        continue
+                    step = probability * weights[i] / remaining
+                    row[i] += step
+                    next_states[mask | 1 << i] = next_states.get(mask | 1 << i, 0) + step
+            states = next_states
+            included.append(row)
+        return included
+
+
+def effective_weights(part):
+    """
+    Draw weights of a choice point's options, as DynamicPromptReplacer applies them.
+
+    Unweighted options share what the `x%` weights leave of 100; weights that
+    end up negative count as 0.
+
+    Args:
+        part: PickPart
+
+    Returns:
+        list: Fraction per option
+    """
+    weights = [Fraction(weight) for weight in part.weights]
+    summed = sum(weights)
+    zero_weights = weights.count(0)
+    if zero_weights:
+        weights = [(100 - summed) / zero_weights if weight == 0 else weight for weight in weights]
+    return [max(weight, Fraction(0)) for weight in weights]
+
+
+def running_totals(values):
+    totals = []
+    total = 0
+    for value in values:
+        total += value
+        totals.append(total)
+    return totals
+
+
+def elementary_symmetric(counts, max_size):
+    """
+    Number of ways to pick k distinct options for every k <= max_size.
+
+    Args:
+        counts: Combination count of each option
+        max_size: Largest subset size needed
+
+    Returns:
+        list: e[k] = sum over k-option subsets of the product of their counts
+    """
+    totals = [1] + [0] * max_size
+    for count in counts:
+        for size in range(max_size, 0, -1):
+            totals[size] += totals[size - 1] * count
+    return totals
+
+
+def suffix_elementary_symmetric(counts, max_size):
+    """Elementary symmetric sums of every suffix of counts, used to decode subsets."""
+    table = [None] * (len(counts) + 1)
+    table[len(counts)] = [1] + [0] * max_size
+    for position in range(len(counts) - 1, -1, -1):
+        after = table[position + 1]
+        row = list(after)
+        for size in range(1, max_size + 1):
+            row[size] += after[size - 1] * counts[position]
+        table[position] = row
+    return table
+
+
+def clean_prompt(prompt):
+    """Apply the same comma and whitespace cleanup as PromptGenerator."""
+    prompt = re.sub(r',\s*,', ',', prompt)  # Remove double commas
+    prompt = re.sub(r',\s*$', '', prompt)   # Remove trailing commas
+    prompt = re.sub(r'^\s*,\s*', '', prompt)  # Remove leading commas
+    prompt = re.sub(r'\s+', ' ', prompt)    # Normalize whitespace
+    return prompt.strip()
@@ -0,0 +1,345 @@
+"""
+DuoUmiWild - Wildcard File Watcher
+Watches a wildcards directory from a background thread and records which files
+were added, modified or removed, so the engines can keep their caches and only
+drop the entries of edited files, without touching the filesystem per prompt.
+
+On Linux the thread sleeps on inotify events; elsewhere (or when inotify is not
+usable) it polls: directories are only re-listed when their mtime changes, and
+the known files are compared by size and mtime.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+try:
+    from .wildcard_io import PACK_EXTENSIONS, strip_compression, wildcard_kind
+except ImportError:  # loaded outside the package
+    from wildcard_io import PACK_EXTENSIONS, strip_compression, wildcard_kind
+
+
+# inotify(7) event flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK if hasattr(os, 'O_NONBLOCK') else 0
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Change batches kept for consumers that check in late; one further behind
+# gets None from changes() and reloads everything
+MAX_LOG = 64
+
+# Running watchers by wildcard directory, shared by all engines of the process
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def is_watched(path):
+    """Whether a file name is a wildcard file or a wildcard pack."""
+    return wildcard_kind(path) is not None or path.lower().endswith(PACK_EXTENSIONS)
+
+
+class Inotify:
+    """Minimal inotify wrapper over libc, one watch per directory."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        """
+        Wait for events.
+
+        Returns:
+            set: Directories with events, or None on a queue overflow (rescan all)
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        dirty = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                directory = self.directories.pop(wd, None)
+            else:
+                directory = self.directories.get(wd)
+            if directory is not None:
+                dirty.add(directory)
+        return dirty
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """
+    Tracks the wildcard files under a directory and numbers each batch of changes.
+
+    `version` goes up by one for every batch. A consumer remembers the version
+    its caches were built at and, when it differs, asks changes() for what
+    happened since; comparing the two numbers is the only cost when nothing
+    changed.
+    """
+
+    interval = 1.0
+    # Wait this long after an inotify event for the rest of an editor's save
+    settle = 0.05
+
+    def __init__(self, root, interval=None, use_inotify=True):
+        self.root = root
+        if interval is not None:
+            self.interval = interval
+        self.version = 0
+        self.log = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # Directory -> (mtime_ns, file paths, subdirectories); file -> (size, mtime_ns)
+        self.listings = {}
+        self.files = {}
+
+        self.inotify = None
+        if use_inotify and hasattr(select, 'select') and os.name == 'posix':
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError, TypeError):
+                self.inotify = None
+
+        self.scan(root, {})
+        self.thread = threading.Thread(target=self.run, name=f"DuoUmiWild watcher {root}", daemon=True)
+        self.thread.start()
+
+    @property
+    def backend(self):
+        return 'inotify' if self.inotify is not None else 'polling'
+
+    def forget(self, directory, changes):
+        """Drop a directory that disappeared, reporting its files as removed."""
+        listing = self.listings.pop(directory, None)
+        if listing is None:
+            return
+        _, files, subdirs = listing
+        for path in files:
+            if self.files.pop(path, None) is not None:
+                changes[path] = 'removed'
+        for subdir in subdirs:
+            self.forget(subdir, changes)
+
+    def scan(self, directory, changes, relist=True):
+        """
+        Bring one directory up to date, recording file events in `changes`.
+
+        Args:
+            directory: Directory path
+            changes: dict path -> 'added' | 'modified' | 'removed', filled in place
+            relist: Re-read the directory listing; False only compares the known files
+        """
+        listing = self.listings.get(directory)
+        if relist or listing is None:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                entries = list(os.scandir(directory))
+            except OSError:
+                self.forget(directory, changes)
+                return
+            files, subdirs = set(), set()
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue  # hidden, like the glob that finds the wildcard files
+                try:
+                    if entry.is_dir():
+                        subdirs.add(entry.path)
+                    elif is_watched(entry.name):
+                        files.add(entry.path)
+                except OSError:
+                    continue
+            if listing is not None:
+                for path in listing[1] - files:
+                    self.files.pop(path, None)
+                    changes[path] = 'removed'
+                for subdir in listing[2] - subdirs:
+                    self.forget(subdir, changes)
+            else:
+                listing = (mtime, set(), set())
+            self.listings[directory] = (mtime, files, subdirs)
+            if self.inotify is not None:
+                self.inotify.add(directory)
+            for subdir in subdirs - listing[2]:
+                self.scan(subdir, changes)
+        else:
+            files = listing[1]
+
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed meanwhile; the next listing reports it
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self.files.get(path)
+            if previous != signature:
+                self.files[path] = signature
+                if previous is None:
+                    changes[path] = 'added'
+                elif changes.get(path) not in ('added', 'removed'):
+                    changes[path] = 'modified'
+
+    def poll(self):
+        """Check every directory once: re-list those whose mtime changed, stat their files."""
+        changes = {}
+        for directory in list(self.listings):
+            if directory not in self.listings:
+                continue  # forgotten along with its parent
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self.forget(directory, changes)
+                continue
+            self.scan(directory, changes, relist=mtime != self.listings[directory][0])
+        return changes
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.inotify is None:
+                if self.stopped.wait(self.interval):
+                    break
+                changes = self.poll()
+            else:
+                try:
+                    dirty = self.inotify.wait(self.interval)
+                except OSError as e:
+                    print(f"DuoUmiWild: File watcher falling back to polling: {e}")
+                    self.inotify.close()
+                    self.inotify = None
+                    continue
+                if dirty is not None and not dirty:
+                    continue
+                self.stopped.wait(self.settle)
+                if dirty is None:
+                    changes = self.poll()
+                else:
+                    changes = {}
+                    more = self.inotify.wait(0)
+                    dirty = set(self.listings) if more is None else dirty | more
+                    for directory in dirty:
+                        if directory in self.listings:
+                            self.scan(directory, changes)
+            if changes:
+                self.publish(changes)
+
+    def publish(self, changes):
+        with self.lock:
+            self.version += 1
+            self.log.append((self.version, changes))
+            del self.log[:-MAX_LOG]
+
+    def changes(self, since):
+        """
+        Collect what changed after a version.
+
+        Args:
+            since: Version the caller's caches were built at
+
+        Returns:
+            tuple: (current version, dict path -> 'added' | 'modified' | 'removed'),
+                the dict being None when the changes are no longer all recorded
+        """
+        with self.lock:
+            version = self.version
+            if since == version:
+                return version, {}
+            if not self.log or self.log[0][0] > since + 1:
+                return version, None
+            merged = {}
+            for batch_version, batch in self.log:
+                if batch_version <= since:
+                    continue
+                for path, event in batch.items():
+                    # Additions and removals change the file list; keep them
+                    # over later modifications
+                    if event != 'modified' or path not in merged:
+                        merged[path] = event
+            return version, merged
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def watch_library(root):
+    """Return the running watcher of a wildcard directory, starting it on first use."""
+    root = os.path.abspath(root)
+    with _watchers_lock:
+        watcher = _watchers.get(root)
+        if watcher is None:
+            watcher = _watchers[root] = LibraryWatcher(root)
+        return watcher
+
+
+def stop_watchers():
+    """Stop all running watchers."""
+    with _watchers_lock:
+        for watcher in _watchers.values():
+            watcher.stop()
+        _watchers.clear()
+
+
+def classify_changes(changes):
+    """
+    Sort a change set by what a cache has to do about it.
+
+    Args:
+        changes: dict from LibraryWatcher.changes(), or None
+
+    Returns:
+        tuple: (rescan, txt_paths, yaml_paths): rescan is True when the file
+            list changed (or is unknown) and the lookups must be rebuilt;
+            txt_paths and yaml_paths hold the modified files, each both as
+            found and without its .gz/.zst suffix
+    """
+    if changes is None:
+        return True, set(), set()
+    rescan = False
+    txt_paths = set()
+    yaml_paths = set()
+    for path, event in changes.items():
+        if event != 'modified' or path.lower().endswith(PACK_EXTENSIONS):
+            rescan = True
+            continue
+        paths = txt_paths if wildcard_kind(path) == '.txt' else yaml_paths
+        paths.add(path)
+        paths.add(strip_compression(path))
+    return rescan, txt_paths, yaml_paths
@@ -0,0 +1,234 @@
+"""
+DuoUmiWild - YAML Parsing
+Loads wildcard YAML files with libyaml's CSafeLoader when PyYAML was built
+with it, and tries a line parser for the layout wildcard files use first:
+
+    Title:
+      Tags:
+        - tag
+      Prompts:
+        - 'prompt'
+      Description: text
+
+that is, a mapping of titles to mappings of keys to single-line scalars or
+block lists of single-line scalars. Anything else (flow collections, block
+or multi-line scalars, anchors, tags, tabs, ...) makes it give up, and the
+whole file is parsed by PyYAML, so both paths give the same data. Set
+DUOUMIWILD_FAST_YAML=0 to always use PyYAML.
+"""
+
+import os
+import re
+
+import yaml
+
+
+FAST_ENV = 'DUOUMIWILD_FAST_YAML'
+
+# libyaml's loader when available (same results, several times faster)
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+STR_TAG = 'tag:yaml.org,2002:str'
+
+# What makes the line parser give up on a whole file: characters PyYAML
+# rejects or treats as line breaks, and tabs (indentation rules)
+UNSUPPORTED_TEXT = re.compile(yaml.reader.Reader.NON_PRINTABLE.pattern + '|[\\t\\r\\x85\\u2028\\u2029]')
+# Characters a plain (unquoted) scalar cannot start with
+INDICATORS = frozenset(',[]{}#&*!|>\'"%@`')
+SINGLE_QUOTED = re.compile(r"'((?:[^']|'')*)'")
+DOUBLE_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+# PyYAML's implicit types (null, bool, int, float, timestamp, ...) by first character
+_resolvers = yaml.SafeLoader.yaml_implicit_resolvers
+
+
+class Unsupported(Exception):
+    """Raised by the line parser on YAML it does not handle."""
+
+
+def fast_yaml_enabled():
+    """Whether the line parser is tried (DUOUMIWILD_FAST_YAML is not off)."""
+    return os.environ.get(FAST_ENV, '').strip().lower() not in ('0', 'no', 'false', 'off')
+
+
+def load_yaml(file):
+    """
+    Parse a YAML wildcard file.
+
+    Args:
+        file: Text file object (e.g. from open_wildcard)
+
+    Returns:
+        object: The document, as yaml.safe_load returns it
+
+    Raises:
+        yaml.YAMLError: As yaml.safe_load
+    """
+    text = file.read()
+    if fast_yaml_enabled():
+        try:
+            return parse_entries(text)
+        except Unsupported:
+            pass
+    return yaml.load(text, Loader=SafeLoader)
+
+
+def plain_scalar(text):
+    """The value of a plain scalar, with PyYAML's implicit types."""
+    for tag, regexp in _resolvers.get(text[0], ()):
+        if regexp.match(text):
+            if tag == STR_TAG:
+                return text
+            try:
+                return yaml.load(text, Loader=SafeLoader)
+            except yaml.YAMLError:
+                raise Unsupported(text)
+    return text
+
+
+def quoted_scalar(text):
+    """
+    Read a quoted scalar at the start of text.
+
+    Returns:
+        tuple: (value, rest of the text after the closing quote)
+    """
+    if text[0] == "'":
+        match = SINGLE_QUOTED.match(text)
+        if match is None:
+            raise Unsupported(text)
+        return match.group(1).replace("''", "'"), text[match.end():]
+    match = DOUBLE_QUOTED.match(text)
+    if match is None:
+        raise Unsupported(text)
+    value = match.group(1)
+    if '\\' in value:
+        try:
+            value = yaml.load(match.group(0), Loader=SafeLoader)
+        except yaml.YAMLError:
+            raise Unsupported(text)
+    return value, text[match.end():]
+
+
+def is_empty(text):
+    """Whether the text after a key or a `-` holds no value (nothing, or only a comment)."""
+    text = text.lstrip(' ')
+    return not text or text[0] == '#'
+
+
+def scalar(text):
+    """The value of a scalar written on one line (None when empty or a comment)."""
+    if is_empty(text):
+        return None
+    text = text.strip(' ')
+    if text[0] in '\'"':
+        value, rest = quoted_scalar(text)
+        if rest and (rest[0] != ' ' or not rest.lstrip(' ').startswith('#')):
+            raise Unsupported(text)
+        return value
+    return plain_scalar(plain_text(text))
+
+
+def plain_text(text):
+    """The text of a plain scalar, without a trailing comment."""
+    if text[0] in INDICATORS or (text[0] in '-?:' and (len(text) == 1 or text[1] == ' ')):
+        raise Unsupported(text)
+    comment = text.find(' #')
+    if comment >= 0:
+        text = text[:comment].rstrip(' ')
+    if ': ' in text or text.endswith(':'):
+        raise Unsupported(text)
+    return text
+
+
+def split_key(text):
+    """
+    Split a `key: value` line.
+
+    Returns:
+        tuple: (key, text after the colon)
+    """
+    if text[0] in '\'"':
+        key, rest = quoted_scalar(text)
+        rest = rest.lstrip(' ')
+        if not rest.startswith(':') or (len(rest) > 1 and rest[1] != ' '):
+            raise Unsupported(text)
+        return key, rest[1:]
+    colon = text.find(': ')
+    if colon < 0:
+        if not text.endswith(':'):
+            raise Unsupported(text)
+        colon = len(text) - 1
+    key = text[:colon].rstrip(' ')
+    if not key or plain_text(key) != key or plain_scalar(key) is not key:
+        raise Unsupported(text)
+    return key, text[colon + 1:]
+
+
+def parse_entries(text):
+    """
+    Parse wildcard YAML laid out as titles -> keys -> scalars or lists of scalars.
+
+    Args:
+        text: YAML text
+
+    Returns:
+        object: The same as yaml.safe_load(text)
+
+    Raises:
+        Unsupported: The text uses YAML this parser does not handle
+    """
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    if UNSUPPORTED_TEXT.search(text):
+        raise Unsupported('characters')
+
+    data = {}
+    entry = None  # Mapping of the current title, once it has a key
+    title = None  # Current title, while its value is still open
+    key_indent = None
+    key = None  # Key of the current entry whose list is open
+    items = None
+    item_indent = None
+
+    for line in text.split('\n'):
+        stripped = line.lstrip(' ')
+        if not stripped or stripped[0] == '#':
+            continue
+        indent = len(line) - len(stripped)
+        stripped = stripped.rstrip(' ')
+
+        if indent == 0:
+            if stripped.startswith(('---', '...')):
+                raise Unsupported(line)
+            title, rest = split_key(stripped)
+            data[title] = scalar(rest)
+            if not is_empty(rest):
+                title = None
+            entry = key = items = None
+            key_indent = item_indent = None
+            continue
+        if title is None:
+            raise Unsupported(line)
+
+        if key is not None and stripped[0] == '-' and (len(stripped) == 1 or stripped[1] == ' ') and (
+                indent == item_indent or (item_indent is None and indent >= key_indent)):
+            # A list item of the open key
+            if items is None:
+                items = entry[key] = []
+                item_indent = indent
+            items.append(scalar(stripped[1:]))
+            continue
+
+        if indent != (key_indent if key_indent is not None else indent):
+            raise Unsupported(line)
+        if entry is None:
+            entry = data[title] = {}
+            key_indent = indent
+        key, rest = split_key(stripped)
+        entry[key] = scalar(rest)
+        if not is_empty(rest):
+            key = None
+        items = item_indent = None
+
+    return data or None